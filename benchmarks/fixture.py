@@ -0,0 +1,194 @@
+import random
+import uuid
+from dataclasses import dataclass, field
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from citi_mesh.database import _tables
+from citi_mesh.database._base import SQLTable
+from citi_mesh.database._models import Address, Repository, Resource, ResourceType, Tenant
+
+"""
+File contains a seeded SQLite database of a realistic size, shared by the benchmarks. The same
+seed and sizes always build the same rows, with the same ids, so results can be compared
+between commits
+"""
+
+_STREETS = ["Broadway", "Atlantic Avenue", "Grand Concourse", "Fulton Street", "Main Street"]
+_CITIES = [("New York", "NY", "100"), ("Brooklyn", "NY", "112"), ("Bronx", "NY", "104")]
+_RESOURCE_TYPES = [
+    "Shelter",
+    "Food Pantry",
+    "Soup Kitchen",
+    "Health Clinic",
+    "Mental Health",
+    "Legal Aid",
+    "Job Training",
+    "Child Care",
+    "Senior Center",
+    "Youth Program",
+    "Library",
+    "Laundry",
+    "Showers",
+    "Benefits Enrollment",
+    "Harm Reduction",
+    "Veterans Services",
+]
+_WORDS = (
+    "free walk in services for residents open daily including weekends with staff who speak "
+    "english spanish and mandarin no appointment or identification needed bring proof of "
+    "address if you have it case managers can help with housing applications and referrals"
+).split()
+
+
+@dataclass
+class Fixture:
+    """
+    A seeded database, along with the models loaded from it
+
+    Attributes:
+        - engine(AsyncEngine): The engine of the database
+        - session_maker(async_sessionmaker): Makes sessions on the database
+        - tenant(Tenant): The single tenant
+        - repositories(list[Repository]): Every repository, with their resource types
+        - resources(list[Resource]): Every resource, with their address and resource types
+    """
+
+    engine: AsyncEngine
+    session_maker: async_sessionmaker
+    tenant: Tenant
+    repositories: list[Repository] = field(default_factory=list)
+    resources: list[Resource] = field(default_factory=list)
+
+    async def dispose(self):
+        await self.engine.dispose()
+
+
+def _sentence(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(low, high))).capitalize()
+
+
+async def build_fixture(
+    path: str,
+    seed: int = 0,
+    resources: int = 5000,
+    repositories: int = 4,
+    resource_types: int = 12,
+) -> Fixture:
+    """
+    Creates a SQLite database at 'path', filled with seeded data
+
+    args:
+        - path(str): Where to create the database, should not exist yet
+        - seed(int): Seeds every generated value, including the ids
+        - resources(int): The number of resources, split evenly between repositories. Most
+            have an address and one to three resource types
+        - repositories(int): The number of repositories
+        - resource_types(int): The number of resource types in each repository
+
+    returns:
+        Fixture: The database, and the models that were put in it
+    """
+    rng = random.Random(seed)
+
+    def new_id() -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128)))
+
+    tenant = Tenant(
+        id=new_id(),
+        name="benchmark",
+        display_name="Benchmark",
+        registered_number="+15550000000",
+        subdomain="benchmark",
+    )
+    repository_models = []
+    for i in range(repositories):
+        repository_id = new_id()
+        repository_models.append(
+            Repository(
+                id=repository_id,
+                tenant_id=tenant.id,
+                name=f"repository_{i}",
+                display_name=f"Repository {i}",
+                tool_description=_sentence(rng, 10, 20),
+                resource_types=[
+                    ResourceType(
+                        id=new_id(),
+                        name=name.lower().replace(" ", "_"),
+                        display_name=name,
+                        repository_id=repository_id,
+                    )
+                    for name in rng.sample(_RESOURCE_TYPES, resource_types)
+                ],
+            )
+        )
+
+    resource_models = []
+    for i in range(resources):
+        repository = repository_models[i % repositories]
+        address = None
+        # Most resources have an address, every address is a different building
+        if rng.random() < 0.8:
+            city, state, zip_prefix = rng.choice(_CITIES)
+            address = Address(
+                id=new_id(),
+                street=f"{i + 1} {rng.choice(_STREETS)}",
+                city=city,
+                state=state,
+                zip_code=f"{zip_prefix}{rng.randint(0, 99):02d}",
+                google_place_id=f"ChIJ{uuid.UUID(int=rng.getrandbits(128)).hex[:23]}",
+            )
+        resource_models.append(
+            Resource(
+                id=new_id(),
+                tenant_id=tenant.id,
+                repository_id=repository.id,
+                name=f"{_sentence(rng, 2, 4)} {i}",
+                description=_sentence(rng, 20, 60),
+                phone_number=f"+1555{rng.randint(0, 9_999_999):07d}",
+                website=f"https://example.org/{i}" if rng.random() < 0.6 else None,
+                address=address,
+                resource_types=rng.sample(repository.resource_types, rng.randint(1, 3)),
+            )
+        )
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    session_maker = async_sessionmaker(bind=engine)
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLTable.metadata.create_all)
+    async with session_maker() as session:
+        await Tenant.insert_many(session, [tenant])
+        await Repository.insert_many(session, repository_models)
+        await ResourceType.insert_many(
+            session, [rt for repository in repository_models for rt in repository.resource_types]
+        )
+        await Address.insert_many(
+            session, [resource.address for resource in resource_models if resource.address]
+        )
+        await Resource.insert_many(session, resource_models)
+        await session.commit()
+
+    return Fixture(
+        engine=engine,
+        session_maker=session_maker,
+        tenant=tenant,
+        repositories=repository_models,
+        resources=resource_models,
+    )
+
+
+async def load_resource_rows(fixture: Fixture, limit: int) -> list[_tables.ResourceTable]:
+    """
+    Returns the first 'limit' resources as orm rows, with their address and resource types
+    loaded the same way the app loads them
+    """
+    load_opts = Resource._build_load_options(_tables.ResourceTable, 2)
+    stmt = (
+        select(_tables.ResourceTable)
+        .options(*load_opts)
+        .order_by(_tables.ResourceTable.created_at, _tables.ResourceTable.id)
+        .limit(limit)
+    )
+    async with fixture.session_maker() as session:
+        return list((await session.execute(stmt)).scalars())
@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import gc
+import inspect
+import itertools
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from benchmarks.fixture import Fixture, build_fixture, load_resource_rows
+from citi_mesh.database._models import Resource
+from citi_mesh.engine.messages import MessageTracker
+from citi_mesh.injestors import (_create_resource_list_model, _create_resource_model,
+                                 create_resource_list_model)
+from citi_mesh.tools import CitiToolManager, RepositoryTool
+
+"""
+Microbenchmarks of the hot paths of the app, run against a seeded SQLite fixture (see
+'benchmarks.fixture'). Results are saved as JSON, one file per commit, and two result files
+can be compared to flag regressions.
+
+Usage:
+    python -m benchmarks.hot_paths run
+    python -m benchmarks.hot_paths run --filter message_tracker --output before.json
+    python -m benchmarks.hot_paths compare .benchmarks/<base>.json .benchmarks/<head>.json
+"""
+
+RESULTS_DIR = pathlib.Path(".benchmarks")
+# The number of resources handled at once by the batch benchmarks
+BATCH_SIZE = 500
+# The number of phones kept by the message tracker benchmarks
+PHONES = 10_000
+
+
+@dataclass
+class Benchmark:
+    """
+    A single benchmark
+
+    Attributes:
+        - name(str): The name results are saved under
+        - setup(Callable): Given the fixture, returns the operation to time. The operation may
+            be async, and setup may be too
+        - iterations(int): The number of times the operation is run in each round
+    """
+
+    name: str
+    setup: Callable
+    iterations: int
+
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, iterations: int):
+    """
+    Decorator to register the setup of a benchmark
+    """
+
+    def decorator(setup: Callable) -> Callable:
+        BENCHMARKS[name] = Benchmark(name=name, setup=setup, iterations=iterations)
+        return setup
+
+    return decorator
+
+
+# --------------------MessageTracker----------------------------------------
+def _filled_tracker(messages_per_phone: int) -> MessageTracker:
+    tracker = MessageTracker()
+    for i in range(PHONES):
+        phone = f"+1555{i:07d}"
+        for j in range(messages_per_phone):
+            role = "user" if j % 2 == 0 else "assistant"
+            tracker.add(phone, {"role": role, "content": f"Message {j} about a food pantry"})
+    return tracker
+
+
+@benchmark("message_tracker.add", iterations=10_000)
+def bench_message_tracker_add(fixture: Fixture):
+    tracker = _filled_tracker(messages_per_phone=10)
+    phones = itertools.cycle(list(tracker.messages))
+    message = {"role": "user", "content": "Where is the closest shelter?"}
+    return lambda: tracker.add(next(phones), message)
+
+
+@benchmark("message_tracker.get", iterations=10_000)
+def bench_message_tracker_get(fixture: Fixture):
+    tracker = _filled_tracker(messages_per_phone=10)
+    phones = itertools.cycle(list(tracker.messages))
+    return lambda: tracker.get(next(phones))
+
+
+def _bench_get_conversation(messages: int):
+    def setup(fixture: Fixture):
+        tracker = _filled_tracker(messages_per_phone=1)
+        phone = "+15559999999"
+        for j in range(messages):
+            role = "user" if j % 2 == 0 else "assistant"
+            tracker.add(phone, {"role": role, "content": f"Message {j} about a food pantry"})
+        return lambda: tracker.get_conversation(phone)
+
+    return setup
+
+
+benchmark("message_tracker.get_conversation.20", iterations=2_000)(_bench_get_conversation(20))
+benchmark("message_tracker.get_conversation.200", iterations=200)(_bench_get_conversation(200))
+
+
+# --------------------SQLModel----------------------------------------
+@benchmark(f"sqlmodel.model_validate.orm.{BATCH_SIZE}", iterations=5)
+async def bench_model_validate_orm(fixture: Fixture):
+    rows = await load_resource_rows(fixture, limit=BATCH_SIZE)
+    return lambda: [Resource.model_validate(row) for row in rows]
+
+
+@benchmark(f"sqlmodel.model_validate.dict.{BATCH_SIZE}", iterations=5)
+def bench_model_validate_dict(fixture: Fixture):
+    payloads = [resource.model_dump() for resource in fixture.resources[:BATCH_SIZE]]
+    return lambda: [Resource.model_validate(payload) for payload in payloads]
+
+
+@benchmark(f"sqlmodel.to_orm.{BATCH_SIZE}", iterations=5)
+def bench_to_orm(fixture: Fixture):
+    resources = fixture.resources[:BATCH_SIZE]
+    return lambda: [resource.to_orm() for resource in resources]
+
+
+# --------------------Tools----------------------------------------
+def _resource_types(fixture: Fixture) -> list[str]:
+    # A couple of types, as the LLM usually asks for
+    return [rt.name for rt in fixture.repositories[0].resource_types[:2]]
+
+
+@benchmark("repository_tool.call", iterations=10)
+def bench_repository_tool_call(fixture: Fixture):
+    tool = RepositoryTool(fixture.repositories[0])
+    resource_types = _resource_types(fixture)
+
+    async def call():
+        async with fixture.session_maker() as session:
+            await tool.call(session, resource_types=resource_types)
+
+    return call
+
+
+class _PreloadedRepository:
+    """
+    Stands in for a repository whose resources have already been loaded, so only the
+    serialization in 'RepositoryTool.call' is timed
+    """
+
+    def __init__(self, resources: list[Resource]):
+        self.resources = resources
+
+    async def get_resources_by_type(self, session, resource_types: list[str]) -> list[Resource]:
+        return self.resources
+
+
+@benchmark("repository_tool.call.serialize", iterations=10)
+async def bench_repository_tool_serialize(fixture: Fixture):
+    tool = RepositoryTool(fixture.repositories[0])
+    resource_types = _resource_types(fixture)
+    async with fixture.session_maker() as session:
+        resources = await fixture.repositories[0].get_resources_by_type(session, resource_types)
+    tool.repository = _PreloadedRepository(resources)
+    return lambda: tool.call(None, resource_types=resource_types)
+
+
+@benchmark("tool_manager.to_openai", iterations=10_000)
+def bench_tool_manager_to_openai(fixture: Fixture):
+    manager = CitiToolManager([RepositoryTool(repository) for repository in fixture.repositories])
+    return manager.to_openai
+
+
+# --------------------Injestors----------------------------------------
+def _resource_type_pairs(fixture: Fixture) -> list[tuple[str, str]]:
+    return [(rt.name, rt.display_name) for rt in fixture.repositories[0].resource_types]
+
+
+@benchmark("create_resource_list_model.cold", iterations=20)
+def bench_create_resource_list_model_cold(fixture: Fixture):
+    resource_types = _resource_type_pairs(fixture)
+
+    def create():
+        # Time a cache miss, including the JSON schema sent to openai
+        _create_resource_list_model.cache_clear()
+        _create_resource_model.cache_clear()
+        create_resource_list_model(resource_types).model_json_schema()
+
+    return create
+
+
+@benchmark("create_resource_list_model.warm", iterations=10_000)
+def bench_create_resource_list_model_warm(fixture: Fixture):
+    resource_types = _resource_type_pairs(fixture)
+    create_resource_list_model(resource_types)
+    return lambda: create_resource_list_model(resource_types).model_json_schema()
+
+
+# --------------------Runner----------------------------------------
+async def measure(operation: Callable, iterations: int, rounds: int, warmup: int = 1) -> dict:
+    """
+    Times 'rounds' rounds of 'iterations' calls of an operation, after 'warmup' untimed rounds.
+    The garbage collector is paused while timing, like 'timeit'
+
+    returns:
+        dict: The median, min and standard deviation of the seconds per call, across rounds
+    """
+    is_async = inspect.iscoroutinefunction(operation)
+    times = []
+    gc.collect()
+    gc.disable()
+    try:
+        for round_ in range(warmup + rounds):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = operation()
+                if is_async or inspect.isawaitable(result):
+                    await result
+            if round_ >= warmup:
+                times.append((time.perf_counter() - start) / iterations)
+    finally:
+        gc.enable()
+    return {
+        "median_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "stdev_seconds": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "rounds": rounds,
+        "iterations": iterations,
+    }
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+async def run(args: argparse.Namespace):
+    selected = [b for name, b in BENCHMARKS.items() if not args.filter or args.filter in name]
+    commit = _git("rev-parse", "--short", "HEAD")
+    report = {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "fixture": {"seed": args.seed, "resources": args.resources},
+        "benchmarks": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixture = await build_fixture(
+            f"{directory}/fixture.db", seed=args.seed, resources=args.resources
+        )
+        try:
+            for bench in selected:
+                operation = bench.setup(fixture)
+                if inspect.isawaitable(operation):
+                    operation = await operation
+                result = await measure(operation, bench.iterations, rounds=args.rounds)
+                report["benchmarks"][bench.name] = result
+                print(
+                    f"{bench.name:<45} {format_seconds(result['median_seconds']):>10} "
+                    f"+- {format_seconds(result['stdev_seconds'])}"
+                )
+        finally:
+            await fixture.dispose()
+
+    output = pathlib.Path(args.output or RESULTS_DIR / f"{commit or 'results'}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Saved results to {output}")
+
+
+def compare(args: argparse.Namespace) -> int:
+    """
+    Compares the medians of two result files, flagging benchmarks that got slower by more than
+    'threshold', and by more than the noise between rounds (the sum of both standard
+    deviations). Returns 1 if there were any regressions, so it can fail a CI step
+    """
+    base = json.loads(pathlib.Path(args.base).read_text())
+    head = json.loads(pathlib.Path(args.head).read_text())
+    if base.get("fixture") != head.get("fixture"):
+        print(f"Warning: fixtures differ, {base.get('fixture')} vs {head.get('fixture')}")
+
+    base_name, head_name = base.get("commit") or "base", head.get("commit") or "head"
+    print(f"{'benchmark':<45} {base_name:>10} {head_name:>10}")
+    regressions = 0
+    for name in sorted(base["benchmarks"].keys() | head["benchmarks"].keys()):
+        if name not in base["benchmarks"] or name not in head["benchmarks"]:
+            print(f"{name:<45} only in {'head' if name in head['benchmarks'] else 'base'}")
+            continue
+        before, after = base["benchmarks"][name], head["benchmarks"][name]
+        change = after["median_seconds"] / before["median_seconds"] - 1
+        noise = before["stdev_seconds"] + after["stdev_seconds"]
+        significant = abs(after["median_seconds"] - before["median_seconds"]) > noise
+        flag = ""
+        if change > args.threshold and significant:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -args.threshold and significant:
+            flag = "  faster"
+        print(
+            f"{name:<45} {format_seconds(before['median_seconds']):>10} "
+            f"{format_seconds(after['median_seconds']):>10} "
+            f"{change:+7.1%}{flag}"
+        )
+
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and save the results")
+    run_parser.add_argument("--filter", default=None, help="Only run benchmarks matching this")
+    run_parser.add_argument("--rounds", type=int, default=5)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--resources", type=int, default=5000)
+    run_parser.add_argument(
+        "--output", default=None, help="Defaults to .benchmarks/<commit>.json"
+    )
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions between two runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="The slowdown to flag, i.e. 0.1 for 10%%"
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run(args))
+    else:
+        sys.exit(compare(args))
@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import httpx
+from sqlalchemy import create_engine
+from twilio.request_validator import RequestValidator
+
+from benchmarks.stand_ins import (OPENAI_CHAT_REPLY, OPENAI_PARSE_PREFIX, Latency,
+                                  StandInServer, create_maps_app, create_openai_app,
+                                  create_twilio_app, free_port)
+from citi_mesh.database import _tables  # noqa: F401, registers every table on the metadata
+from citi_mesh.database._base import SQLTable
+
+"""
+End to end load test of the '/sms/twilio' webhook. The app is started in its own process,
+pointed at local stand-ins for openai, Twilio and Google Maps, and many simulated phones each
+text it, wait for the answer, think, and text it again.
+
+The reply latency of a message is the time from posting its webhook until the Twilio stand-in
+is asked to send its answer, so it includes the coalescing window, the chat turn and the
+outbound queue. Acknowledgments sent while an answer is slow are counted, but do not end the
+wait.
+
+The stand-ins and the phones share this process, so at very high rates they compete with each
+other for the GIL. Watch the webhook latency, if it climbs while the app is idle, the driver
+is the bottleneck, not the app.
+
+Usage:
+    python -m benchmarks.load_test --phones 100 --messages 5
+    python -m benchmarks.load_test --openai-parse-latency lognormal:1.5,0.5 \\
+        --env SMS_COALESCE_MS=0 --output load_test.json
+"""
+
+ACCOUNT_SID = "AC00000000000000000000000000000000"
+SERVICE_SID = "MG00000000000000000000000000000000"
+AUTH_TOKEN = "load-test-auth-token"
+SERVICE_NUMBER = "+15550000000"
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    """
+    Returns the 'q' percentile (0 to 100) of 'values', by nearest rank
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+@dataclass
+class LoadTestResults:
+    """
+    What the simulated phones saw during a load test
+
+    Attributes:
+        - sent(int): The webhooks posted
+        - rejected(int): The webhooks the app did not accept
+        - answered(int): The messages that got an answer
+        - timed_out(int): The messages that did not get an answer in time
+        - acks(int): The acknowledgments sent while an answer was slow
+        - reply_latencies(list[float]): The seconds from each webhook to its answer
+        - webhook_latencies(list[float]): The seconds the app took to accept each webhook
+        - started_at(float): When the first webhook was posted
+        - finished_at(float): When the last phone finished
+    """
+
+    sent: int = 0
+    rejected: int = 0
+    answered: int = 0
+    timed_out: int = 0
+    acks: int = 0
+    reply_latencies: list[float] = field(default_factory=list)
+    webhook_latencies: list[float] = field(default_factory=list)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+    def snapshot(self) -> dict:
+        return {
+            "sent": self.sent,
+            "rejected": self.rejected,
+            "answered": self.answered,
+            "timed_out": self.timed_out,
+            "acks": self.acks,
+            "duration_seconds": self.duration,
+            "messages_per_second": self.answered / self.duration if self.duration else 0.0,
+            "reply_latency": {
+                f"p{q}_seconds": percentile(self.reply_latencies, q) for q in (50, 95, 99)
+            },
+            "webhook_latency": {
+                f"p{q}_seconds": percentile(self.webhook_latencies, q) for q in (50, 95, 99)
+            },
+        }
+
+
+class AppProcess:
+    """
+    Runs the app with uvicorn in a separate process, for use as an async context manager
+
+    Attributes:
+        - app(str): The import string of the app to run
+        - env(dict): Environment variables for the app, on top of this process'
+        - workers(int): The number of uvicorn workers
+        - url(str): The root url of the app
+    """
+
+    def __init__(self, app: str, env: dict, workers: int = 1):
+        self.app = app
+        self.env = {**os.environ, **env}
+        self.workers = workers
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._process: Optional[subprocess.Popen] = None
+
+    async def __aenter__(self) -> "AppProcess":
+        self._process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                self.app,
+                "--port",
+                str(self.port),
+                "--workers",
+                str(self.workers),
+                "--log-level",
+                "warning",
+            ],
+            env=self.env,
+        )
+        async with httpx.AsyncClient() as client:
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                if self._process.poll() is not None:
+                    raise RuntimeError(f"The app exited with code {self._process.returncode}")
+                try:
+                    if (await client.get(f"{self.url}/health/live")).status_code == 200:
+                        return self
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        self._process.terminate()
+        raise RuntimeError("The app did not start within 60 seconds")
+
+    async def __aexit__(self, *exc):
+        self._process.terminate()
+        await asyncio.to_thread(self._process.wait, 30)
+
+
+async def simulate_phone(
+    client: httpx.AsyncClient,
+    webhook_url: str,
+    phone: str,
+    inbox: asyncio.Queue,
+    results: LoadTestResults,
+    messages: int,
+    think_time: Latency,
+    reply_timeout: float,
+    start_after: float,
+):
+    """
+    Texts the app 'messages' times from 'phone', waiting for each answer before thinking and
+    texting again
+    """
+    validator = RequestValidator(AUTH_TOKEN)
+    await asyncio.sleep(start_after)
+    for i in range(messages):
+        body = f"Message {i} from {phone}"
+        params = {
+            "AccountSid": ACCOUNT_SID,
+            "MessageSid": f"SM{secrets.token_hex(16)}",
+            "From": phone,
+            "To": SERVICE_NUMBER,
+            "Body": body,
+        }
+        headers = {"X-Twilio-Signature": validator.compute_signature(webhook_url, params)}
+
+        sent_at = time.monotonic()
+        if results.started_at is None:
+            results.started_at = sent_at
+        results.sent += 1
+        response = await client.post(webhook_url, data=params, headers=headers)
+        results.webhook_latencies.append(time.monotonic() - sent_at)
+        if response.status_code != 200:
+            results.rejected += 1
+            continue
+
+        answer = f"{OPENAI_PARSE_PREFIX}{body}"
+        try:
+            async with asyncio.timeout(reply_timeout):
+                while True:
+                    reply = await inbox.get()
+                    if reply["body"] == answer:
+                        break
+                    # Anything else is an acknowledgment, or the late answer to a message
+                    # that timed out
+                    if reply["body"] == OPENAI_CHAT_REPLY:
+                        results.acks += 1
+            results.answered += 1
+            results.reply_latencies.append(reply["at"] - sent_at)
+        except TimeoutError:
+            results.timed_out += 1
+
+        if i < messages - 1:
+            await asyncio.sleep(think_time.sample())
+
+
+async def run_load_test(
+    app_url: str,
+    inboxes: dict[str, asyncio.Queue],
+    messages: int,
+    think_time: Latency,
+    ramp_up: float,
+    reply_timeout: float,
+) -> LoadTestResults:
+    """
+    Runs a phone for each inbox, starting them evenly over 'ramp_up' seconds
+    """
+    results = LoadTestResults()
+    webhook_url = f"{app_url}/sms/twilio"
+    limits = httpx.Limits(max_connections=len(inboxes), max_keepalive_connections=len(inboxes))
+    async with httpx.AsyncClient(limits=limits, timeout=reply_timeout) as client:
+        await asyncio.gather(
+            *(
+                simulate_phone(
+                    client,
+                    webhook_url,
+                    phone,
+                    inbox,
+                    results,
+                    messages=messages,
+                    think_time=think_time,
+                    reply_timeout=reply_timeout,
+                    start_after=ramp_up * i / len(inboxes),
+                )
+                for i, (phone, inbox) in enumerate(inboxes.items())
+            )
+        )
+    results.finished_at = time.monotonic()
+    return results
+
+
+async def main(args: argparse.Namespace):
+    loop = asyncio.get_running_loop()
+    inboxes = {f"+1555{i:07d}": asyncio.Queue() for i in range(1, args.phones + 1)}
+
+    def on_message(message: dict):
+        # Called from the Twilio stand-in's thread
+        if message["to"] in inboxes:
+            loop.call_soon_threadsafe(inboxes[message["to"]].put_nowait, message)
+
+    openai_app = create_openai_app(
+        chat_latency=Latency.parse(args.openai_chat_latency, seed=args.seed),
+        parse_latency=Latency.parse(args.openai_parse_latency, seed=args.seed),
+        moderation_latency=Latency.parse(args.openai_moderation_latency, seed=args.seed),
+    )
+    twilio_app = create_twilio_app(
+        latency=Latency.parse(args.twilio_latency, seed=args.seed), on_message=on_message
+    )
+    maps_app = create_maps_app(latency=Latency.parse(args.maps_latency, seed=args.seed))
+
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        StandInServer(openai_app) as openai_server,
+        StandInServer(twilio_app) as twilio_server,
+        StandInServer(maps_app) as maps_server,
+    ):
+        database_url = f"sqlite:///{directory}/load_test.db"
+        engine = create_engine(database_url)
+        SQLTable.metadata.create_all(engine)
+        engine.dispose()
+
+        env = {
+            "DEFAULT_DATABASE_CONNECTION_URL": database_url,
+            "OPENAI_API_KEY": "sk-load-test",
+            "OPENAI_BASE_URL": f"{openai_server.url}/v1",
+            "LLM_CACHE_MODE": "off",
+            "TWILIO_ACCOUNT_SID": ACCOUNT_SID,
+            "TWILIO_MESSAGE_SERVICE_SID": SERVICE_SID,
+            "TWILIO_AUTH_TOKEN": AUTH_TOKEN,
+            "TWILIO_BASE_URL": twilio_server.url,
+            "GOOGLE_MAPS_KEY": "AIzaLoadTest",
+            "GOOGLE_MAPS_BASE_URL": maps_server.url,
+            # The real per number limit would cap every run at 1 msg/s
+            "SMS_MESSAGES_PER_SECOND": str(args.sms_rate),
+        }
+        env.update(variable.split("=", 1) for variable in args.env)
+
+        async with AppProcess(args.app, env=env, workers=args.workers) as app:
+            results = await run_load_test(
+                app.url,
+                inboxes,
+                messages=args.messages,
+                think_time=Latency.parse(args.think_time, seed=args.seed),
+                ramp_up=args.ramp_up,
+                reply_timeout=args.reply_timeout,
+            )
+            async with httpx.AsyncClient() as client:
+                app_metrics = (await client.get(f"{app.url}/health/sms")).json()
+
+    report = {
+        "config": {
+            "phones": args.phones,
+            "messages_per_phone": args.messages,
+            "workers": args.workers,
+            "think_time": args.think_time,
+            "latencies": {
+                "openai_chat": args.openai_chat_latency,
+                "openai_parse": args.openai_parse_latency,
+                "openai_moderation": args.openai_moderation_latency,
+                "twilio": args.twilio_latency,
+                "maps": args.maps_latency,
+            },
+            "env": args.env,
+        },
+        "results": results.snapshot(),
+        "upstream_requests": {
+            "openai": openai_app.state.requests,
+            "twilio": len(twilio_app.state.messages),
+            "maps": maps_app.state.requests,
+        },
+        "app": app_metrics,
+    }
+
+    summary = report["results"]
+    print(
+        f"{summary['answered']}/{summary['sent']} answered in "
+        f"{summary['duration_seconds']:.1f}s ({summary['messages_per_second']:.1f} msg/s), "
+        f"{summary['timed_out']} timed out, {summary['rejected']} rejected, "
+        f"{summary['acks']} acks"
+    )
+    for name in ("reply_latency", "webhook_latency"):
+        latencies = "  ".join(
+            f"{key.removesuffix('_seconds')}={value or 0:.3f}s"
+            for key, value in summary[name].items()
+        )
+        print(f"{name:<16} {latencies}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--app", default="benchmarks.load_test_app:app", help="Import string of the app"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--phones", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5, help="Messages sent by each phone")
+    parser.add_argument("--think-time", default="uniform:1,3")
+    parser.add_argument("--ramp-up", type=float, default=5.0)
+    parser.add_argument("--reply-timeout", type=float, default=60.0)
+    parser.add_argument("--openai-chat-latency", default="lognormal:0.6,0.4")
+    parser.add_argument("--openai-parse-latency", default="lognormal:1.5,0.5")
+    parser.add_argument("--openai-moderation-latency", default="lognormal:0.1,0.3")
+    parser.add_argument("--twilio-latency", default="uniform:0.05,0.2")
+    parser.add_argument("--maps-latency", default="lognormal:0.15,0.3")
+    parser.add_argument("--sms-rate", type=float, default=1000.0)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Extra configuration for the app, i.e. SMS_COALESCE_MS=0. Can be repeated",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Write the full report to this JSON file")
+    asyncio.run(main(parser.parse_args()))
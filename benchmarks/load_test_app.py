@@ -0,0 +1,35 @@
+import sys
+import types
+
+from citi_mesh.engine import CitiEngine
+from citi_mesh.engine.analytic_models import OpenAIOutput
+from citi_mesh.tools import CitiToolManager
+
+"""
+File contains the app run by the load test. 'citi_mesh.app' loads its output config from
+'citi_mesh.dev.demo', which is not part of this tree, so a fixed config giving the plain output
+model is used in its place, and the engine is started with no tools before the app's lifespan
+runs. The app is otherwise exactly 'citi_mesh.app:app'.
+
+Usage:
+    python -m benchmarks.load_test
+"""
+
+
+def load_output_config():
+    return OpenAIOutput
+
+
+# Used in place of the demo config, so every run answers with the same output model
+demo = types.ModuleType("citi_mesh.dev.demo")
+demo.load_output_config = load_output_config
+sys.modules.setdefault("citi_mesh.dev", types.ModuleType("citi_mesh.dev"))
+sys.modules["citi_mesh.dev.demo"] = demo
+
+# The lifespan starts the engine with a plain list of tools, starting it first with a fixed
+# output model and an empty tool manager keeps the chat turn runnable
+CitiEngine.get_instance(output_model=OpenAIOutput, tool_manager=CitiToolManager([]))
+
+from citi_mesh.app import app  # noqa: E402
+
+__all__ = ["app"]
@@ -0,0 +1,304 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import secrets
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Union
+
+import uvicorn
+from fastapi import FastAPI, Form, Request
+
+"""
+File contains local stand-ins for the external APIs the app talks to, so benchmarks can run
+without credentials or network access. Each stand-in is a small FastAPI app, served by uvicorn
+on a background thread so it keeps answering while the code under test blocks its own loop
+"""
+
+
+@dataclass
+class Latency:
+    """
+    A distribution of response times, in seconds, for a stand-in to wait before it answers
+
+    Attributes:
+        - kind(str): One of 'fixed', 'uniform', 'normal' or 'lognormal'
+        - a(float): The fixed value, the low end of 'uniform', the mean of 'normal' or the
+            median of 'lognormal'
+        - b(float): The high end of 'uniform', or the standard deviation of 'normal' or sigma of
+            'lognormal'
+        - seed(int): Seeds the samples, so runs can be repeated
+
+    Usage:
+        Latency.parse("0.05")
+        Latency.parse("uniform:0.05,0.2")
+        Latency.parse("lognormal:0.8,0.5")
+    """
+
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+    seed: Optional[int] = None
+
+    def __post_init__(self):
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {self.kind}")
+        self._random = random.Random(self.seed)
+
+    @classmethod
+    def parse(cls, value: Union[str, float, "Latency"], seed: Optional[int] = None) -> "Latency":
+        """
+        Returns the distribution described by 'value', either seconds, or '<kind>:<a>,<b>'
+        """
+        if isinstance(value, Latency):
+            return value
+        if isinstance(value, (int, float)):
+            return cls(a=float(value), seed=seed)
+        kind, _, params = value.partition(":")
+        if not params:
+            return cls(a=float(kind), seed=seed)
+        a, _, b = params.partition(",")
+        return cls(kind=kind, a=float(a), b=float(b or 0), seed=seed)
+
+    def sample(self) -> float:
+        if self.kind == "uniform":
+            return self._random.uniform(self.a, self.b)
+        if self.kind == "normal":
+            return max(0.0, self._random.gauss(self.a, self.b))
+        if self.kind == "lognormal":
+            return self._random.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+        return self.a
+
+    def __str__(self) -> str:
+        return str(self.a) if self.kind == "fixed" else f"{self.kind}:{self.a},{self.b}"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StandInServer:
+    """
+    Serves a FastAPI app on a background thread, for use as a context manager
+
+    Attributes:
+        - app(FastAPI): The app to serve
+        - port(int): The port to serve on, defaults to a free port
+        - url(str): The root url of the server, once started
+    """
+
+    def __init__(self, app: FastAPI, port: Optional[int] = None):
+        self.app = app
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        )
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self) -> "StandInServer":
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+
+
+def create_twilio_app(
+    latency: Union[float, str, Latency] = 0.02,
+    on_message: Optional[Callable[[dict], None]] = None,
+) -> FastAPI:
+    """
+    Returns a stand-in for the Twilio Messages API, that accepts every message after 'latency'
+    seconds. Sent messages are kept in 'app.state.messages', and handed to 'on_message' as they
+    arrive, which is called from the server's thread
+    """
+    app = FastAPI()
+    app.state.messages = []
+    latency = Latency.parse(latency)
+
+    @app.post("/2010-04-01/Accounts/{account_sid}/Messages.json", status_code=201)
+    async def create_message(
+        account_sid: str,
+        To: str = Form(...),
+        Body: str = Form(...),
+        MessagingServiceSid: Optional[str] = Form(None),
+    ):
+        await asyncio.sleep(latency.sample())
+        sid = f"SM{secrets.token_hex(16)}"
+        message = {"sid": sid, "to": To, "body": Body, "at": time.monotonic()}
+        app.state.messages.append(message)
+        if on_message:
+            on_message(message)
+        return {
+            "sid": sid,
+            "account_sid": account_sid,
+            "to": To,
+            "body": Body,
+            "messaging_service_sid": MessagingServiceSid,
+            "status": "queued",
+        }
+
+    return app
+
+
+# The text the openai stand-in answers plain chat completions with, i.e. acknowledgments
+OPENAI_CHAT_REPLY = "One moment, looking into that for you."
+# Structured replies answer the last user message with this prefix
+OPENAI_PARSE_PREFIX = "Answer to: "
+
+
+def _example_from_schema(schema: dict, defs: dict) -> Any:
+    """
+    Private function to build the smallest instance of a JSON schema, as used for structured
+    outputs. Enough to be parsed back into the model the schema came from
+    """
+    if "$ref" in schema:
+        return _example_from_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    if "anyOf" in schema:
+        return _example_from_schema(schema["anyOf"][0], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = kind[0]
+    if kind == "object":
+        return {
+            name: _example_from_schema(prop, defs)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    return {"array": [], "string": "", "integer": 0, "number": 0.0, "boolean": False}.get(kind)
+
+
+def create_openai_app(
+    chat_latency: Union[float, str, Latency] = 0.5,
+    parse_latency: Union[float, str, Latency] = 1.0,
+    moderation_latency: Union[float, str, Latency] = 0.1,
+) -> FastAPI:
+    """
+    Returns a stand-in for the openai API, serving chat completions, structured chat
+    completions (the 'parse' helper) and moderations. Point a client at it with
+    'OPENAI_BASE_URL=<url>/v1'.
+
+    Plain chat completions are answered with 'OPENAI_CHAT_REPLY'. Structured completions are
+    answered with the smallest instance of the requested schema, with its 'message' set to the
+    last user message prefixed by 'OPENAI_PARSE_PREFIX', so callers can tell which message was
+    answered. Tools are never called. Every input passes moderation
+
+    args:
+        - chat_latency: The response times of plain chat completions
+        - parse_latency: The response times of structured chat completions
+        - moderation_latency: The response times of moderations
+    """
+    app = FastAPI()
+    app.state.requests = {"chat": 0, "parse": 0, "moderation": 0}
+    chat_latency = Latency.parse(chat_latency)
+    parse_latency = Latency.parse(parse_latency)
+    moderation_latency = Latency.parse(moderation_latency)
+
+    @app.post("/v1/chat/completions")
+    async def create_chat_completion(request: Request):
+        body = await request.json()
+        response_format = body.get("response_format") or {}
+        user_messages = [m for m in body["messages"] if m.get("role") == "user"]
+        prompt = user_messages[-1]["content"] if user_messages else ""
+
+        if response_format.get("type") == "json_schema":
+            app.state.requests["parse"] += 1
+            await asyncio.sleep(parse_latency.sample())
+            schema = response_format["json_schema"]["schema"]
+            parsed = _example_from_schema(schema, schema.get("$defs", {}))
+            parsed["message"] = f"{OPENAI_PARSE_PREFIX}{prompt}"
+            content = json.dumps(parsed)
+        else:
+            app.state.requests["chat"] += 1
+            await asyncio.sleep(chat_latency.sample())
+            content = OPENAI_CHAT_REPLY
+
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body["messages"]) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-{secrets.token_hex(12)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content, "refusal": None},
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    @app.post("/v1/moderations")
+    async def create_moderation(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        app.state.requests["moderation"] += 1
+        await asyncio.sleep(moderation_latency.sample())
+        return {
+            "id": f"modr-{secrets.token_hex(12)}",
+            "model": body.get("model", "omni-moderation-latest"),
+            "results": [
+                {"flagged": False, "categories": {}, "category_scores": {}} for _ in inputs
+            ],
+        }
+
+    return app
+
+
+def create_maps_app(latency: Union[float, str, Latency] = 0.15) -> FastAPI:
+    """
+    Returns a stand-in for the Google Maps Places and Directions APIs. Point the app at it with
+    'GOOGLE_MAPS_BASE_URL=<url>'. Every place is found, with a place id derived from its name,
+    and every pair of places is a single transit step apart
+    """
+    app = FastAPI()
+    app.state.requests = 0
+    latency = Latency.parse(latency)
+
+    @app.get("/maps/api/place/findplacefromtext/json")
+    async def find_place(input: str):
+        app.state.requests += 1
+        await asyncio.sleep(latency.sample())
+        place_id = f"ChIJ{hashlib.sha1(input.encode()).hexdigest()[:23]}"
+        return {"status": "OK", "candidates": [{"place_id": place_id}]}
+
+    @app.get("/maps/api/directions/json")
+    async def directions(origin: str, destination: str):
+        app.state.requests += 1
+        await asyncio.sleep(latency.sample())
+        step = {
+            "travel_mode": "TRANSIT",
+            "html_instructions": f"Take the train from {origin} to {destination}",
+            "duration": {"text": "20 mins", "value": 1200},
+            "distance": {"text": "5 km", "value": 5000},
+        }
+        leg = {
+            "start_address": origin,
+            "end_address": destination,
+            "duration": step["duration"],
+            "distance": step["distance"],
+            "steps": [step],
+        }
+        return {"status": "OK", "geocoded_waypoints": [], "routes": [{"legs": [leg]}]}
+
+    return app
@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import time
+
+from twilio.rest import Client
+
+from benchmarks.stand_ins import StandInServer, create_twilio_app
+from citi_mesh.sms import TwilioSender
+
+"""
+Benchmark of the pooled 'TwilioSender' against the per message 'twilio.rest.Client' it
+replaced, both sending to a local stand-in of the Twilio API.
+
+The stand-in is served over plain http, so the numbers leave out the TLS handshake the old
+sender paid on every message, and understate the gap against the real API.
+
+Usage:
+    python -m benchmarks.twilio_sender --messages 500 --concurrency 20
+"""
+
+ACCOUNT_SID = "AC00000000000000000000000000000000"
+SERVICE_SID = "MG00000000000000000000000000000000"
+
+
+async def run_client_per_message(url: str, messages: int, concurrency: int) -> float:
+    """
+    Sends every message the old way, with a new client per message and a blocking send
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int):
+        async with semaphore:
+            client = Client(username="key", password="secret", account_sid=ACCOUNT_SID)
+            client.api.base_url = url
+            client.messages.create(
+                to=f"+1555{i:07d}", body="Hello!", messaging_service_sid=SERVICE_SID
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(messages)))
+    return time.perf_counter() - start
+
+
+async def run_pooled_sender(url: str, messages: int, concurrency: int) -> float:
+    """
+    Sends every message with a single, pooled TwilioSender
+    """
+    sender = TwilioSender(
+        account_sid=ACCOUNT_SID,
+        messaging_service_sid=SERVICE_SID,
+        username="key",
+        password="secret",
+        base_url=url,
+        max_connections=concurrency,
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int):
+        async with semaphore:
+            await sender.send(to=f"+1555{i:07d}", body="Hello!")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(messages)))
+    elapsed = time.perf_counter() - start
+    await sender.close()
+    return elapsed
+
+
+async def main(messages: int, concurrency: int, latency: float):
+    with StandInServer(create_twilio_app(latency=latency)) as server:
+        for name, run in (
+            ("client per message", run_client_per_message),
+            ("pooled sender", run_pooled_sender),
+        ):
+            elapsed = await run(server.url, messages, concurrency)
+            print(
+                f"{name:<20} {messages} messages in {elapsed:.2f}s "
+                f"({messages / elapsed:.0f} msg/s)"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.concurrency, args.latency))
@@ -1,29 +1,54 @@
-import asyncio
-import io
 import os
-import pathlib
 from contextlib import asynccontextmanager
-from tempfile import TemporaryDirectory
+from typing import Optional
 
-import pandas as pd
-from fastapi import (BackgroundTasks, Depends, FastAPI, File, Form, HTTPException, Request,
-                     UploadFile, status)
+from fastapi import (Depends, FastAPI, File, Form, HTTPException, Query, Request, UploadFile,
+                     status)
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
 from twilio.request_validator import RequestValidator
 
 from citi_mesh import __version__
+from citi_mesh.blocking import BlockingCallDetector
+from citi_mesh.coalescing import InboundCoalescer
+from citi_mesh.config import Config
 from citi_mesh.database import _models
+from citi_mesh.database._exceptions import InstanceNotFound
+from citi_mesh.database.engine_factory import get_pool_status
 from citi_mesh.database.route_factory import RouteFactory
-from citi_mesh.database.session import get_session_dependency
+from citi_mesh.database.session import ENGINE, get_session_dependency
 from citi_mesh.dev.demo import load_output_config
+from citi_mesh.dispatch import SMSDispatchQueue
 from citi_mesh.engine import CitiEngine
-from citi_mesh.injestors import CSVInjestor, WebpageInjestor
+from citi_mesh.health import HealthMonitor
+from citi_mesh.idempotency import WebhookDeduplicator
+from citi_mesh.injestors import (CSVInjestor, CrawlerInjestor, ParquetInjestor, WebpageInjestor,
+                                 XLSXInjestor)
+from citi_mesh.jobs import IngestionJobQueue
 from citi_mesh.logging import get_logger
-from citi_mesh.utils import send_message_twilio
 
 logger = get_logger(__name__)
 
+job_queue = IngestionJobQueue()
+sms_queue = SMSDispatchQueue()
+webhook_dedup = WebhookDeduplicator()
+health_monitor = HealthMonitor(ENGINE)
+blocking_detector = BlockingCallDetector() if Config.blocking_detector_enabled else None
+
+
+def start_turn(phone: str, message: str):
+    """
+    Starts answering a phone's messages, only acknowledging them if the answer is slow
+    """
+    return sms_queue.submit_with_ack(
+        phone,
+        answer=CitiEngine.chat(phone=phone, message=message),
+        ack=lambda: CitiEngine.get_processing_message(phone=phone, message=message),
+    )
+
+
+inbound = InboundCoalescer(start_turn=start_turn)
+
 
 @asynccontextmanager
 async def app_lifespan(app: FastAPI):
@@ -33,10 +58,21 @@ async def app_lifespan(app: FastAPI):
     logger.info("App starting...")
     # tools = await load_tools()
     CitiEngine.get_instance(output_model=load_output_config(), tool_manager=[])
+    await job_queue.start()
+    await sms_queue.start()
+    await health_monitor.start()
+    if blocking_detector:
+        await blocking_detector.start()
 
     yield
 
     logger.info("App shutting down...")
+    await job_queue.stop()
+    await sms_queue.stop()
+    await sms_queue.sender.close()
+    await health_monitor.stop()
+    if blocking_detector:
+        await blocking_detector.stop()
 
 
 # Create the application
@@ -57,59 +93,83 @@ route_factory.add_routes(_models.Resource)
 
 
 # --------------------Status Checks----------------------------------------
-# TODO: Update these to actually check services
-async def check_database():
-    try:
-        # For example, perform a simple query or connection test.
-        # await your_database.execute("SELECT 1")
-        await asyncio.sleep(0.1)  # Simulate IO-bound operation
-        return True
-    except Exception as e:
-        return False
-
-
-async def check_cache():
-    try:
-        # For example, ping your cache (Redis, Memcached, etc.)
-        # await redis_client.ping()
-        await asyncio.sleep(0.1)  # Simulate IO-bound operation
-        return True
-    except Exception as e:
-        return False
+@app.get("/health", tags=["Health"])
+@app.get("/health/live", tags=["Health"])
+async def liveness():
+    """
+    Cheap liveness probe, only checks that the app can answer a request
+    """
+    return {"status": "alive"}
 
 
-@app.get("/health", tags=["Health"])
-async def health_check():
-    # Run dependency checks concurrently.
-    db_status, cache_status = await asyncio.gather(check_database(), check_cache())
-
-    # Build a status response for each dependency.
-    components = {
-        "database": "ok" if db_status else "error",
-        "cache": "ok" if cache_status else "error",
+@app.get("/health/ready", tags=["Health"])
+async def readiness():
+    """
+    Readiness probe, reporting live measurements of how saturated the app is. Nothing is
+    checked during the request, upstreams are checked in the background by 'health_monitor'
+    """
+    content = {
+        "status": "ready" if health_monitor.ready else "not ready",
+        **health_monitor.snapshot(),
+        "database_pool": get_pool_status(ENGINE),
+        "chat_turns_in_flight": CitiEngine.turns_in_flight,
+        "backlog": {
+            "sms": sms_queue.metrics.depth,
+            "sms_in_flight": sms_queue.metrics.in_flight,
+            "ingestion_jobs": job_queue.backlog(),
+        },
     }
+    return JSONResponse(
+        status_code=(
+            status.HTTP_200_OK if health_monitor.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        ),
+        content=content,
+    )
 
-    # Determine the overall health.
-    overall_healthy = all([db_status, cache_status])
-    if overall_healthy:
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content={"status": "healthy", "components": components},
-        )
-    else:
-        return JSONResponse(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            content={"status": "unhealthy", "components": components},
+
+@app.get("/health/blocking", tags=["Health"])
+async def blocking_calls():
+    """
+    Reports the call sites that blocked the event loop, worst first. Only available when
+    'Config.blocking_detector_enabled' is set
+    """
+    if not blocking_detector:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="The blocking call detector is off"
         )
+    return blocking_detector.snapshot()
+
+
+@app.get("/health/database/pool", tags=["Health"])
+async def database_pool_status():
+    """
+    Reports the state of the database connection pool, including how long requests have waited
+    to check out a connection
+    """
+    return get_pool_status(ENGINE)
+
+
+@app.get("/health/sms", tags=["Health"])
+async def sms_queue_status():
+    """
+    Reports the state of the outbound SMS queue, including its depth and how long messages
+    waited to be sent, along with how many inbound messages were merged into a single turn and
+    how many webhook retries were ignored
+    """
+    return {
+        **sms_queue.metrics.snapshot(),
+        "inbound": inbound.metrics.snapshot(),
+        "webhooks": webhook_dedup.metrics.snapshot(),
+    }
 
 
 # --------------------SMS Webhooks----------------------------------------
 @app.post("/sms/twilio", tags=["Webhooks"])
 async def sms(
     request: Request,
-    background_tasks: BackgroundTasks,
     From: str = Form(...),
     Body: str = Form(...),
+    MessageSid: Optional[str] = Form(None),
 ):
     """
     Webhook to recieve and send sms messages from a Twilio Service
@@ -123,60 +183,171 @@ async def sms(
     ):
         raise HTTPException(status_code=400, detail="Error in Twilio Signature")
 
-    background_tasks.add_task(
-        send_message_twilio,
-        to=From,
-        message_func=CitiEngine.get_processing_message,
-        phone=From,
-        message=Body,
-    )
+    # Twilio retries slow webhooks, answer each message only once
+    if MessageSid and await webhook_dedup.is_duplicate(MessageSid):
+        return
 
-    background_tasks.add_task(
-        send_message_twilio, to=From, message_func=CitiEngine.chat, phone=From, message=Body
-    )
+    # Messages sent in quick succession are answered together
+    inbound.receive(From, Body)
 
 
 # --------------------Submit Sources----------------------------------------
-# TODO: Add more injestors, like PDF or word doc or excel
+# TODO: Add more injestors, like PDF or word doc
 
 
-@app.post("/repository/{repository_id}/web", tags=["Repository"])
+@app.post(
+    "/repository/{repository_id}/web",
+    tags=["Repository"],
+    status_code=status.HTTP_202_ACCEPTED,
+)
 async def post_webpage_repository(
     repository_id: str, url: str, session=Depends(get_session_dependency)
 ):
     """
-    Endpoint to add resources to a repository via a 'WebPage' source
+    Endpoint to add resources to a repository via a 'WebPage' source. The page is pulled in
+    the background, use the returned job id to check on it
     """
     repo = await _models.Repository.from_id(session=session, id_=repository_id)
-    repo = WebpageInjestor(repo=repo, url=url)
+    job = await job_queue.submit(
+        session, repository_id=repo.id, source_type=WebpageInjestor.__source_type__, details=url
+    )
 
-    await repo.pull_resources(session)
+    return {"job_id": job.id}
 
-    return status.HTTP_200_OK
 
+@app.post(
+    "/repository/{repository_id}/crawl",
+    tags=["Repository"],
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def post_crawl_repository(
+    repository_id: str,
+    url: str,
+    max_depth: int = Query(default=2, ge=0, le=5),
+    max_pages: int = Query(default=100, ge=1, le=1000),
+    session=Depends(get_session_dependency),
+):
+    """
+    Endpoint to add resources to a repository by crawling a website, following links on the
+    same domain up to 'max_depth' away from 'url'. The site is crawled in the background, use
+    the returned job id to check on it
+    """
+    repo = await _models.Repository.from_id(session=session, id_=repository_id)
+    job = await job_queue.submit(
+        session,
+        repository_id=repo.id,
+        source_type=CrawlerInjestor.__source_type__,
+        details=url,
+        options={"max_depth": max_depth, "max_pages": max_pages},
+    )
 
-@app.post("/repository/{repository_id}/csv", tags=["Repository"])
+    return {"job_id": job.id}
+
+
+@app.post(
+    "/repository/{repository_id}/csv",
+    tags=["Repository"],
+    status_code=status.HTTP_202_ACCEPTED,
+)
 async def post_csv_repository(
     repository_id: str,
     csv_file: UploadFile = File(..., description="CSV file containing resources."),
+    column_mapping: bool = Query(
+        default=False,
+        description="Map columns straight to resource fields, only parsing unmappable rows",
+    ),
+    session=Depends(get_session_dependency),
+):
+    """
+    Endpoint to add resources to a repository via a 'CSV' source. The file is pulled in the
+    background, use the returned job id to check on it
+    """
+    repo = await _models.Repository.from_id(session=session, id_=repository_id)
+    job = await job_queue.submit(
+        session,
+        repository_id=repo.id,
+        source_type=CSVInjestor.__source_type__,
+        details=csv_file.filename,
+        upload=csv_file.file,
+        options={"column_mapping": column_mapping},
+    )
+
+    return {"job_id": job.id}
+
+
+@app.post(
+    "/repository/{repository_id}/parquet",
+    tags=["Repository"],
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def post_parquet_repository(
+    repository_id: str,
+    parquet_file: UploadFile = File(..., description="Parquet file containing resources."),
+    columns: Optional[list[str]] = Query(
+        default=None, description="The columns to read, defaults to every column"
+    ),
     session=Depends(get_session_dependency),
 ):
     """
-    Endpoint to add resources to a repository via a 'CSV' source
+    Endpoint to add resources to a repository via a 'Parquet' source. The file is pulled in
+    the background, use the returned job id to check on it
     """
     repo = await _models.Repository.from_id(session=session, id_=repository_id)
-    # 2. Read & parse the CSV
-    contents = await csv_file.read()
-    text = contents.decode("utf-8")
-    df = pd.read_csv(io.StringIO(text))
-    # Use StringIO so csv.DictReader can treat it like a file
-    with TemporaryDirectory() as temp_dir:
-        temp_path = pathlib.Path(temp_dir) / "temp.csv"
-        df.to_csv(temp_path)
-
-        repo = CSVInjestor(repo_id=repository_id)
-
-        await repo.pull_resources(session=session)
+    job = await job_queue.submit(
+        session,
+        repository_id=repo.id,
+        source_type=ParquetInjestor.__source_type__,
+        details=parquet_file.filename,
+        upload=parquet_file.file,
+        options={"columns": columns},
+    )
+
+    return {"job_id": job.id}
+
+
+@app.post(
+    "/repository/{repository_id}/xlsx",
+    tags=["Repository"],
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def post_xlsx_repository(
+    repository_id: str,
+    xlsx_file: UploadFile = File(..., description="Excel workbook containing resources."),
+    sheet_name: Optional[str] = Query(
+        default=None, description="The sheet to read, defaults to the active sheet"
+    ),
+    session=Depends(get_session_dependency),
+):
+    """
+    Endpoint to add resources to a repository via an 'Excel' source. The file is pulled in the
+    background, use the returned job id to check on it
+    """
+    repo = await _models.Repository.from_id(session=session, id_=repository_id)
+    job = await job_queue.submit(
+        session,
+        repository_id=repo.id,
+        source_type=XLSXInjestor.__source_type__,
+        details=xlsx_file.filename,
+        upload=xlsx_file.file,
+        options={"sheet_name": sheet_name},
+    )
+
+    return {"job_id": job.id}
+
+
+@app.get("/jobs/{job_id}", tags=["Repository"])
+async def get_job(job_id: str, session=Depends(get_session_dependency)):
+    """
+    Endpoint to check on the status and progress of an ingestion job
+    """
+    try:
+        job = await _models.IngestionJob.from_id(session=session, id_=job_id)
+    except InstanceNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    # Prefer the live progress if the job is running in this process
+    job.progress = job_queue.get_live_progress(job_id) or job.progress
+    return job
 
 
 if __name__ == "__main__":
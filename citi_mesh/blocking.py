@@ -0,0 +1,168 @@
+import asyncio
+import pathlib
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Optional
+
+from citi_mesh.config import Config
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+"""
+File contains an opt-in diagnostic that catches synchronous calls blocking the event loop,
+i.e. 'requests.get' or a sync SDK call inside of an async route. Turn it on with
+'Config.blocking_detector_enabled', ideally in staging, and read the results from the logs or
+'/health/blocking'
+"""
+
+# Frames in this package are the ones worth blaming for a block
+_PACKAGE_ROOT = str(pathlib.Path(__file__).resolve().parent)
+
+
+@dataclass
+class BlockingReport:
+    """
+    The blocks caught at a single call site
+
+    Attributes:
+        - call_site(str): The innermost frame of this package that was running during the block
+        - count(int): The number of blocks caught here
+        - total_seconds(float): How long the loop was blocked here, across every block
+        - max_seconds(float): The longest block caught here
+        - stack(str): The stack of the loop thread during the last block
+    """
+
+    call_site: str
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    stack: str = ""
+
+    def snapshot(self) -> dict:
+        return {
+            "call_site": self.call_site,
+            "count": self.count,
+            "total_seconds": self.total_seconds,
+            "max_seconds": self.max_seconds,
+            "stack": self.stack,
+        }
+
+
+def _call_site(frames: list[traceback.FrameSummary]) -> str:
+    """
+    Private function to pick the frame to blame for a block, the innermost one in this package
+    """
+    for frame in reversed(frames):
+        if frame.filename.startswith(_PACKAGE_ROOT):
+            break
+    else:
+        frame = frames[-1]
+    return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+
+class BlockingCallDetector:
+    """
+    Watches the event loop from a separate thread. A task on the loop records a heartbeat every
+    'interval' seconds, and if the heartbeat is more than 'threshold' seconds late, the stack
+    of the loop's thread is captured, since whatever it is running is blocking the loop.
+
+    Blocks are grouped by call site, see 'BlockingReport'
+
+    Attributes:
+        - threshold(float): The seconds the loop has to be blocked for to be reported.
+            Defaults to 'Config.blocking_threshold'
+        - interval(float): The seconds between heartbeats
+
+    Usage:
+        detector = BlockingCallDetector()
+        await detector.start()
+        ...
+        detector.snapshot()
+        await detector.stop()
+    """
+
+    def __init__(self, threshold: Optional[float] = None, interval: float = 0.02):
+        self.threshold = Config.blocking_threshold if threshold is None else threshold
+        self.interval = interval
+        self.reports: dict[str, BlockingReport] = {}
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    async def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="blocking-detector", daemon=True)
+        self._thread.start()
+        logger.info(f"Reporting event loop blocks longer than {self.threshold * 1000:.0f}ms")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        """
+        Private method run on the watchdog thread. Captures at most one stack per block, and
+        records how long the block lasted once the heartbeat comes back
+        """
+        blocked: Optional[tuple[float, BlockingReport]] = None
+        while not self._stopped.wait(self.interval / 2):
+            beat = self._beat
+            late = time.monotonic() - beat - self.interval
+            if blocked and blocked[0] != beat:
+                # The loop is running again
+                started, report = blocked
+                duration = beat - started
+                with self._lock:
+                    report.total_seconds += duration
+                    report.max_seconds = max(report.max_seconds, duration)
+                message = f"Event loop was blocked for {duration:.3f}s at {report.call_site}"
+                # Only log the whole stack the first time a call site is caught
+                if report.count == 1:
+                    message += f"\n{report.stack}"
+                logger.warning(message)
+                blocked = None
+            elif not blocked and late > self.threshold:
+                blocked = (beat, self._capture())
+
+    def _capture(self) -> BlockingReport:
+        """
+        Private method to capture the stack of the loop's thread, and count it against its
+        call site
+        """
+        frame = sys._current_frames().get(self._loop_thread_id)
+        frames = traceback.extract_stack(frame) if frame else []
+        call_site = _call_site(frames) if frames else "unknown"
+        with self._lock:
+            report = self.reports.setdefault(call_site, BlockingReport(call_site=call_site))
+            report.count += 1
+            report.stack = "".join(traceback.format_list(frames))
+        return report
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            reports = sorted(self.reports.values(), key=lambda r: r.total_seconds, reverse=True)
+            return {
+                "threshold_seconds": self.threshold,
+                "call_sites": [report.snapshot() for report in reports],
+            }
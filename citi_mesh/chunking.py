@@ -0,0 +1,110 @@
+import re
+from typing import Optional
+
+"""
+File contains the helpers used to pack source strings into chunks sized by tokens, instead of
+by a fixed number of entries, before they are sent to openai
+"""
+
+# Approximates a BPE pre-tokenizer: runs of letters, groups of up to 3 digits, single symbols,
+# and line breaks. A space before a word is merged into the word's token, so it is not counted.
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|\n+|[ \t]{2,}")
+
+# Tokens added around each entry in a chunk, for the '[index] ' prefix and the newline
+ITEM_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a string without a tokenizer model. Long words are
+    counted as several tokens, as BPE splits them up. Errs on the side of overestimating, so
+    chunks built from it do not overflow the context.
+    """
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group()
+        if piece[0].isalpha():
+            tokens += 1 + (len(piece) - 1) // 6
+        else:
+            tokens += 1
+    return tokens
+
+
+class TokenChunker:
+    """
+    Packs source strings into chunks of up to 'target_tokens' estimated tokens, so that narrow
+    rows share a single call and wide pages are split across several.
+
+    Attributes:
+        - target_tokens(int): The max estimated tokens in a chunk
+        - max_items(int): An optional cap on the number of entries in a chunk, as the size of the
+            response grows with the number of entries
+
+    Usage:
+        chunker = TokenChunker(target_tokens=4000)
+        for text in source:
+            for piece in chunker.split(text):
+                if chunk := chunker.add(piece):
+                    send(chunk)
+        if chunk := chunker.flush():
+            send(chunk)
+    """
+
+    def __init__(self, target_tokens: int, max_items: Optional[int] = None):
+        self.target_tokens = target_tokens
+        self.max_items = max_items
+        self._items: list[str] = []
+        self._tokens = 0
+
+    def split(self, text: str) -> list[str]:
+        """
+        Splits a string that would not fit in a chunk on its own into pieces that do, breaking
+        on lines where possible. Strings that already fit are returned as is.
+        """
+        budget = self.target_tokens - ITEM_OVERHEAD_TOKENS
+        # Every token is at least one character, so short strings can skip the estimate
+        if len(text) <= budget or estimate_tokens(text) <= budget:
+            return [text]
+
+        pieces, lines, lines_tokens = [], [], 0
+        for line in text.splitlines(keepends=True):
+            line_tokens = estimate_tokens(line)
+            if lines and lines_tokens + line_tokens > budget:
+                pieces.append("".join(lines))
+                lines, lines_tokens = [], 0
+            if line_tokens > budget:
+                # A single line that is too big (i.e. minified html) is split by characters
+                step = max(1, len(line) * budget // line_tokens)
+                pieces.extend(line[i : i + step] for i in range(0, len(line), step))
+                continue
+            lines.append(line)
+            lines_tokens += line_tokens
+        if lines:
+            pieces.append("".join(lines))
+
+        return [piece for piece in pieces if piece.strip()]
+
+    def add(self, text: str) -> Optional[list[str]]:
+        """
+        Adds a string to the current chunk. If it does not fit, the current chunk is returned
+        and the string starts the next one. 'text' should already fit, see 'split'.
+        """
+        tokens = estimate_tokens(text) + ITEM_OVERHEAD_TOKENS
+        full = self._tokens + tokens > self.target_tokens or (
+            self.max_items is not None and len(self._items) >= self.max_items
+        )
+
+        chunk = None
+        if self._items and full:
+            chunk = self.flush()
+        self._items.append(text)
+        self._tokens += tokens
+        return chunk
+
+    def flush(self) -> Optional[list[str]]:
+        """
+        Returns the current chunk, if it has any entries, and starts a new one
+        """
+        chunk = self._items or None
+        self._items, self._tokens = [], 0
+        return chunk
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from citi_mesh.config import Config
+from citi_mesh.dispatch import OutboundMessage
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CoalescingMetrics:
+    """
+    Running counters of the inbound messages handled by an InboundCoalescer
+    """
+
+    received: int = 0
+    turns: int = 0
+    merged: int = 0
+    restarted: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def snapshot(self) -> dict:
+        return {
+            "received": self.received,
+            "turns": self.turns,
+            "merged": self.merged,
+            "restarted": self.restarted,
+            "messages_per_turn": self.received / self.turns if self.turns else 0.0,
+        }
+
+
+@dataclass
+class PendingTurn:
+    """
+    The messages from a phone that will be answered together
+
+    Attributes:
+        - messages(list[str]): The messages received so far, in order
+        - timer(asyncio.TimerHandle): Starts the turn once the window closes
+        - reply(OutboundMessage): The reply to the turn, once it has started
+    """
+
+    messages: list[str] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+    reply: Optional[OutboundMessage] = None
+
+
+class InboundCoalescer:
+    """
+    Merges messages that a phone sends in quick succession into a single turn. Each message
+    restarts a window of 'window_ms', and the turn only starts once the window closes without
+    a new message.
+
+    If a message arrives after the turn has started, but before its reply is sent, the reply
+    is cancelled and the turn is restarted with every message so far.
+
+    Attributes:
+        - start_turn(Callable): Called with the phone and the merged text to start a turn, and
+            gives back the queued reply, i.e. 'SMSDispatchQueue.submit_with_ack'
+        - window_ms(int): How long to wait for another message before starting a turn.
+            Defaults to 'Config.sms_coalesce_ms'
+
+    Usage:
+        coalescer = InboundCoalescer(
+            start_turn=lambda phone, text: queue.submit(phone, CitiEngine.chat(phone, text))
+        )
+        coalescer.receive(phone, body)
+    """
+
+    def __init__(
+        self,
+        start_turn: Callable[[str, str], OutboundMessage],
+        window_ms: Optional[int] = None,
+    ):
+        self.start_turn = start_turn
+        self.window_ms = Config.sms_coalesce_ms if window_ms is None else window_ms
+        self.metrics = CoalescingMetrics()
+        self._turns: dict[str, PendingTurn] = {}
+
+    def receive(self, phone: str, message: str):
+        """
+        Adds a message to the phone's pending turn, and restarts its window
+        """
+        self.metrics.received += 1
+        turn = self._turns.get(phone)
+        if turn and turn.reply and turn.reply.sending:
+            # Too late to take the reply back, so the message starts a new turn
+            turn = None
+        if turn is None:
+            turn = self._turns[phone] = PendingTurn()
+        else:
+            self.metrics.merged += 1
+
+        if turn.reply:
+            logger.info(f"Restarting the turn for {phone} with a new message")
+            self.metrics.restarted += 1
+            reply, turn.reply = turn.reply, None
+            reply.cancel()
+
+        turn.messages.append(message)
+        if turn.timer:
+            turn.timer.cancel()
+        turn.timer = asyncio.get_running_loop().call_later(
+            self.window_ms / 1000, self._start, phone, turn
+        )
+
+    def _start(self, phone: str, turn: PendingTurn):
+        """
+        Private method to start a turn once its window has closed
+        """
+        turn.timer = None
+        self.metrics.turns += 1
+        reply = turn.reply = self.start_turn(phone, "\n".join(turn.messages))
+        reply.delivered.add_done_callback(lambda _: self._finish(phone, turn, reply))
+
+    def _finish(self, phone: str, turn: PendingTurn, reply: OutboundMessage):
+        """
+        Private method to forget a turn once its reply is done, unless a newer message has
+        restarted it
+        """
+        if self._turns.get(phone) is turn and turn.reply is reply:
+            del self._turns[phone]
@@ -0,0 +1,177 @@
+from functools import lru_cache
+from typing import Any, Literal, Optional
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+from citi_mesh.database._models import Address
+from citi_mesh.logging import get_logger
+from citi_mesh.model_cache import MODEL_CACHE_SIZE, CachedSchemaModel
+
+logger = get_logger(__name__)
+
+"""
+File contains the helpers used to map the columns of a tabular source straight onto resource
+fields. openai is asked for the mapping once, using the header and a sample of rows, and every
+row after that is turned into a resource with vectorized pandas operations
+"""
+
+# Resource fields that can be read straight from a column
+FIELD_COLUMNS = (
+    "name",
+    "description",
+    "phone_number",
+    "website",
+    "street",
+    "street2",
+    "city",
+    "state",
+    "zip_code",
+)
+# Address fields that every mapped address must have
+ADDRESS_FIELDS = ("street", "city", "state", "zip_code")
+
+MAPPING_SYSTEM_MESSAGE = """
+You are an expert at normalizing government and non-profit data.
+You will be provided the columns of a table of resources, along with a sample of its rows.
+Your task is to map the columns of the table to the fields of a resource.
+
+Only map a column to a field if the values in that column can be used as is for that field.
+If no column holds a field, or a field is spread across many columns, leave it null.
+
+If a column describes the kind of each resource, set it as the 'resource_type_column', and
+give a rule for each of its values that says which resource types it means. Otherwise, give the
+resource types that apply to every row in 'default_resource_types'.
+"""
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def create_column_mapping_model(columns: tuple[str, ...], resource_types: tuple[str, ...]):
+    """
+    Return a pydantic model class for openai to map the given columns onto resource fields.
+    Fields can only be mapped to one of 'columns', and types to one of 'resource_types'
+    """
+    Column = Optional[Literal[columns]]
+    ResourceTypeName = Literal[resource_types] if resource_types else str
+
+    ResourceTypeRule = create_model(
+        "ResourceTypeRule",
+        value=(str, Field(..., description="A value of the 'resource_type_column'")),
+        resource_types=(list[ResourceTypeName], ...),
+    )
+
+    field_definitions = {
+        field: (Column, Field(..., description=f"The column holding the resource's {field}"))
+        for field in FIELD_COLUMNS
+    }
+    return create_model(
+        "ColumnMapping",
+        __base__=CachedSchemaModel,
+        **field_definitions,
+        resource_type_column=(
+            Column,
+            Field(..., description="The column describing the kind of each resource"),
+        ),
+        resource_type_rules=(list[ResourceTypeRule], ...),
+        default_resource_types=(list[ResourceTypeName], ...),
+    )
+
+
+def _text(df: pd.DataFrame, column: Optional[str]) -> pd.Series:
+    """
+    Private function to get a column as stripped strings, with blanks as NA
+    """
+    if column is None or column not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype="string")
+    values = df[column].astype("string").str.strip()
+    # Whole numbers read as floats, i.e. zip codes or phone numbers, lose their '.0'
+    values = values.str.replace(r"^(\d+)\.0$", r"\1", regex=True)
+    return values.mask(values == "")
+
+
+def apply_column_mapping(
+    mapping: BaseModel, records: list[dict[str, Any]], resource_model: type[BaseModel]
+) -> tuple[list[BaseModel], list[int]]:
+    """
+    Turns rows into resources using a mapping from 'create_column_mapping_model'. Rows are
+    only mapped if they have a name, a description, either a full address or none at all, and
+    a resource type that the mapping knows about. A row that fails to build for any reason is
+    left unmapped, so one bad row never sends the whole batch to openai. Nothing is geocoded
+    here, addresses are only resolved once the resources are saved.
+
+    args:
+        - mapping(BaseModel): The column mapping given by openai
+        - records(list[dict]): The rows of the source
+        - resource_model(type[BaseModel]): The model to build resources with, the same one used
+            for resources parsed by openai
+
+    returns:
+        tuple[list[BaseModel], list[int]]: The resources built, where 'source_index' is the
+            index of the row it was built from, and the indexes of the rows that could not
+            be mapped
+    """
+    df = pd.DataFrame.from_records(records)
+    fields = {field: _text(df, getattr(mapping, field)) for field in FIELD_COLUMNS}
+    # Restore the leading zeros of zip codes read as numbers
+    zip_code = fields["zip_code"]
+    fields["zip_code"] = zip_code.mask(
+        zip_code.str.fullmatch(r"\d{3,4}").fillna(False), zip_code.str.zfill(5)
+    )
+
+    mappable = fields["name"].notna() & fields["description"].notna()
+    address_parts = pd.concat([fields[field].notna() for field in ADDRESS_FIELDS], axis=1)
+    has_address = address_parts.all(axis=1)
+    mappable &= has_address | ~address_parts.any(axis=1)
+
+    if mapping.resource_type_column:
+        rules = {
+            rule.value.strip().lower(): list(rule.resource_types)
+            for rule in mapping.resource_type_rules
+        }
+        resource_types = _text(df, mapping.resource_type_column).str.lower().map(rules)
+        mappable &= resource_types.notna()
+    else:
+        resource_types = pd.Series(
+            [list(mapping.default_resource_types)] * len(df), index=df.index, dtype=object
+        )
+
+    # Swap NA for None, so values can be handed to pydantic
+    values = pd.DataFrame(fields)
+    values = values.astype(object).where(values.notna(), None)
+    values["resource_types"] = resource_types
+    values["has_address"] = has_address
+
+    resources, unmapped = [], np.flatnonzero(~mappable.to_numpy()).tolist()
+    # Rows at the same address share a single Address, so each one is only validated once.
+    # Validating an Address only normalizes it, it is not geocoded until it is saved
+    addresses = {}
+    mapped_rows = values[mappable].to_dict("records")
+    for index, row in zip(np.flatnonzero(mappable.to_numpy()), mapped_rows):
+        try:
+            address = None
+            if row["has_address"]:
+                address_values = {field: row[field] for field in ADDRESS_FIELDS + ("street2",)}
+                key = tuple(address_values.values())
+                if key not in addresses:
+                    addresses[key] = Address(**address_values)
+                address = addresses[key]
+            resources.append(
+                resource_model(
+                    name=row["name"],
+                    description=row["description"],
+                    phone_number=row["phone_number"],
+                    website=row["website"],
+                    address=address,
+                    resource_types=row["resource_types"],
+                    source_index=int(index),
+                )
+            )
+        except ValidationError:
+            # Values that can not be used as is are left for openai
+            unmapped.append(int(index))
+        except Exception as e:
+            logger.warning(f"Could not map row {index}, leaving it for openai: {e!r}")
+            unmapped.append(int(index))
+
+    return resources, sorted(unmapped)
@@ -1,7 +1,9 @@
 import os
+from typing import Literal, Optional
 
 from pydantic import Field
 from pydantic_settings import BaseSettings
+from sqlalchemy.engine import URL
 
 
 class CitimeshConfig(BaseSettings):
@@ -11,34 +13,110 @@ class CitimeshConfig(BaseSettings):
     temperature: float = Field(default=0.4)
     default_model_parameters: dict = Field(default_factory=dict)
 
+    # LLM rate limiting, see 'citi_mesh.scheduler.LLMScheduler'
+    llm_max_concurrency: int = Field(default=8)
+    llm_requests_per_minute: int = Field(default=500)
+    llm_tokens_per_minute: int = Field(default=200_000)
+    llm_max_retries: int = Field(default=5)
+    llm_backoff_base: float = Field(default=1.0)
+    llm_backoff_max: float = Field(default=60.0)
+
+    # openai response caching, see 'citi_mesh.llm_cache.LLMCache'
+    llm_cache_mode: Literal["off", "read_write", "replay"] = Field(default="off")
+    llm_cache_dir: str = Field(default=".llm_cache")
+    llm_cache_max_bytes: int = Field(default=512 * 1024 * 1024)
+
+    # Moderation configuration, see 'citi_mesh.moderation.ModerationCache'
+    moderation_batch_size: int = Field(default=32)
+    moderation_cache_size: int = Field(default=100_000)
+
+    # Ingestion configuration
+    ingestion_chunk_tokens: int = Field(default=4000)
+    ingestion_workers: int = Field(default=2)
+    ingestion_upload_dir: str = Field(default="uploads")
+    ingestion_heartbeat_seconds: float = Field(default=15.0)
+    ingestion_stale_seconds: float = Field(default=120.0)
+    ingestion_sweep_seconds: float = Field(default=60.0)
+    # Jobs whose worker dies this many times are failed instead of picked up again
+    ingestion_max_attempts: int = Field(default=3)
+
     # Database configuration
     default_database_name: str = Field(default="dev")
     default_database_connection_url: str = Field(default="")
     server: str = Field(default="citimesh-{env}.database.windows.net")
     database: str = Field(default="Resources")
     db_username: str = Field(default="azureadmin")
-    db_password: str = Field(default=os.getenv("SQL_ADMIN_PASSWORD"))
+    db_password: Optional[str] = Field(default=os.getenv("SQL_ADMIN_PASSWORD"))
     db_driver: str = Field(default="ODBC Driver 18 for SQL Server")
 
+    # Database engine configuration
+    db_pool_size: int = Field(default=5)
+    db_max_overflow: int = Field(default=10)
+    db_pool_timeout: float = Field(default=30.0)
+    db_pool_pre_ping: bool = Field(default=True)
+    db_pool_recycle: int = Field(default=1800)
+    # The number of compiled SQL statements SQLAlchemy keeps per engine ('query_cache_size'),
+    # not a prepared statement cache in the database driver
+    db_compiled_cache_size: int = Field(default=500)
+    sqlite_mmap_size: int = Field(default=256 * 1024 * 1024)
+
+    # Twilio configuration, see 'citi_mesh.sms.TwilioSender'
+    twilio_base_url: str = Field(default="https://api.twilio.com")
+    twilio_max_connections: int = Field(default=10)
+    twilio_timeout: float = Field(default=10.0)
+
+    # Google Maps configuration, can be swapped for a local stand-in
+    google_maps_base_url: str = Field(default="https://maps.googleapis.com")
+
+    # Outbound SMS, see 'citi_mesh.dispatch.SMSDispatchQueue'
+    sms_messages_per_second: float = Field(default=1.0)
+    sms_dispatch_workers: int = Field(default=4)
+    sms_drain_seconds: float = Field(default=5.0)
+    sms_ack_after_seconds: float = Field(default=3.0)
+    sms_coalesce_ms: int = Field(default=1500)
+
+    # Webhook retries, see 'citi_mesh.idempotency.WebhookDeduplicator'
+    webhook_dedup_backend: Literal["memory", "database"] = Field(default="memory")
+    webhook_dedup_ttl_seconds: float = Field(default=3600)
+
+    # Readiness probe, see 'citi_mesh.health.HealthMonitor'
+    health_check_interval: float = Field(default=10.0)
+    health_upstream_timeout: float = Field(default=2.0)
+    health_max_loop_lag: float = Field(default=0.5)
+    # Reports synchronous calls that block the event loop, see 'citi_mesh.blocking'
+    blocking_detector_enabled: bool = Field(default=False)
+    blocking_threshold: float = Field(default=0.1)
+
     # Service configuration
     conversation_expiration: int = Field(default=30)
+    # Where conversations are kept, see 'citi_mesh.engine.conversations'. Use 'database' when
+    # running more than one worker
+    conversation_store: Literal["memory", "database"] = Field(default="memory")
 
     def __init__(self, **values):
         super().__init__(**values)
         # Set the database connection URL after the initial values have been set
-        if not self.default_database_connection_url:
+        # Without a SQL Server password, fallback to a local SQLite database for development
+        if not self.default_database_connection_url and not self.db_password:
+            self.default_database_connection_url = "sqlite:///dev.db"
+        elif not self.default_database_connection_url:
             pyoodbc_str = (
                 "Driver={" + self.db_driver + "};"
                 f"Server=tcp:{self.server.format(env='dev')},1433;"
                 f"Database={self.database};"
                 f"Uid={self.db_username};"
-                "Pwd={" + self.db_password + "};"
+                # A '}' in the password is escaped by doubling it
+                "Pwd={" + self.db_password.replace("}", "}}") + "};"
                 "Authentication=SqlPassword;"
                 "Encrypt=yes;"
                 "TrustServerCertificate=yes;"
                 "Connection Timeout=30;"
             )
-            self.default_database_connection_url = f"mssql+pyodbc:///?odbc_connect={pyoodbc_str}"
+            # Built with URL.create, so the connection string is quoted and a password with i.e.
+            # '&' or '#' in it survives being parsed back with 'make_url'
+            self.default_database_connection_url = URL.create(
+                "mssql+pyodbc", query={"odbc_connect": pyoodbc_str}
+            ).render_as_string(hide_password=False)
 
 
 Config = CitimeshConfig()
@@ -0,0 +1,136 @@
+import re
+
+"""
+File contains the helpers used to normalize addresses into a natural key, so that the same
+building written different ways resolves to a single row in the database
+"""
+
+_STREET_ABBREVIATIONS = {
+    "avenue": "ave",
+    "av": "ave",
+    "boulevard": "blvd",
+    "circle": "cir",
+    "court": "ct",
+    "drive": "dr",
+    "expressway": "expy",
+    "highway": "hwy",
+    "lane": "ln",
+    "parkway": "pkwy",
+    "place": "pl",
+    "plaza": "plz",
+    "road": "rd",
+    "square": "sq",
+    "street": "st",
+    "terrace": "ter",
+    "turnpike": "tpke",
+    "north": "n",
+    "south": "s",
+    "east": "e",
+    "west": "w",
+    "northeast": "ne",
+    "northwest": "nw",
+    "southeast": "se",
+    "southwest": "sw",
+}
+
+_STATE_ABBREVIATIONS = {
+    "alabama": "al",
+    "alaska": "ak",
+    "arizona": "az",
+    "arkansas": "ar",
+    "california": "ca",
+    "colorado": "co",
+    "connecticut": "ct",
+    "delaware": "de",
+    "district of columbia": "dc",
+    "florida": "fl",
+    "georgia": "ga",
+    "hawaii": "hi",
+    "idaho": "id",
+    "illinois": "il",
+    "indiana": "in",
+    "iowa": "ia",
+    "kansas": "ks",
+    "kentucky": "ky",
+    "louisiana": "la",
+    "maine": "me",
+    "maryland": "md",
+    "massachusetts": "ma",
+    "michigan": "mi",
+    "minnesota": "mn",
+    "mississippi": "ms",
+    "missouri": "mo",
+    "montana": "mt",
+    "nebraska": "ne",
+    "nevada": "nv",
+    "new hampshire": "nh",
+    "new jersey": "nj",
+    "new mexico": "nm",
+    "new york": "ny",
+    "north carolina": "nc",
+    "north dakota": "nd",
+    "ohio": "oh",
+    "oklahoma": "ok",
+    "oregon": "or",
+    "pennsylvania": "pa",
+    "rhode island": "ri",
+    "south carolina": "sc",
+    "south dakota": "sd",
+    "tennessee": "tn",
+    "texas": "tx",
+    "utah": "ut",
+    "vermont": "vt",
+    "virginia": "va",
+    "washington": "wa",
+    "west virginia": "wv",
+    "wisconsin": "wi",
+    "wyoming": "wy",
+}
+
+# Matches unit designators and their value, i.e. 'Apt 4B', 'Suite 200', 'Fl. 3', '#12'
+_UNIT_PATTERN = re.compile(
+    r"(?:\b(?:apt|apartment|suite|ste|unit|fl|floor|rm|room|bldg|building|dept)\b\.?|#)\s*[\w-]*",
+    flags=re.IGNORECASE,
+)
+_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+
+
+def _clean(value: str) -> str:
+    """
+    Helper function to lowercase a value, and collapse any punctuation and whitespace
+    """
+    value = _PUNCTUATION_PATTERN.sub(" ", (value or "").lower())
+    return " ".join(value.split())
+
+
+def normalize_street(street: str) -> str:
+    """
+    Normalizes a street line by removing any unit and abbreviating street types and directions
+    I.E
+        '350 Fifth Avenue, Suite 3300' -> '350 fifth ave'
+    """
+    street = _UNIT_PATTERN.sub(" ", street or "")
+    return " ".join(_STREET_ABBREVIATIONS.get(token, token) for token in _clean(street).split())
+
+
+def normalize_state(state: str) -> str:
+    state = _clean(state)
+    return _STATE_ABBREVIATIONS.get(state, state)
+
+
+def normalize_zip(zip_code: str) -> str:
+    """
+    Reduces a zip code to its first 5 digits, i.e. '10118-0110' -> '10118'
+    """
+    return re.sub(r"\D", "", zip_code or "")[:5]
+
+
+def normalize_address_key(street: str, city: str, state: str, zip_code: str) -> str:
+    """
+    Creates the natural key of an address. Addresses that only differ by case, punctuation,
+    abbreviations, unit or zip+4 share the same key. 'street2' is not a part of the key, as it
+    only ever holds the unit.
+    """
+    return "|".join(
+        [normalize_street(street), _clean(city), normalize_state(state), normalize_zip(zip_code)]
+    )
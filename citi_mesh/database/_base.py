@@ -1,16 +1,19 @@
+import base64
 import re
 import uuid
 from datetime import datetime, timezone
-from typing import Any, Optional, Self
+from functools import cache
+from typing import Any, AsyncIterator, Optional, Self
 
 from pydantic import BaseModel, ConfigDict, Field
 from pydantic.json_schema import SkipJsonSchema
-from sqlalchemy import Column, DateTime, String, select
+from sqlalchemy import Column, DateTime, Select, String, and_, insert, or_, select
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession
 from sqlalchemy.inspection import inspect
 from sqlalchemy.orm import Load, declarative_base, selectinload
 
-from citi_mesh.database._exceptions import InstanceNotFound
+from citi_mesh.database._exceptions import InstanceNotFound, InvalidCursor
 
 
 def _to_snake_case(name: str) -> str:
@@ -23,6 +26,41 @@ def _to_snake_case(name: str) -> str:
     return name
 
 
+def _encode_cursor(created_at: datetime, id_: str) -> str:
+    """
+    Helper function to pack a keyset position into an opaque, url-safe cursor string
+    """
+    raw = f"{created_at.isoformat()}|{id_}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """
+    Helper function to unpack a cursor created by '_encode_cursor'. Raises InvalidCursor if the
+    cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, id_ = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), id_
+    except (UnicodeError, ValueError) as e:
+        raise InvalidCursor(cursor=cursor) from e
+
+
+@cache
+def _column_keys(model_cls: type) -> tuple[str, ...]:
+    """
+    Helper function to get the columns of a model's orm class that are also fields on the model
+    """
+    columns = inspect(model_cls.__ormclass__).columns
+    return tuple(column.key for column in columns if column.key in model_cls.model_fields)
+
+
+# Max number of bound parameters to put in a single 'IN' clause. SQL Server caps a statement at
+# 2100 parameters
+IN_CLAUSE_CHUNK_SIZE = 1000
+
+
 # Declare the database's Base
 Base = declarative_base()
 
@@ -41,8 +79,8 @@ class SQLTable(Base, AsyncAttrs):
     __abstract__ = True
 
     id = Column(String(length=128), primary_key=True, default=lambda: str(uuid.uuid4()))
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
-    updated_at = Column(DateTime, default=datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
@@ -63,12 +101,26 @@ class SQLModel(BaseModel):
             class given its corresponding ID in the database.
         - async sync_to_db(session: AsyncSession): Syncs any updated data in the class with its
             respective table (and subtables) in the db
+        - async list_page(session: AsyncSession, ...): Returns a page of instances ordered by
+            '(created_at, id)' along with a cursor to the next page
+        - async stream(session: AsyncSession, ...): Yields every matching instance from a
+            server-side cursor
+        - async upsert_many(session: AsyncSession, instances: list): Upserts many instances in
+            a single transaction, returning a result for each
+        - async insert_many(session: AsyncSession, instances: list): Inserts many new instances
+            in bulk, without their relationships
+        - async link_existing(session: AsyncSession, instances: list): Points instances at rows
+            that are already saved under another id, called before they are upserted
+
+    Methods:
+        - async resolve(): Fills in any fields that need I/O (i.e. geocoding) before the
+            instance is saved
     """
 
     __ormclass__ = None
     id: SkipJsonSchema[str] = Field(default_factory=lambda: str(uuid.uuid4()))
-    created_at: SkipJsonSchema[datetime] = Field(default=datetime.now(timezone.utc))
-    updated_at: SkipJsonSchema[datetime] = Field(default=datetime.now(timezone.utc))
+    created_at: SkipJsonSchema[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: SkipJsonSchema[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -124,6 +176,107 @@ class SQLModel(BaseModel):
 
         return cls.model_validate(instance)
 
+    @classmethod
+    def indexed_columns(cls) -> dict[str, type]:
+        """
+        Returns the columns of the orm class that are backed by an index (and are therefor cheap
+        to filter on), mapped to their python type. Only the leading column of a composite index
+        is included, as it is the only one the index can serve on its own.
+        """
+        table = cls.__ormclass__.__table__
+        names = {index.columns[0].name for index in table.indexes}
+        names.update(column.name for column in table.columns if column.unique)
+        # 'created_at' and 'id' are reserved for the pagination cursor
+        names -= {"id", "created_at"}
+        return {
+            column.name: column.type.python_type
+            for column in table.columns
+            if column.name in names
+        }
+
+    @classmethod
+    def _keyset_query(
+        cls, filters: dict[str, Any], after: Optional[tuple[datetime, str]] = None
+    ) -> Select:
+        """
+        Private method to build a query ordered by '(created_at, id)', starting after the given
+        keyset position. Filters must only reference columns from 'indexed_columns'.
+        """
+        orm_cls = cls.__ormclass__
+        load_opts = cls._build_load_options(orm_cls, 2)
+        stmt = select(orm_cls).options(*load_opts)
+
+        for name, value in filters.items():
+            stmt = stmt.where(getattr(orm_cls, name) == value)
+
+        if after:
+            created_at, id_ = after
+            # Expanded form of '(created_at, id) > (:created_at, :id)', as row value
+            # comparisons are not supported by every backend (i.e. SQL Server)
+            stmt = stmt.where(
+                or_(
+                    orm_cls.created_at > created_at,
+                    and_(orm_cls.created_at == created_at, orm_cls.id > id_),
+                )
+            )
+
+        return stmt.order_by(orm_cls.created_at, orm_cls.id)
+
+    @classmethod
+    async def list_page(
+        cls,
+        session: AsyncSession,
+        filters: Optional[dict[str, Any]] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> tuple[list[Self], Optional[str]]:
+        """
+        Returns a single page of instances using keyset pagination on '(created_at, id)'.
+
+        args:
+            session(AsyncSession): An Async SQLAlchemy Session object
+            filters(dict): Equality filters, keyed by names from 'indexed_columns'
+            limit(int): The max number of instances to return
+            cursor(str): The 'next_cursor' returned from the previous page, if any
+
+        returns:
+            tuple[list[Self], Optional[str]]: The page of instances, and the cursor for the next
+                page. The cursor is None when there are no more pages
+        """
+        after = _decode_cursor(cursor) if cursor else None
+        # Fetch one extra row to know if there is another page without a COUNT query
+        stmt = cls._keyset_query(filters or {}, after=after).limit(limit + 1)
+        instances = list((await session.execute(stmt)).scalars())
+
+        next_cursor = None
+        if len(instances) > limit:
+            instances = instances[:limit]
+            next_cursor = _encode_cursor(instances[-1].created_at, instances[-1].id)
+
+        return [cls.model_validate(instance) for instance in instances], next_cursor
+
+    @classmethod
+    async def stream(
+        cls,
+        session: AsyncSession,
+        filters: Optional[dict[str, Any]] = None,
+        batch_size: int = 500,
+    ) -> AsyncIterator[Self]:
+        """
+        Yields every matching instance, ordered by '(created_at, id)'. Rows are fetched from a
+        server-side cursor 'batch_size' at a time, so memory stays constant regardless of how
+        many rows match.
+
+        args:
+            session(AsyncSession): An Async SQLAlchemy Session object
+            filters(dict): Equality filters, keyed by names from 'indexed_columns'
+            batch_size(int): The number of rows to buffer from the cursor at a time
+        """
+        stmt = cls._keyset_query(filters or {}).execution_options(yield_per=batch_size)
+        result = await session.stream_scalars(stmt)
+        async for instance in result:
+            yield cls.model_validate(instance)
+
     def _check_orm_fields(self, field_name) -> bool:
         """
         Private to check a 'field_name' in the orm model. This includes columns and relationships.
@@ -137,6 +290,31 @@ class SQLModel(BaseModel):
 
         return field_name in columns or field_name in relationship_names
 
+    async def resolve(self):
+        """
+        Hook to fill in fields that need I/O before the instance is saved, such as looking up
+        an address' google place id. Kept out of validation, so validating never blocks on the
+        network. Does nothing by default
+        """
+        pass
+
+    @classmethod
+    async def link_existing(cls, session: AsyncSession, instances: list[Self]):
+        """
+        Hook to point instances, or the models nested in them, at rows that are already saved
+        under another id (i.e. an address that is already saved under the same normalized key),
+        so upserting them does not break a unique constraint. Called by 'upsert' and
+        'upsert_many'. Does nothing by default
+        """
+        pass
+
+    def to_row(self) -> dict[str, Any]:
+        """
+        Returns the values of the instance's own columns, without any relationships. Used for
+        bulk inserts, where building the full orm object of each instance is too slow.
+        """
+        return {key: getattr(self, key) for key in _column_keys(type(self))}
+
     def to_orm(
         self,
         parent_id: Optional[str] = None,
@@ -202,7 +380,93 @@ class SQLModel(BaseModel):
             - session(AsyncSession): An Async SQLAlchemy Session object
 
         """
+        await type(self).link_existing(session, [self])
         instance = self.to_orm()
         await session.merge(instance)
         await session.commit()
         await session.flush()
+
+    @classmethod
+    async def insert_many(cls, session: AsyncSession, instances: list[Self]):
+        """
+        Inserts many new instances in bulk, with a single executemany per table. Unlike
+        'upsert_many', relationships are not written and instances must not exist yet. Does
+        not commit.
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - instances(list[SQLModel]): The instances to insert
+        """
+        if instances:
+            await session.execute(
+                insert(cls.__ormclass__.__table__), [instance.to_row() for instance in instances]
+            )
+
+    @classmethod
+    async def upsert_many(cls, session: AsyncSession, instances: list[Self]) -> list[dict]:
+        """
+        Upserts many instances into the database in a single transaction.
+
+        Existing rows are loaded up front in batched 'IN' queries, so that merging does not need
+        a SELECT per entity. Autoflush is off while merging, so all writes are sent in a single
+        flush, inside a savepoint. If that flush fails, only the savepoint is rolled back, and
+        the batch is retried with a savepoint per instance so that only the bad instances are
+        rejected.
+
+        The fallback is not free: rows that were changed by the failed flush are expired, so
+        each is loaded again with its own SELECT, and each instance is flushed on its own. A
+        batch with one bad instance costs about one round trip per instance, instead of one
+        for the whole batch.
+
+        Rows are merged instead of written with the dialect's 'INSERT ... ON CONFLICT DO
+        UPDATE', as merging also writes the nested relationships (i.e. a resource's address and
+        resource types), which a single upsert statement can not.
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - instances(list[SQLModel]): The instances to upsert
+
+        returns:
+            list[dict]: One result per instance, in order, with the keys 'id', 'status' ("ok"
+                or "error") and 'detail' (the error message, if any)
+        """
+        await cls.link_existing(session, instances)
+        orm_cls = cls.__ormclass__
+        load_opts = cls._build_load_options(orm_cls, 2)
+        ids = [instance.id for instance in instances]
+        # The session only holds weak references to the rows it loads, so they are kept here
+        # until the upsert is done, or merging would SELECT each of them again
+        loaded = []
+        for i in range(0, len(ids), IN_CLAUSE_CHUNK_SIZE):
+            stmt = (
+                select(orm_cls)
+                .options(*load_opts)
+                .where(orm_cls.id.in_(ids[i : i + IN_CLAUSE_CHUNK_SIZE]))
+            )
+            loaded.extend((await session.execute(stmt)).scalars())
+
+        try:
+            async with session.begin_nested():
+                # Merges only look up rows that were not loaded above, never flushing
+                with session.no_autoflush:
+                    for instance in instances:
+                        await session.merge(instance.to_orm())
+            await session.commit()
+            return [{"id": instance.id, "status": "ok", "detail": None} for instance in instances]
+        except SQLAlchemyError:
+            # Leaving the savepoint rolled it back, the rows loaded above are kept
+            pass
+
+        # Fall back to isolating each instance to find the ones that failed
+        results = []
+        for instance in instances:
+            try:
+                async with session.begin_nested():
+                    await session.merge(instance.to_orm())
+                results.append({"id": instance.id, "status": "ok", "detail": None})
+            except SQLAlchemyError as e:
+                detail = str(getattr(e, "orig", None) or e)
+                results.append({"id": instance.id, "status": "error", "detail": detail})
+        await session.commit()
+
+        return results
@@ -6,3 +6,13 @@ class InstanceNotFound(Exception):
     def __init__(self, id_: str, model: str):
         self.message = f"{model} instance not found with id {id_}"
         super().__init__(self.message)
+
+
+class InvalidCursor(Exception):
+    """
+    Exception to be raised when a pagination cursor cannot be decoded
+    """
+
+    def __init__(self, cursor: str):
+        self.message = f"Invalid pagination cursor: {cursor}"
+        super().__init__(self.message)
@@ -1,14 +1,24 @@
+import asyncio
 import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from typing import List, Optional
 
 import googlemaps
 from pydantic import Field, model_validator
 from pydantic.json_schema import SkipJsonSchema
-from sqlalchemy import select
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from citi_mesh.config import Config
 from citi_mesh.database import _tables
-from citi_mesh.database._base import SQLModel
+from citi_mesh.database._address import normalize_address_key
+from citi_mesh.database._base import IN_CLAUSE_CHUNK_SIZE, SQLModel
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
 
 """
 File contains all CRUD models to be used to access and change information in the database.
@@ -17,6 +27,29 @@ Models can also be used with FastAPI as Request / Response bodies
 """
 
 
+# Place ids found so far, by the address' normalized key. Failed lookups are not kept, so they
+# are tried again next time
+_PLACE_IDS: OrderedDict[str, str] = OrderedDict()
+_PLACE_IDS_SIZE = 4096
+# The number of times an address is saved again when another writer takes its key first
+_CLAIM_ATTEMPTS = 3
+
+
+def _find_google_place_id(query: str) -> Optional[str]:
+    """
+    Helper function to look up the google place id of an address. Blocks on the network, so
+    should be run in a thread
+    """
+    client = googlemaps.Client(
+        key=os.environ["GOOGLE_MAPS_KEY"], base_url=Config.google_maps_base_url
+    )
+    res = client.find_place(query, input_type="textquery")
+    try:
+        return res["candidates"][0]["place_id"]
+    except (IndexError, KeyError):
+        return None
+
+
 class Address(SQLModel):
     __ormclass__ = _tables.AddressTable
 
@@ -26,23 +59,120 @@ class Address(SQLModel):
     state: str
     zip_code: str
     google_place_id: SkipJsonSchema[Optional[str]] = Field(default=None)
+    normalized_key: SkipJsonSchema[Optional[str]] = Field(default=None)
 
     @model_validator(mode="after")
-    def get_google_place_id(self):
+    def set_normalized_key(self):
+        # Addresses that are already normalized are validated again whenever they are nested
+        # in another model, so only normalize them once
+        if not self.normalized_key:
+            self.normalized_key = normalize_address_key(
+                street=self.street, city=self.city, state=self.state, zip_code=self.zip_code
+            )
+        return self
+
+    @property
+    def query(self) -> str:
         """
-        Example logic to auto-populate google_place_id
-        (only if you really want to do this at model validation time).
+        The address as written, for geocoding
         """
-        client = googlemaps.Client(key=os.environ["GOOGLE_MAPS_KEY"])
-        address_str = (
-            f"{self.street} {self.street2 or ''}, {self.city}, {self.state}, {self.zip_code}"
-        )
-        res = client.find_place(address_str, input_type="textquery")
-        try:
-            self.google_place_id = res["candidates"][0]["place_id"]
-        except IndexError:
-            self.google_place_id = None
-        return self
+        return f"{self.street}, {self.city}, {self.state} {self.zip_code}"
+
+    async def resolve(self):
+        """
+        Looks up the google place id of the address, unless it already has one. Lookups are
+        cached by normalized key, so the same building is only geocoded once per process. A
+        failed lookup is logged and leaves the place id empty
+        """
+        if self.google_place_id:
+            return
+        place_id = _PLACE_IDS.get(self.normalized_key)
+        if place_id is None:
+            try:
+                place_id = await asyncio.to_thread(_find_google_place_id, self.query)
+            except Exception as e:
+                logger.warning(f"Could not geocode '{self.query}': {e!r}")
+                return
+            if place_id is None:
+                return
+            _PLACE_IDS[self.normalized_key] = place_id
+            while len(_PLACE_IDS) > _PLACE_IDS_SIZE:
+                _PLACE_IDS.popitem(last=False)
+        _PLACE_IDS.move_to_end(self.normalized_key)
+        self.google_place_id = place_id
+
+    @classmethod
+    async def get_ids_by_key(cls, session: AsyncSession, keys: set[str]) -> dict[str, str]:
+        """
+        Returns the ids of any existing addresses with the given normalized keys
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - keys(set[str]): Normalized keys, see 'normalize_address_key'
+
+        returns:
+            dict[str, str]: Maps normalized keys to the id of the address that has it
+        """
+        keys = list(keys)
+        ids = {}
+        for i in range(0, len(keys), IN_CLAUSE_CHUNK_SIZE):
+            stmt = select(_tables.AddressTable.normalized_key, _tables.AddressTable.id).where(
+                _tables.AddressTable.normalized_key.in_(keys[i : i + IN_CLAUSE_CHUNK_SIZE])
+            )
+            ids.update({key: id_ for key, id_ in await session.execute(stmt)})
+        return ids
+
+    @classmethod
+    async def claim_keys(cls, session: AsyncSession, addresses: list["Address"]) -> dict[str, str]:
+        """
+        Saves the addresses whose normalized key is not saved yet, and returns the id of the
+        address saved under every key. Addresses that share a key share the first one's row,
+        and only addresses that are new to the database are geocoded.
+
+        Another writer can save the same key in the meantime, i.e. a second ingestion worker.
+        The insert then fails on the unique key, so the keys are looked up again and the other
+        writer's rows are used instead. Does not commit.
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - addresses(list[Address]): The addresses to save
+
+        returns:
+            dict[str, str]: Maps normalized keys to the id of the address saved under it
+        """
+        ids = await cls.get_ids_by_key(session, {a.normalized_key for a in addresses})
+        # An address with a new key whose id is already saved was edited. Its row can be shared
+        # with other resources, so the edit is saved as a new address instead of changing it
+        candidates = [a.id for a in addresses if a.normalized_key not in ids]
+        saved = set()
+        for i in range(0, len(candidates), IN_CLAUSE_CHUNK_SIZE):
+            stmt = select(_tables.AddressTable.id).where(
+                _tables.AddressTable.id.in_(candidates[i : i + IN_CLAUSE_CHUNK_SIZE])
+            )
+            saved.update((await session.execute(stmt)).scalars())
+        for address in addresses:
+            if address.id in saved:
+                address.id = str(uuid.uuid4())
+
+        for attempt in range(_CLAIM_ATTEMPTS):
+            new = {}
+            for address in addresses:
+                if address.normalized_key not in ids:
+                    new.setdefault(address.normalized_key, address)
+            if not new:
+                break
+            await asyncio.gather(*(address.resolve() for address in new.values()))
+            try:
+                async with session.begin_nested():
+                    await cls.insert_many(session, list(new.values()))
+            except IntegrityError:
+                if attempt == _CLAIM_ATTEMPTS - 1:
+                    raise
+                # Another writer saved some of the keys first, use its rows instead
+                ids.update(await cls.get_ids_by_key(session, set(new)))
+                continue
+            ids.update({key: address.id for key, address in new.items()})
+        return ids
 
 
 class ResourceType(SQLModel):
@@ -64,10 +194,49 @@ class Resource(SQLModel):
     phone_number: Optional[str] = None
     website: Optional[str] = None
     address: Optional[Address] = None
+    retired_at: SkipJsonSchema[Optional[datetime]] = None
 
     # Many-to-many with ResourceType
     resource_types: List[ResourceType] = Field(default_factory=list)
 
+    async def resolve(self):
+        if self.address:
+            await self.address.resolve()
+
+    @classmethod
+    async def link_existing(cls, session: AsyncSession, instances: list["Resource"]):
+        # Resources at the same building share a single address row
+        addresses = [resource.address for resource in instances if resource.address]
+        if not addresses:
+            return
+        ids = await Address.claim_keys(session, addresses)
+        for address in addresses:
+            address.id = ids[address.normalized_key]
+
+    def to_row(self) -> dict:
+        row = super().to_row()
+        row["address_id"] = self.address.id if self.address else None
+        return row
+
+    @classmethod
+    async def insert_many(cls, session: AsyncSession, instances: list["Resource"]):
+        """
+        Inserts many new resources in bulk, along with the links to their resource types.
+        Addresses and resource types must already exist. Does not commit.
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - instances(list[Resource]): The resources to insert
+        """
+        await super().insert_many(session, instances)
+        links = [
+            {"resource_id": resource.id, "resource_type_id": resource_type.id}
+            for resource in instances
+            for resource_type in resource.resource_types
+        ]
+        if links:
+            await session.execute(insert(_tables.ResourceTypeLinkTable.__table__), links)
+
 
 class Repository(SQLModel):
     __ormclass__ = _tables.RepositoryTable
@@ -153,6 +322,7 @@ class Repository(SQLModel):
                 (
                     _tables.ResourceTypeTable.name.in_(resource_types)
                     & (_tables.ResourceTable.repository_id == self.id)
+                    & (_tables.ResourceTable.retired_at.is_(None))
                 )
             )
         )
@@ -166,6 +336,148 @@ class Source(SQLModel):
     source_type: str
     details: str
 
+    @classmethod
+    async def get_or_create(
+        cls, session: AsyncSession, repository_id: str, source_type: str, details: str
+    ) -> "Source":
+        """
+        Returns the Source matching the repository, type and details, creating it if this is
+        the first time it has been pulled. This keeps a single Source per url / file, so that
+        re-ingesting it can be compared against the previous pull.
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - repository_id(str): The id of the repository the source belongs to
+            - source_type(str): The '__source_type__' of the injestor
+            - details(str): The details identifying the source, i.e. the url
+        """
+        stmt = select(_tables.SourceTable).where(
+            (_tables.SourceTable.repository_id == repository_id)
+            & (_tables.SourceTable.source_type == source_type)
+            & (_tables.SourceTable.details == details)
+        )
+        instance = (await session.execute(stmt)).scalars().first()
+        if instance:
+            return cls.model_validate(instance)
+
+        source = cls(repository_id=repository_id, source_type=source_type, details=details)
+        session.add(source.to_orm())
+        await session.flush()
+        return source
+
+    async def get_content_hashes(self, session: AsyncSession) -> dict[str, set[Optional[str]]]:
+        """
+        Returns the content hash of every row / chunk previously pulled from this source, mapped
+        to the ids of the resources parsed from it
+        """
+        stmt = select(
+            _tables.SourceRecordTable.content_hash, _tables.SourceRecordTable.resource_id
+        ).where(_tables.SourceRecordTable.source_id == self.id)
+
+        hashes = {}
+        for content_hash, resource_id in await session.execute(stmt):
+            hashes.setdefault(content_hash, set()).add(resource_id)
+        return hashes
+
+    async def add_content_hashes(
+        self, session: AsyncSession, records: list[tuple[str, Optional[str]]]
+    ):
+        """
+        Records newly pulled rows / chunks of this source, in a single bulk insert. Does not
+        commit.
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - records(list[tuple]): Pairs of (content_hash, resource_id). resource_id should be
+                None for content that did not produce any resources
+        """
+        if records:
+            await session.execute(
+                insert(_tables.SourceRecordTable.__table__),
+                [
+                    {"source_id": self.id, "content_hash": content_hash, "resource_id": resource_id}
+                    for content_hash, resource_id in records
+                ],
+            )
+
+    async def retire_content_hashes(
+        self,
+        session: AsyncSession,
+        content_hashes: set[str],
+        known_hashes: dict[str, set[Optional[str]]],
+    ) -> int:
+        """
+        Removes rows / chunks that no longer exist in this source, and retires any resources that
+        are not also linked to content that still exists
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - content_hashes(set[str]): The hashes that have disappeared from the source
+            - known_hashes(dict): The result of 'get_content_hashes' from before the pull
+
+        returns:
+            int: The number of retired resources
+        """
+        removed_ids = set().union(*[known_hashes[h] for h in content_hashes])
+        kept_ids = set().union(*[ids for h, ids in known_hashes.items() if h not in content_hashes])
+        retired_ids = list(removed_ids - kept_ids - {None})
+        now = datetime.now(timezone.utc)
+
+        for i in range(0, len(retired_ids), IN_CLAUSE_CHUNK_SIZE):
+            await session.execute(
+                update(_tables.ResourceTable)
+                .where(_tables.ResourceTable.id.in_(retired_ids[i : i + IN_CLAUSE_CHUNK_SIZE]))
+                .values(retired_at=now, updated_at=now)
+            )
+
+        content_hashes = list(content_hashes)
+        for i in range(0, len(content_hashes), IN_CLAUSE_CHUNK_SIZE):
+            await session.execute(
+                delete(_tables.SourceRecordTable).where(
+                    (_tables.SourceRecordTable.source_id == self.id)
+                    & (
+                        _tables.SourceRecordTable.content_hash.in_(
+                            content_hashes[i : i + IN_CLAUSE_CHUNK_SIZE]
+                        )
+                    )
+                )
+            )
+
+        return len(retired_ids)
+
+    async def get_pages(self, session: AsyncSession) -> dict[str, dict]:
+        """
+        Returns the pages crawled the last time this source was pulled, keyed by url
+        """
+        stmt = select(_tables.SourcePageTable).where(_tables.SourcePageTable.source_id == self.id)
+        return {
+            page.url: {
+                "etag": page.etag,
+                "last_modified": page.last_modified,
+                "content_hashes": page.content_hashes or [],
+                "links": page.links or [],
+            }
+            for page in (await session.execute(stmt)).scalars()
+        }
+
+    async def replace_pages(self, session: AsyncSession, pages: dict[str, dict]):
+        """
+        Replaces the crawled pages of this source with the pages from the latest pull
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - pages(dict): Pages keyed by url, in the same format as 'get_pages'
+        """
+        await session.execute(
+            delete(_tables.SourcePageTable).where(_tables.SourcePageTable.source_id == self.id)
+        )
+        session.add_all(
+            [
+                _tables.SourcePageTable(source_id=self.id, url=url, **page)
+                for url, page in pages.items()
+            ]
+        )
+
 
 class Tenant(SQLModel):
     __ormclass__ = _tables.TenantTable
@@ -184,3 +496,250 @@ class Tenant(SQLModel):
         return list(
             filter(lambda repository: repository.name == repository_name, self.repositorys)
         )[0]
+
+
+class IngestionJob(SQLModel):
+    """
+    A request to pull resources from a source into a repository, processed in the background.
+    See 'citi_mesh.jobs.IngestionJobQueue'
+    """
+
+    __ormclass__ = _tables.IngestionJobTable
+
+    repository_id: str
+    source_type: str
+    details: str
+    options: Optional[dict] = None
+    # A path on the server, never sent back in responses
+    payload_path: SkipJsonSchema[Optional[str]] = Field(default=None, exclude=True)
+    status: str = "queued"
+    progress: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    heartbeat_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @staticmethod
+    def _is_stale(stale_seconds: float):
+        """
+        Private method to build the condition for a running job whose worker stopped sending
+        heartbeats, and so is assumed to have crashed
+        """
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+        return (_tables.IngestionJobTable.status == "running") & (
+            _tables.IngestionJobTable.heartbeat_at.is_(None)
+            | (_tables.IngestionJobTable.heartbeat_at < stale_before)
+        )
+
+    @classmethod
+    def _is_claimable(cls, stale_seconds: float, max_attempts: int):
+        """
+        Private method to build the condition for a job that can be picked up by a worker.
+        Crashed jobs are only picked up again until they have been tried 'max_attempts' times
+        """
+        return or_(
+            _tables.IngestionJobTable.status == "queued",
+            cls._is_stale(stale_seconds) & (_tables.IngestionJobTable.attempts < max_attempts),
+        )
+
+    @classmethod
+    async def get_claimable_ids(
+        cls, session: AsyncSession, stale_seconds: float, max_attempts: int
+    ) -> list[str]:
+        """
+        Returns the ids of all jobs that are queued, or were running on a worker that crashed
+        """
+        stmt = (
+            select(_tables.IngestionJobTable.id)
+            .where(cls._is_claimable(stale_seconds, max_attempts))
+            .order_by(_tables.IngestionJobTable.created_at)
+        )
+        return list((await session.execute(stmt)).scalars())
+
+    @classmethod
+    async def fail_exhausted(
+        cls, session: AsyncSession, stale_seconds: float, max_attempts: int
+    ) -> list[Optional[str]]:
+        """
+        Marks every crashed job that has already been tried 'max_attempts' times as failed, so
+        a job that keeps killing its worker is not picked up forever
+
+        returns:
+            list[Optional[str]]: The upload paths of the jobs that were failed
+        """
+        condition = cls._is_stale(stale_seconds) & (
+            _tables.IngestionJobTable.attempts >= max_attempts
+        )
+        stmt = select(_tables.IngestionJobTable.id, _tables.IngestionJobTable.payload_path)
+        rows = list(await session.execute(stmt.where(condition)))
+        if not rows:
+            return []
+        now = datetime.now(timezone.utc)
+        stmt = (
+            update(_tables.IngestionJobTable)
+            .where(condition & _tables.IngestionJobTable.id.in_([id_ for id_, _ in rows]))
+            .values(
+                status="failed",
+                error=f"Gave up after {max_attempts} attempts",
+                updated_at=now,
+                finished_at=now,
+            )
+        )
+        await session.execute(stmt)
+        await session.commit()
+        return [payload_path for _, payload_path in rows]
+
+    @classmethod
+    async def claim(
+        cls, session: AsyncSession, id_: str, stale_seconds: float, max_attempts: int
+    ) -> bool:
+        """
+        Marks a job as running, if no other worker has claimed it. Returns True if the claim
+        succeeded. The check and update is a single statement, so it is safe across processes.
+        """
+        now = datetime.now(timezone.utc)
+        stmt = (
+            update(_tables.IngestionJobTable)
+            .where(
+                (_tables.IngestionJobTable.id == id_)
+                & cls._is_claimable(stale_seconds, max_attempts)
+            )
+            .values(
+                status="running",
+                heartbeat_at=now,
+                updated_at=now,
+                attempts=_tables.IngestionJobTable.attempts + 1,
+            )
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    async def update_status(cls, session: AsyncSession, id_: str, **values):
+        """
+        Updates the status, progress, heartbeat or error of a job
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - id_(str): The id of the job
+            - values: The columns to update, i.e. status="succeeded"
+        """
+        values["updated_at"] = datetime.now(timezone.utc)
+        stmt = (
+            update(_tables.IngestionJobTable)
+            .where(_tables.IngestionJobTable.id == id_)
+            .values(**values)
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+
+class WebhookReceipt(SQLModel):
+    """
+    A webhook that has been accepted, so that retries of it can be ignored. See
+    'citi_mesh.idempotency.DatabaseDedupStore'
+    """
+
+    __ormclass__ = _tables.WebhookReceiptTable
+
+    @classmethod
+    async def record(cls, session: AsyncSession, id_: str) -> bool:
+        """
+        Records a webhook as accepted. Returns False if it was already recorded. The id is the
+        primary key, so only one worker can record the same webhook.
+        """
+        now = datetime.now(timezone.utc)
+        stmt = insert(_tables.WebhookReceiptTable.__table__).values(
+            id=id_, created_at=now, updated_at=now
+        )
+        try:
+            await session.execute(stmt)
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            return False
+        return True
+
+    @classmethod
+    async def purge(cls, session: AsyncSession, older_than: datetime) -> int:
+        """
+        Deletes every receipt recorded before 'older_than', returning how many were deleted
+        """
+        stmt = delete(_tables.WebhookReceiptTable).where(
+            _tables.WebhookReceiptTable.created_at < older_than
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
+
+
+class ConversationState(SQLModel):
+    """
+    The stored messages of a conversation with a phone. See
+    'citi_mesh.engine.conversations.SQLConversationStore'
+    """
+
+    __ormclass__ = _tables.ConversationStateTable
+
+    phone: str
+    messages: str
+    version: int = 0
+
+    @classmethod
+    async def from_phone(cls, session: AsyncSession, phone: str) -> Optional["ConversationState"]:
+        """
+        Returns the conversation with a phone, or None if there is not one
+        """
+        stmt = select(_tables.ConversationStateTable).where(
+            _tables.ConversationStateTable.phone == phone
+        )
+        row = (await session.execute(stmt)).scalar_one_or_none()
+        return cls.model_validate(row) if row else None
+
+    @classmethod
+    async def compare_and_set(
+        cls, session: AsyncSession, phone: str, messages: str, expected_version: int
+    ) -> bool:
+        """
+        Saves the messages of a conversation, only if it is still at 'expected_version'.
+        Returns False if someone else saved it first. A version of 0 means the conversation has
+        not been saved yet.
+        """
+        now = datetime.now(timezone.utc)
+        if expected_version == 0:
+            stmt = insert(_tables.ConversationStateTable.__table__).values(
+                id=str(uuid.uuid4()),
+                phone=phone,
+                messages=messages,
+                version=1,
+                created_at=now,
+                updated_at=now,
+            )
+        else:
+            stmt = (
+                update(_tables.ConversationStateTable)
+                .where(
+                    (_tables.ConversationStateTable.phone == phone)
+                    & (_tables.ConversationStateTable.version == expected_version)
+                )
+                .values(messages=messages, version=expected_version + 1, updated_at=now)
+            )
+        try:
+            result = await session.execute(stmt)
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            return False
+        return result.rowcount == 1
+
+    @classmethod
+    async def remove(cls, session: AsyncSession, phone: str):
+        """
+        Deletes the conversation with a phone
+        """
+        stmt = delete(_tables.ConversationStateTable).where(
+            _tables.ConversationStateTable.phone == phone
+        )
+        await session.execute(stmt)
+        await session.commit()
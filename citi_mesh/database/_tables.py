@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Index, String, Text
+from sqlalchemy import JSON, Column, DateTime, ForeignKey, Index, Integer, String, Text, text
 from sqlalchemy.orm import relationship
 
 from citi_mesh.database._base import SQLTable
@@ -43,6 +43,12 @@ class ResourceTable(SQLTable):
     phone_number = Column(String)
     website = Column(String)
     address_id = Column(String(length=128), ForeignKey("address.id"), nullable=True)
+    # Set when the source data the resource was parsed from no longer exists
+    retired_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("idx_resource_repository_id_created_at", "repository_id", "created_at", "id"),
+    )
 
     address = relationship("AddressTable", back_populates="resources")
 
@@ -64,6 +70,19 @@ class AddressTable(SQLTable):
     state = Column(String(16))  # e.g. US state abbreviations
     zip_code = Column(String(10))
     google_place_id = Column(String, nullable=True)
+    # See 'citi_mesh.database._address.normalize_address_key'
+    normalized_key = Column(String(256), nullable=True)
+
+    __table_args__ = (
+        # Filtered, as SQL Server only allows a single NULL in a unique index
+        Index(
+            "idx_address_normalized_key",
+            "normalized_key",
+            unique=True,
+            mssql_where=text("normalized_key IS NOT NULL"),
+            sqlite_where=text("normalized_key IS NOT NULL"),
+        ),
+    )
 
     # Relationships
     resources = relationship("ResourceTable", back_populates="address")
@@ -94,3 +113,73 @@ class SourceTable(SQLTable):
     repository_id = Column(String, ForeignKey("repository.id"))
     source_type = Column(String)
     details = Column(String)
+
+    __table_args__ = (
+        Index("idx_source_repository_id_source_type", "repository_id", "source_type", unique=False),
+    )
+
+
+class SourceRecordTable(SQLTable):
+    """
+    Content hash of a single row / chunk pulled from a source, linked to each resource that was
+    parsed from it. Rows that produced no resources are stored with a null resource_id, so they
+    are not sent to openai again.
+    """
+
+    source_id = Column(String(length=128), ForeignKey("source.id"))
+    content_hash = Column(String(length=64))
+    resource_id = Column(String(length=128), ForeignKey("resource.id"), nullable=True)
+
+    __table_args__ = (
+        Index("idx_source_record_source_id_content_hash", "source_id", "content_hash"),
+    )
+
+
+class SourcePageTable(SQLTable):
+    """
+    A page fetched by a crawl, with the validators used to conditionally re-fetch it, and what
+    was pulled from it last time, for when it has not changed
+    """
+
+    source_id = Column(String(length=128), ForeignKey("source.id"))
+    url = Column(String(length=2048))
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hashes = Column(JSON)
+    links = Column(JSON)
+
+    __table_args__ = (Index("idx_source_page_source_id", "source_id"),)
+
+
+class IngestionJobTable(SQLTable):
+    repository_id = Column(String(length=128), ForeignKey("repository.id"))
+    source_type = Column(String(length=32))
+    details = Column(String)
+    # Any extra arguments for the injestor, i.e. the depth of a crawl
+    options = Column(JSON, nullable=True)
+    # Where an uploaded source is kept until the job succeeds
+    payload_path = Column(String, nullable=True)
+    status = Column(String(length=16), index=True)
+    progress = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class WebhookReceiptTable(SQLTable):
+    """
+    A webhook that has been accepted, keyed by the id the sender gave it (i.e. Twilio's
+    'MessageSid'), so retries of the same webhook can be spotted across workers
+    """
+
+
+class ConversationStateTable(SQLTable):
+    """
+    The messages of a conversation with a phone, as a JSON array. 'version' is bumped on every
+    save, so that concurrent saves can be detected
+    """
+
+    phone = Column(String(length=32), unique=True, index=True)
+    messages = Column(Text)
+    version = Column(Integer, default=0)
@@ -0,0 +1,173 @@
+import threading
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from citi_mesh.config import CitimeshConfig
+
+"""
+File contains the factories used to create the database engines from the Citimesh Config, so
+that the app and any scripts share the same connection and pool settings
+"""
+
+# Maps a backend name to the driver to use for each type of engine. Only backends whose drivers
+# are in requirements.txt are listed, any other url is used as is
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "mssql": "mssql+aioodbc",
+}
+_SYNC_DRIVERS = {
+    "sqlite": "sqlite",
+    "mssql": "mssql+pyodbc",
+}
+
+
+@dataclass
+class PoolMetrics:
+    """
+    Running counters of how long connections wait to be checked out of an engine's pool
+    """
+
+    checkouts: int = 0
+    timeouts: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, wait_seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait_seconds": self.total_wait_seconds,
+                "avg_wait_seconds": self.total_wait_seconds / attempts if attempts else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+def _timed_pool_class(base: type[QueuePool], metrics: PoolMetrics) -> type[QueuePool]:
+    """
+    Helper function to create a subclass of a queue pool that records checkout wait times.
+
+    A class is created per engine (instead of passing the metrics to the pool) so that the
+    metrics survive the pool being recreated on 'engine.dispose()'
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = base._do_get(self)
+        except PoolTimeoutError:
+            metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        metrics.record(time.perf_counter() - start)
+        return connection
+
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get, "metrics": metrics})
+
+
+def _is_memory_sqlite(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _engine_kwargs(config: CitimeshConfig, url: URL, pool_base: type[QueuePool]) -> dict:
+    """
+    Helper function to build the keyword arguments shared by the sync and async engines
+    """
+    kwargs = {"query_cache_size": config.db_compiled_cache_size}
+    # In memory SQLite databases live inside a single connection, so they can not be pooled
+    if not _is_memory_sqlite(url):
+        kwargs.update(
+            poolclass=_timed_pool_class(pool_base, PoolMetrics()),
+            pool_size=config.db_pool_size,
+            max_overflow=config.db_max_overflow,
+            pool_timeout=config.db_pool_timeout,
+            pool_pre_ping=config.db_pool_pre_ping,
+            pool_recycle=config.db_pool_recycle,
+        )
+    return kwargs
+
+
+def _apply_sqlite_pragmas(engine: Engine, config: CitimeshConfig):
+    """
+    Helper function to set SQLite pragmas on every new connection. WAL mode lets readers run
+    alongside a writer, and synchronous=NORMAL is safe under WAL while skipping an fsync
+    per commit
+    """
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={int(config.sqlite_mmap_size)}")
+        cursor.close()
+
+
+def create_async_engine_from_config(config: CitimeshConfig) -> AsyncEngine:
+    """
+    Creates an async engine for the configured database, swapping in the async driver for the
+    backend if needed
+
+    args:
+        config(CitimeshConfig): The config to pull the url and pool settings from
+    """
+    url = make_url(config.default_database_connection_url)
+    url = url.set(drivername=_ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+    engine = create_async_engine(url, **_engine_kwargs(config, url, AsyncAdaptedQueuePool))
+    if url.get_backend_name() == "sqlite":
+        _apply_sqlite_pragmas(engine.sync_engine, config)
+    return engine
+
+
+def create_sync_engine_from_config(config: CitimeshConfig) -> Engine:
+    """
+    Creates a syncronous engine for the configured database, to be used by scripts such as the
+    database setup
+
+    args:
+        config(CitimeshConfig): The config to pull the url and pool settings from
+    """
+    url = make_url(config.default_database_connection_url)
+    url = url.set(drivername=_SYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+    engine = create_engine(url, **_engine_kwargs(config, url, QueuePool))
+    if url.get_backend_name() == "sqlite":
+        _apply_sqlite_pragmas(engine, config)
+    return engine
+
+
+def get_pool_status(engine: AsyncEngine | Engine) -> dict:
+    """
+    Returns the current state of an engine's pool, along with the checkout wait metrics if the
+    engine was created by this module
+    """
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    metrics = getattr(pool, "metrics", None)
+    if metrics:
+        status.update(metrics.snapshot())
+    return status
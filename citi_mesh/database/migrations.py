@@ -0,0 +1,89 @@
+import asyncio
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from citi_mesh.database import _tables
+from citi_mesh.database._address import normalize_address_key
+from citi_mesh.database._base import IN_CLAUSE_CHUNK_SIZE
+from citi_mesh.database._models import Address
+from citi_mesh.database.session import ENGINE, get_session
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+"""
+File contains one off data migrations, to be run against an existing database after upgrading.
+
+Usage:
+    python -m citi_mesh.database.migrations
+"""
+
+
+async def backfill_address_keys(session: AsyncSession) -> dict[str, int]:
+    """
+    Fills in the 'normalized_key' of addresses saved before addresses were deduplicated, so
+    that new resources are linked to them instead of creating another copy. Addresses that turn
+    out to be the same building as one that already has the key are merged into it: their
+    resources are pointed at the kept address, and the copy is deleted. Commits after every
+    batch, and is safe to run again.
+
+    args:
+        - session(AsyncSession): An Async SQLAlchemy Session object
+
+    returns:
+        dict[str, int]: The number of addresses that were given a key, merged and skipped
+    """
+    table = _tables.AddressTable
+    stmt = select(table.id).where(table.normalized_key.is_(None)).order_by(table.created_at)
+    ids = list((await session.execute(stmt)).scalars())
+    counts = {"keyed": 0, "merged": 0, "skipped": 0}
+
+    for i in range(0, len(ids), IN_CLAUSE_CHUNK_SIZE):
+        stmt = (
+            select(table.id, table.street, table.city, table.state, table.zip_code)
+            .where(table.id.in_(ids[i : i + IN_CLAUSE_CHUNK_SIZE]))
+            .order_by(table.created_at)
+        )
+        rows = list(await session.execute(stmt))
+        keys = {}
+        for id_, street, city, state, zip_code in rows:
+            if not (street and city and state and zip_code):
+                counts["skipped"] += 1
+                continue
+            keys[id_] = normalize_address_key(
+                street=street, city=city, state=state, zip_code=zip_code
+            )
+        kept = await Address.get_ids_by_key(session, set(keys.values()))
+
+        for id_, key in keys.items():
+            if key in kept:
+                await session.execute(
+                    update(_tables.ResourceTable)
+                    .where(_tables.ResourceTable.address_id == id_)
+                    .values(address_id=kept[key])
+                )
+                await session.execute(delete(table).where(table.id == id_))
+                counts["merged"] += 1
+            else:
+                await session.execute(
+                    update(table).where(table.id == id_).values(normalized_key=key)
+                )
+                kept[key] = id_
+                counts["keyed"] += 1
+        await session.commit()
+
+    return counts
+
+
+async def main():
+    try:
+        async with get_session() as session:
+            counts = await backfill_address_keys(session)
+        logger.info(f"Backfilled address keys: {counts}")
+    finally:
+        await ENGINE.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
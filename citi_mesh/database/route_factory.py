@@ -1,10 +1,15 @@
-from fastapi import Depends, FastAPI, Response
+import asyncio
+from typing import Annotated, Optional
+
+from fastapi import Depends, FastAPI, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import Field, create_model
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from citi_mesh.database._base import SQLModel
-from citi_mesh.database._exceptions import InstanceNotFound
-from citi_mesh.database.session import get_session_dependency
+from citi_mesh.database._exceptions import InstanceNotFound, InvalidCursor
+from citi_mesh.database.session import get_session, get_session_dependency
 
 
 class RouteFactory:
@@ -13,9 +18,13 @@ class RouteFactory:
 
     Args:
         app(FastAPI): The FastAPI applicaiton to add the new endpoints to
+        max_batch_size(int): The max number of entities accepted by a batch 'POST' endpoint.
+            Defaults to 1000
 
     Methods:
-        add_routes(model: SQlMode): Adds CRUD endpoints to the app
+        add_routes(model: SQlMode): Adds CRUD endpoints to the app. This includes a keyset
+            paginated list endpoint and a NDJSON export endpoint, both of which can be filtered
+            on the model's indexed columns, and a batch create endpoint
 
 
     Usage:
@@ -26,8 +35,9 @@ class RouteFactory:
         factory.add_routes(MyModelB)
     """
 
-    def __init__(self, app: FastAPI):
+    def __init__(self, app: FastAPI, max_batch_size: int = 1000):
         self.app = app
+        self.max_batch_size = max_batch_size
 
     def _create_get_endpoint(self, model):
         """
@@ -43,6 +53,64 @@ class RouteFactory:
 
         return _get
 
+    @staticmethod
+    def _create_filter_model(Model):
+        """
+        Private factory method to create a pydantic model of optional query parameters, one for
+        each indexed column of the SQLModel
+        """
+        fields = {
+            name: (Optional[python_type], None)
+            for name, python_type in Model.indexed_columns().items()
+        }
+        return create_model(f"{Model.__name__}Filters", **fields)
+
+    def _create_list_endpoint(self, Model, Filters):
+        """
+        Private factory method to create a keyset paginated 'GET' endpoint function given a
+        SQLModel
+        """
+
+        async def _list(
+            filters: Filters = Depends(),
+            limit: int = Query(default=100, ge=1, le=1000),
+            cursor: Optional[str] = None,
+            session: AsyncSession = Depends(get_session_dependency),
+        ):
+            try:
+                items, next_cursor = await Model.list_page(
+                    session=session,
+                    filters=filters.model_dump(exclude_none=True),
+                    limit=limit,
+                    cursor=cursor,
+                )
+            except InvalidCursor as e:
+                return Response(content=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+
+            return {"items": items, "next_cursor": next_cursor}
+
+        return _list
+
+    def _create_stream_endpoint(self, Model, Filters):
+        """
+        Private factory method to create a 'GET' endpoint function that streams every matching
+        entity as newline delimited JSON
+        """
+
+        async def _stream(filters: Filters = Depends()):
+            filter_values = filters.model_dump(exclude_none=True)
+
+            # The session is opened inside the generator, as dependencies are closed before the
+            # body of a streaming response is sent
+            async def _rows():
+                async with get_session() as session:
+                    async for entity in Model.stream(session=session, filters=filter_values):
+                        yield entity.model_dump_json() + "\n"
+
+            return StreamingResponse(_rows(), media_type="application/x-ndjson")
+
+        return _stream
+
     def _create_add_endpoint(self, Model):
         """
         Private factory method to create a 'POST' endpoint function given a SQLModel
@@ -50,12 +118,28 @@ class RouteFactory:
 
         async def _add(data: Model, session: AsyncSession = Depends(get_session_dependency)):
             try:
+                await data.resolve()
                 await data.upsert(session)
             except Exception as e:
                 return Response(content=str(e), status_code=status.HTTP_404_NOT_FOUND)
 
         return _add
 
+    def _create_batch_add_endpoint(self, Model):
+        """
+        Private factory method to create a batch 'POST' endpoint function given a SQLModel.
+        The batch size is part of the body's type, so an oversized batch is rejected with a 422
+        as soon as validation passes 'max_batch_size' entities, instead of after all of them
+        are validated
+        """
+        Batch = Annotated[list[Model], Field(max_length=self.max_batch_size)]
+
+        async def _add_batch(data: Batch, session: AsyncSession = Depends(get_session_dependency)):
+            await asyncio.gather(*(instance.resolve() for instance in data))
+            return await Model.upsert_many(session=session, instances=data)
+
+        return _add_batch
+
     def add_routes(self, Model: type[SQLModel]):
         """
         Add all CRUD routes to application given a SQLModel
@@ -63,6 +147,23 @@ class RouteFactory:
         args:
             Model(SQLModel): A SQLModel class that will be exposed in the FastAPI application
         """
+        Filters = self._create_filter_model(Model)
+
+        # LIST Endpoint
+        self.app.get(
+            f"/{Model.__name__.lower()}/",
+            name=f"{Model.__name__}.List",
+            tags=["CRUD", Model.__name__],
+        )(self._create_list_endpoint(Model, Filters))
+
+        # STREAM Endpoint, registered before 'GET' so that it is not captured by '{id}'
+        self.app.get(
+            f"/{Model.__name__.lower()}/stream",
+            name=f"{Model.__name__}.Stream",
+            tags=["CRUD", Model.__name__],
+            response_class=StreamingResponse,
+        )(self._create_stream_endpoint(Model, Filters))
+
         # GET Endpoint
         self.app.get(
             f"/{Model.__name__.lower()}/{{id}}",
@@ -76,3 +177,10 @@ class RouteFactory:
             name=f"{Model.__name__}.Create",
             tags=["CRUD", Model.__name__],
         )(self._create_add_endpoint(Model))
+
+        # BATCH POST Endpoint
+        self.app.post(
+            f"/{Model.__name__.lower()}/batch",
+            name=f"{Model.__name__}.CreateBatch",
+            tags=["CRUD", Model.__name__],
+        )(self._create_batch_add_endpoint(Model))
@@ -1,9 +1,12 @@
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-ENGINE = create_async_engine("sqlite+aiosqlite:///dev.db", pool_size=5)
+from citi_mesh.config import Config
+from citi_mesh.database.engine_factory import create_async_engine_from_config
+
+ENGINE = create_async_engine_from_config(Config)
 SESSION_MAKER = async_sessionmaker(bind=ENGINE)
 
 
@@ -2,11 +2,13 @@ import json
 import logging
 import pathlib
 
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import MetaData
 from sqlalchemy.orm import Session
 
+from citi_mesh.config import Config
 from citi_mesh.database._base import SQLTable
 from citi_mesh.database._models import Tenant
+from citi_mesh.database.engine_factory import create_sync_engine_from_config
 
 logger = logging.getLogger("uvicorn")
 logger.setLevel(logging.DEBUG)
@@ -16,8 +18,8 @@ def setup_db(reset_db: bool = True, is_dev: bool = False):
     """
     Helper function to create and setup the database
     """
-    # Create a syncronous engine
-    ENGINE = create_engine(url="sqlite:///dev.db")
+    # Create a syncronous engine, pointed at the same database as the app
+    ENGINE = create_sync_engine_from_config(Config)
     if reset_db:
         # Create a MetaData instance
         metadata = MetaData()
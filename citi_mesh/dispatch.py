@@ -0,0 +1,340 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional, Union
+
+from citi_mesh.config import Config
+from citi_mesh.logging import get_logger
+from citi_mesh.scheduler import TokenBucket
+from citi_mesh.sms import TwilioSender
+
+logger = get_logger(__name__)
+
+# Priority lanes, lower lanes are sent first
+ACK = 0
+REPLY = 1
+LANES = {ACK: "ack", REPLY: "reply"}
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent))]
+
+
+@dataclass
+class DispatchMetrics:
+    """
+    Running counters of the messages sent through a SMSDispatchQueue. Latencies are kept for
+    the last 'window' messages of each lane, measured from when the message was submitted
+    """
+
+    submitted: int = 0
+    sent: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    depth: int = 0
+    in_flight: int = 0
+    window: int = 1000
+    started_at: float = field(default_factory=time.monotonic)
+    queue_latencies: dict = field(default_factory=dict)
+    send_latencies: dict = field(default_factory=dict)
+
+    def record(self, lane: str, queued: float, sent: float):
+        self.queue_latencies.setdefault(lane, deque(maxlen=self.window)).append(queued)
+        self.send_latencies.setdefault(lane, deque(maxlen=self.window)).append(sent)
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        lanes = {}
+        for lane, queued in self.queue_latencies.items():
+            queued, sent = list(queued), list(self.send_latencies[lane])
+            lanes[lane] = {
+                "queue_latency_p50": _percentile(queued, 0.5),
+                "queue_latency_p95": _percentile(queued, 0.95),
+                "send_latency_p50": _percentile(sent, 0.5),
+                "send_latency_p95": _percentile(sent, 0.95),
+            }
+        return {
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "depth": self.depth,
+            "in_flight": self.in_flight,
+            "messages_per_second": self.sent / elapsed,
+            "lanes": lanes,
+        }
+
+
+@dataclass
+class OutboundMessage:
+    """
+    A message waiting to be sent. The body can still be generating, in which case the message
+    holds its place in line until the body is ready.
+
+    Attributes:
+        - to(str): The phone number to send to
+        - body(asyncio.Future): Resolves to the text of the message
+        - priority(int): The lane the message is sent in, one of 'ACK' or 'REPLY'
+        - delivered(asyncio.Future): Resolves to the message resource given back by Twilio,
+            once the message is sent
+    """
+
+    to: str
+    body: asyncio.Future
+    priority: int
+    delivered: asyncio.Future
+    submitted_at: float = field(default_factory=time.monotonic)
+    # Set once the message is handed to the sender, after which it can no longer be dropped
+    sending: bool = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self.body.cancelled() or self.delivered.cancelled()
+
+    def cancel(self):
+        """
+        Drops the message if it has not been sent yet, cancelling the generation of its body
+        """
+        self.body.cancel()
+        self.delivered.cancel()
+
+
+class SMSDispatchQueue:
+    """
+    Sends outbound SMS in the background, under the provider's send rate limit.
+
+    Messages to the same phone are sent strictly in the order they were submitted, even if the
+    body of a later message is ready first. Across phones, acknowledgments ('ACK') are sent
+    before replies ('REPLY'), and a single token bucket keeps the total send rate under
+    'messages_per_second'.
+
+    Attributes:
+        - messages_per_second(float): The max number of messages sent per second. Defaults to
+            'Config.sms_messages_per_second'
+        - workers(int): The max number of messages being sent at once. Defaults to
+            'Config.sms_dispatch_workers'
+        - sender(TwilioSender): Sends each message. Defaults to the shared TwilioSender
+
+    Usage:
+        queue = SMSDispatchQueue()
+        await queue.start()
+        queue.submit(phone, "Welcome!", priority=ACK)
+        queue.submit_with_ack(
+            phone,
+            answer=CitiEngine.chat(phone, body),
+            ack=lambda: CitiEngine.get_processing_message(phone, body),
+        )
+        ...
+        await queue.stop()
+    """
+
+    def __init__(
+        self,
+        messages_per_second: Optional[float] = None,
+        workers: Optional[int] = None,
+        sender: Optional[TwilioSender] = None,
+    ):
+        self.messages_per_second = messages_per_second or Config.sms_messages_per_second
+        self.workers = workers or Config.sms_dispatch_workers
+        self.sender = sender
+        self.metrics = DispatchMetrics()
+        # Allow a burst of one second's worth of messages
+        self._bucket = TokenBucket(
+            self.messages_per_second * 60, capacity=max(1.0, self.messages_per_second)
+        )
+        # Messages waiting to be sent, per phone
+        self._phones: dict[str, deque[OutboundMessage]] = {}
+        # Phones whose next message is waiting on its body, queued or being sent
+        self._active: set[str] = set()
+        self._ready: asyncio.PriorityQueue[tuple[int, int, str]] = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        """
+        Starts the workers
+        """
+        self.sender = self.sender or TwilioSender.get_instance()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, drain_seconds: Optional[float] = None):
+        """
+        Stops the workers, after waiting up to 'drain_seconds' for queued messages to be sent.
+        Defaults to 'Config.sms_drain_seconds'
+        """
+        drain_seconds = Config.sms_drain_seconds if drain_seconds is None else drain_seconds
+        deadline = time.monotonic() + drain_seconds
+        while self.metrics.depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.metrics.depth:
+            logger.warning(f"Dropping {self.metrics.depth} unsent messages on shutdown")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(
+        self, to: str, body: Union[str, Awaitable[str]], priority: int = REPLY
+    ) -> OutboundMessage:
+        """
+        Queues a message to be sent
+
+        args:
+            - to(str): The phone number to send to
+            - body(str | Awaitable[str]): The text of the message, or an awaitable that gives
+                it, i.e. 'CitiEngine.chat(phone, message)'. Awaitables start running right
+                away, and the message keeps its place in line while they do
+            - priority(int): The lane to send the message in, one of 'ACK' or 'REPLY'
+
+        returns:
+            OutboundMessage: The queued message, which can be awaited with 'delivered' or
+                dropped with 'cancel'
+        """
+        loop = asyncio.get_running_loop()
+        if isinstance(body, str):
+            body_future = loop.create_future()
+            body_future.set_result(body)
+        else:
+            body_future = asyncio.ensure_future(body)
+        delivered = loop.create_future()
+        # Failures are logged by the workers, so it is fine if nobody awaits the result
+        delivered.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        message = OutboundMessage(to=to, body=body_future, priority=priority, delivered=delivered)
+        self._phones.setdefault(to, deque()).append(message)
+        self.metrics.submitted += 1
+        self.metrics.depth += 1
+        self._schedule(to)
+        return message
+
+    def submit_with_ack(
+        self,
+        to: str,
+        answer: Awaitable[str],
+        ack: Callable[[], Awaitable[str]],
+        ack_after: Optional[float] = None,
+    ) -> OutboundMessage:
+        """
+        Queues an answer that is still generating, along with an acknowledgment that is only
+        sent if the answer takes longer than 'ack_after' seconds. If the answer is ready first,
+        the acknowledgment is never generated, or its generation is cancelled.
+
+        args:
+            - to(str): The phone number to send to
+            - answer(Awaitable[str]): Gives the text of the answer, i.e. 'CitiEngine.chat'
+            - ack(Callable): Called to start generating the acknowledgment, once the answer is
+                late, i.e. 'lambda: CitiEngine.get_processing_message(phone, message)'
+            - ack_after(float): The seconds to wait on the answer before acknowledging. Defaults
+                to 'Config.sms_ack_after_seconds'
+
+        returns:
+            OutboundMessage: The queued answer
+        """
+        ack_after = Config.sms_ack_after_seconds if ack_after is None else ack_after
+        answer = asyncio.ensure_future(answer)
+
+        async def acknowledge() -> Optional[str]:
+            done, _ = await asyncio.wait({answer}, timeout=ack_after)
+            if done:
+                return None
+            ack_task = asyncio.ensure_future(ack())
+            try:
+                await asyncio.wait({answer, ack_task}, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                ack_task.cancel()
+                raise
+            if not ack_task.done():
+                # The answer won, so the acknowledgment is no longer needed
+                ack_task.cancel()
+                return None
+            return ack_task.result()
+
+        # The acknowledgment is submitted first, so it can never be sent after the answer
+        self.submit(to, acknowledge(), priority=ACK)
+        return self.submit(to, answer)
+
+    def _schedule(self, phone: str):
+        """
+        Private method to line a phone's next message up to be sent, once its body is ready
+        """
+        if phone in self._active:
+            return
+        messages = self._phones.get(phone)
+        if not messages:
+            self._phones.pop(phone, None)
+            return
+
+        self._active.add(phone)
+        message = messages[0]
+
+        def ready(_=None):
+            self._ready.put_nowait((message.priority, next(self._order), phone))
+
+        if message.body.done():
+            ready()
+        else:
+            message.body.add_done_callback(ready)
+
+    async def _work(self):
+        while True:
+            _, _, phone = await self._ready.get()
+            message = self._phones[phone][0]
+            try:
+                await self._send(message)
+            finally:
+                self._phones[phone].popleft()
+                self.metrics.depth -= 1
+                self._active.discard(phone)
+                self._schedule(phone)
+
+    async def _send(self, message: OutboundMessage):
+        """
+        Private method to send a message whose body is ready, unless it was cancelled. Bodies
+        that resolve to None are dropped as well
+        """
+        lane = LANES.get(message.priority, str(message.priority))
+        if message.cancelled:
+            self.metrics.cancelled += 1
+            message.delivered.cancel()
+            return
+        if message.body.exception():
+            logger.error(f"Message to {message.to} was not sent: {message.body.exception()}")
+            self.metrics.failed += 1
+            message.delivered.set_exception(message.body.exception())
+            return
+        if message.body.result() is None:
+            self.metrics.cancelled += 1
+            message.delivered.cancel()
+            return
+
+        # Only messages that are really sent use up the rate limit
+        await self._bucket.acquire(1)
+        if message.cancelled:
+            # Cancelled while waiting for capacity
+            self.metrics.cancelled += 1
+            message.delivered.cancel()
+            return
+
+        queued = time.monotonic() - message.submitted_at
+        message.sending = True
+        self.metrics.in_flight += 1
+        try:
+            result = await self.sender.send(to=message.to, body=message.body.result())
+        except Exception as e:
+            logger.error(f"Message to {message.to} was not sent: {e}")
+            self.metrics.failed += 1
+            if not message.delivered.done():
+                message.delivered.set_exception(e)
+        else:
+            self.metrics.sent += 1
+            self.metrics.record(lane, queued, time.monotonic() - message.submitted_at)
+            if not message.delivered.done():
+                message.delivered.set_result(result)
+        finally:
+            self.metrics.in_flight -= 1
@@ -1,7 +1,10 @@
+from functools import lru_cache
 from typing import Any, Literal, Optional, Type
 
 from pydantic import BaseModel, Field, create_model
 
+from citi_mesh.model_cache import MODEL_CACHE_SIZE, CachedSchemaModel
+
 
 class Analytic(BaseModel):
     name: str
@@ -21,12 +24,32 @@ class Analytic(BaseModel):
         else:
             return (self.value_type, Field(..., description=self.description))
 
+    @property
+    def cache_key(self) -> tuple:
+        """
+        A hashable version of the analytic's definition, used to reuse generated output models
+        """
+        possible_values = tuple(self.possible_values) if self.possible_values else None
+        return (self.name, self.description, self.value_type, possible_values)
+
+    def __hash__(self):
+        return hash(self.cache_key)
 
-class OpenAIOutput(BaseModel):
+
+class OpenAIOutput(CachedSchemaModel):
     message: str = Field(..., description="Response to the user's query")
 
     @classmethod
     def from_analytics(cls, analytics: list[Analytic]):
-        field_definitions = {analytic.name: analytic.field_definition for analytic in analytics}
+        """
+        Returns the output model extended with a field for each analytic. Models are cached by
+        the analytics' definitions, so the same analytics give back the same class
+        """
+        return _create_output_model(cls, tuple(analytics))
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def _create_output_model(base: Type[OpenAIOutput], analytics: tuple[Analytic, ...]):
+    field_definitions = {analytic.name: analytic.field_definition for analytic in analytics}
 
-        return create_model("ExtendedOpenAIOutput", __base__=cls, **field_definitions)
+    return create_model("ExtendedOpenAIOutput", __base__=base, **field_definitions)
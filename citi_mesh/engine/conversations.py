@@ -0,0 +1,246 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from citi_mesh.config import Config
+from citi_mesh.database._models import ConversationState
+from citi_mesh.database.session import get_session
+from citi_mesh.engine.messages import MessageArray, MessageTracker
+from citi_mesh.engine.system_message import SYSTEM_MESSAGE
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+"""
+File contains the stores used to keep each phone's conversation between messages.
+
+Conversations are versioned. A turn is generated against the version it loaded, and is only
+saved if nobody else saved the conversation in the meantime (optimistic concurrency). Any
+worker can answer any message, so the app can run with many uvicorn workers or replicas when
+the conversations are kept in a shared store
+"""
+
+
+class ConversationConflict(Exception):
+    """
+    Raised when a conversation was saved by someone else since it was loaded
+    """
+
+    def __init__(self, phone: str, version: int):
+        self.phone = phone
+        self.version = version
+        self.message = f"Conversation with {phone} is no longer at version {version}"
+        super().__init__(self.message)
+
+
+@dataclass
+class Conversation:
+    """
+    The messages of a conversation with a phone, as of 'version'. Version 0 is a conversation
+    that has never been saved, or has expired
+    """
+
+    phone: str
+    messages: list[dict] = field(
+        default_factory=lambda: [{"role": "system", "content": SYSTEM_MESSAGE}]
+    )
+    version: int = 0
+
+
+def to_message_dict(message: Any) -> dict:
+    """
+    Returns a message given back by openai as a plain dict, with only the fields that are sent
+    back to openai, so that it can be stored
+    """
+    if isinstance(message, dict):
+        return message
+    message_dict = {"role": message.role, "content": message.content}
+    if message.tool_calls:
+        message_dict["tool_calls"] = [
+            {
+                "id": tool_call.id,
+                "type": tool_call.type,
+                "function": {
+                    "name": tool_call.function.name,
+                    "arguments": tool_call.function.arguments,
+                },
+            }
+            for tool_call in message.tool_calls
+        ]
+    return message_dict
+
+
+def format_conversation(messages: list[dict]) -> str:
+    """
+    Returns the user and assistant messages of a conversation as a readable string
+    """
+    lines = []
+    for message in messages:
+        if message["role"] == "assistant" and message.get("content"):
+            lines.append(f"\n Assistant: {message['content']}")
+        elif message["role"] == "user":
+            lines.append(f"\n User: {message['content']}")
+    return "".join(lines) or "Conversation just started"
+
+
+class ConversationStore(ABC):
+    """
+    Abstract class for a store of conversations
+
+    Attributes:
+        - expiration_minutes(int): Conversations that have not been saved for this long are
+            started over
+        - conflicts(int): The number of saves that lost a race, and were retried
+
+    Abstract Methods:
+        - async load(phone: str) -> Conversation: Returns the latest version of a conversation
+        - async save(conversation: Conversation, messages: list[dict]) -> Conversation: Saves
+            the messages onto the end of the conversation, raising ConversationConflict if it
+            is no longer the latest version
+        - async remove(phone: str): Forgets a conversation
+    """
+
+    def __init__(self, expiration_minutes: int = 5):
+        self.expiration_minutes = expiration_minutes
+        self.conflicts = 0
+
+    @property
+    def expiration(self) -> timedelta:
+        return timedelta(minutes=self.expiration_minutes)
+
+    @abstractmethod
+    async def load(self, phone: str) -> Conversation:
+        pass
+
+    @abstractmethod
+    async def save(self, conversation: Conversation, messages: list[dict]) -> Conversation:
+        pass
+
+    @abstractmethod
+    async def remove(self, phone: str):
+        pass
+
+    async def append(
+        self,
+        phone: str,
+        messages: list[dict],
+        conversation: Optional[Conversation] = None,
+        max_attempts: int = 5,
+    ) -> Conversation:
+        """
+        Saves messages onto the end of a conversation. If the conversation was saved by someone
+        else in the meantime, the messages are added onto their version instead
+
+        args:
+            - phone(str): The phone the conversation is with
+            - messages(list[dict]): The messages to add
+            - conversation(Conversation): The version the messages were generated against.
+                Defaults to the latest version
+            - max_attempts(int): The number of times to try saving before giving up
+
+        returns:
+            Conversation: The saved conversation
+        """
+        conversation = conversation or await self.load(phone)
+        messages = [to_message_dict(message) for message in messages]
+        for attempt in range(max_attempts):
+            try:
+                return await self.save(conversation, messages)
+            except ConversationConflict:
+                if attempt == max_attempts - 1:
+                    raise
+                self.conflicts += 1
+                conversation = await self.load(phone)
+
+
+class MemoryConversationStore(ConversationStore):
+    """
+    Keeps conversations in process memory, with a MessageTracker. Only works with a single
+    worker, since other workers can not see the conversations
+    """
+
+    def __init__(self, expiration_minutes: int = 5):
+        super().__init__(expiration_minutes)
+        self.tracker = MessageTracker(expiration_minutes=expiration_minutes)
+        self._cleaned_at = time.monotonic()
+
+    async def load(self, phone: str) -> Conversation:
+        array = self.tracker.messages.get(phone)
+        if array is None:
+            return Conversation(phone=phone)
+        if datetime.now() - array.last_updated > self.expiration:
+            return Conversation(phone=phone, version=array.version)
+        return Conversation(phone=phone, messages=list(array.messages), version=array.version)
+
+    async def save(self, conversation: Conversation, messages: list[dict]) -> Conversation:
+        array = self.tracker.messages.get(conversation.phone)
+        if (array.version if array else 0) != conversation.version:
+            raise ConversationConflict(conversation.phone, conversation.version)
+
+        saved = Conversation(
+            phone=conversation.phone,
+            messages=conversation.messages + messages,
+            version=conversation.version + 1,
+        )
+        self.tracker.messages[saved.phone] = MessageArray(
+            messages=saved.messages, last_updated=datetime.now(), version=saved.version
+        )
+        # Forget expired conversations every so often
+        if time.monotonic() - self._cleaned_at > self.expiration.total_seconds():
+            self._cleaned_at = time.monotonic()
+            self.tracker._cleanup()
+        return saved
+
+    async def remove(self, phone: str):
+        self.tracker.remove_phone(phone)
+
+
+class SQLConversationStore(ConversationStore):
+    """
+    Keeps conversations in the app's database, as 'ConversationState' rows, so every worker
+    and replica shares them. Messages are stored as compact JSON arrays, and each save is a
+    single compare and set on the row's version
+    """
+
+    async def load(self, phone: str) -> Conversation:
+        async with get_session() as session:
+            state = await ConversationState.from_phone(session, phone)
+        if state is None:
+            return Conversation(phone=phone)
+        updated_at = state.updated_at.replace(tzinfo=state.updated_at.tzinfo or timezone.utc)
+        if datetime.now(timezone.utc) - updated_at > self.expiration:
+            return Conversation(phone=phone, version=state.version)
+        return Conversation(
+            phone=phone, messages=json.loads(state.messages), version=state.version
+        )
+
+    async def save(self, conversation: Conversation, messages: list[dict]) -> Conversation:
+        saved = Conversation(
+            phone=conversation.phone,
+            messages=conversation.messages + messages,
+            version=conversation.version + 1,
+        )
+        serialized = json.dumps(saved.messages, separators=(",", ":"), ensure_ascii=False)
+        async with get_session() as session:
+            if not await ConversationState.compare_and_set(
+                session, saved.phone, serialized, expected_version=conversation.version
+            ):
+                raise ConversationConflict(conversation.phone, conversation.version)
+        return saved
+
+    async def remove(self, phone: str):
+        async with get_session() as session:
+            await ConversationState.remove(session, phone)
+
+
+def create_conversation_store(expiration_minutes: Optional[int] = None) -> ConversationStore:
+    """
+    Returns the store named by 'Config.conversation_store', either 'memory' or 'database'
+    """
+    expiration_minutes = expiration_minutes or Config.conversation_expiration
+    if Config.conversation_store == "database":
+        return SQLConversationStore(expiration_minutes=expiration_minutes)
+    return MemoryConversationStore(expiration_minutes=expiration_minutes)
@@ -1,12 +1,12 @@
 import threading
-from typing import Type
-
-import openai
+from typing import Optional, Type
 
 from citi_mesh.config import Config
 from citi_mesh.engine.analytic_models import OpenAIOutput
-from citi_mesh.engine.messages import MessageTracker
+from citi_mesh.engine.conversations import (ConversationStore, create_conversation_store,
+                                            format_conversation)
 from citi_mesh.engine.system_message import INITIAL_MESSAGE, PROCESSING_MESSAGE
+from citi_mesh.llm_cache import create_openai_client
 from citi_mesh.logging import get_logger
 from citi_mesh.tools import CitiToolManager
 
@@ -16,10 +16,12 @@ logger = get_logger(__name__)
 class CitiEngine:
     _instance = None
     _lock = threading.Lock()
-    _message_tracker = None
+    _conversations = None
     _client = None
     _output_model = None
     _tool_manager = None
+    # The number of chat turns being generated right now
+    turns_in_flight = 0
 
     @classmethod
     def get_instance(
@@ -27,55 +29,63 @@ class CitiEngine:
         output_model: Type[OpenAIOutput],
         tool_manager: CitiToolManager,
         conversation_expiration: int = 5,
+        conversation_store: Optional[ConversationStore] = None,
     ):
         if not cls._instance:
             with cls._lock:
                 if not cls._instance:
                     logger.info("Starting up CitiEngine...")
                     cls._instance = cls()
-                    cls._message_tracker = MessageTracker(
+                    cls._conversations = conversation_store or create_conversation_store(
                         expiration_minutes=conversation_expiration
                     )
-                    cls._client = openai.AsyncOpenAI()
+                    cls._client = create_openai_client()
                     cls._output_model = output_model
                     cls._tool_manager = tool_manager
         return cls._instance
 
     @classmethod
     async def chat(cls, phone: str, message: str) -> OpenAIOutput:
-        with cls._lock:
-            cls._message_tracker.add(phone=phone, message={"role": "user", "content": message})
+        cls.turns_in_flight += 1
+        try:
+            return await cls._chat(phone, message)
+        finally:
+            cls.turns_in_flight -= 1
+
+    @classmethod
+    async def _chat(cls, phone: str, message: str) -> OpenAIOutput:
+        # The turn is only saved once it is finished, so a turn that is cancelled part way
+        # through (i.e. when the user sends another message) leaves no trace
+        conversation = await cls._conversations.load(phone)
+        turn = [{"role": "user", "content": message}]
+
+        completion = await cls._client.beta.chat.completions.parse(
+            model=Config.chat_model,
+            messages=conversation.messages + turn,
+            response_format=cls._output_model,
+            tools=cls._tool_manager.to_openai(),
+        )
+
+        if completion.choices[0].message.tool_calls:
+            turn.append(completion.choices[0].message)
+            # Call tools and add messages
+            turn.extend(
+                cls._tool_manager.from_openai(completion.choices[0].message.tool_calls)
+            )
 
             completion = await cls._client.beta.chat.completions.parse(
                 model=Config.chat_model,
-                messages=cls._message_tracker.get(phone),
+                messages=conversation.messages + turn,
                 response_format=cls._output_model,
                 tools=cls._tool_manager.to_openai(),
             )
 
-            if completion.choices[0].message.tool_calls:
-                cls._message_tracker.add(phone=phone, message=completion.choices[0].message)
-                # Call tools and add messages
-                cls._message_tracker.extend(
-                    phone=phone,
-                    messages=cls._tool_manager.from_openai(
-                        completion.choices[0].message.tool_calls
-                    ),
-                )
-
-                completion = await cls._client.beta.chat.completions.parse(
-                    model=Config.chat_model,
-                    messages=cls._message_tracker.get(phone),
-                    response_format=cls._output_model,
-                    tools=cls._tool_manager.to_openai(),
-                )
-
-            output = completion.choices[0].message.parsed
-            cls._message_tracker.add(
-                phone=phone, message={"role": "assistant", "content": output.message}
-            )
+        output = completion.choices[0].message.parsed
+        turn.append({"role": "assistant", "content": output.message})
+        # Saved against the version the turn was generated from, see 'ConversationStore.append'
+        await cls._conversations.append(phone, turn, conversation=conversation)
 
-            return output.message
+        return output.message
 
     @classmethod
     async def get_init_message(cls, phone, message: str):
@@ -89,15 +99,15 @@ class CitiEngine:
 
         message = completion.choices[0].message.content
 
-        cls._message_tracker.add(phone=phone, message={"role": "assistant", "content": message})
+        await cls._conversations.append(phone, [{"role": "assistant", "content": message}])
 
         return message
 
     @classmethod
     async def get_processing_message(cls, phone: str, message: str):
-
+        conversation = await cls._conversations.load(phone)
         user_message = (
-            f"Here is the current conversation: {cls._message_tracker.get_conversation(phone)}"
+            f"Here is the current conversation: {format_conversation(conversation.messages)}"
             f"Here is the incoming message: {message}"
         )
 
@@ -111,13 +121,6 @@ class CitiEngine:
 
         message = completion.choices[0].message.content
 
-        with cls._lock:
-            cls._message_tracker.add(
-                phone=phone, message={"role": "assistant", "content": message}
-            )
+        await cls._conversations.append(phone, [{"role": "assistant", "content": message}])
 
         return message
-
-    @classmethod
-    def is_new_phone(cls, phone) -> bool:
-        return phone in cls._message_tracker.messages
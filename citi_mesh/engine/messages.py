@@ -9,6 +9,8 @@ from citi_mesh.engine.system_message import SYSTEM_MESSAGE
 class MessageArray:
     messages: List[Dict]
     last_updated: datetime
+    # Bumped each time the messages are saved, see 'citi_mesh.engine.conversations'
+    version: int = 0
 
 
 class MessageTracker:
@@ -70,7 +72,7 @@ class MessageTracker:
         """
         now = datetime.now()
         if phone not in self.messages:
-            system_message = [{"role": "system", "content": SYSTEM_MESSAGE}]
+            system_message = {"role": "system", "content": SYSTEM_MESSAGE}
             self.messages[phone] = MessageArray(messages=[system_message], last_updated=now)
         self.messages[phone].messages.extend(messages)
         self.messages[phone].last_updated = now
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from citi_mesh.config import Config
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+"""
+File contains the live measurements behind the readiness probe. Everything is measured in the
+background, so a probe only reads what was last measured and never waits on a dependency
+"""
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps for 'interval' seconds. A
+    loop that is busy, or blocked by a synchronous call, wakes it up late.
+
+    Attributes:
+        - interval(float): The seconds between measurements
+        - window(int): The number of recent measurements kept
+    """
+
+    def __init__(self, interval: float = 0.25, window: int = 240):
+        self.interval = interval
+        self._lags: deque[float] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self._lags.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    @property
+    def current(self) -> float:
+        return self._lags[-1] if self._lags else 0.0
+
+    def snapshot(self) -> dict:
+        lags = sorted(self._lags)
+        return {
+            "current_seconds": self.current,
+            "p95_seconds": lags[int(len(lags) * 0.95)] if lags else 0.0,
+            "max_seconds": lags[-1] if lags else 0.0,
+        }
+
+
+@dataclass
+class UpstreamStatus:
+    """
+    The result of the last check of an upstream dependency
+    """
+
+    reachable: Optional[bool] = None
+    latency_seconds: Optional[float] = None
+    error: Optional[str] = None
+    checked_at: Optional[float] = None
+
+    def snapshot(self) -> dict:
+        return {
+            "reachable": self.reachable,
+            "latency_seconds": self.latency_seconds,
+            "error": self.error,
+            "age_seconds": time.monotonic() - self.checked_at if self.checked_at else None,
+        }
+
+
+class UpstreamChecks:
+    """
+    Checks the reachability of upstream dependencies every 'interval' seconds, and caches the
+    results
+
+    Attributes:
+        - checks(dict): Maps the name of each upstream to an async function that raises if it
+            can not be reached
+        - interval(float): The seconds between checks
+        - timeout(float): The seconds each check has to finish
+    """
+
+    def __init__(
+        self,
+        checks: dict[str, Callable[[], Awaitable]],
+        interval: float = 10.0,
+        timeout: float = 2.0,
+    ):
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        self.statuses = {name: UpstreamStatus() for name in checks}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _check(self, name: str, check: Callable[[], Awaitable]):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(check(), timeout=self.timeout)
+        except Exception as e:
+            if self.statuses[name].reachable is not False:
+                logger.warning(f"Upstream '{name}' can not be reached: {e!r}")
+            self.statuses[name] = UpstreamStatus(
+                reachable=False, error=repr(e), checked_at=time.monotonic()
+            )
+        else:
+            self.statuses[name] = UpstreamStatus(
+                reachable=True,
+                latency_seconds=time.perf_counter() - start,
+                checked_at=time.monotonic(),
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.gather(
+                *(self._check(name, check) for name, check in self.checks.items())
+            )
+            await asyncio.sleep(self.interval)
+
+    def snapshot(self) -> dict:
+        return {name: status.snapshot() for name, status in self.statuses.items()}
+
+
+def database_check(engine: AsyncEngine) -> Callable[[], Awaitable]:
+    """
+    Returns a check that runs 'SELECT 1' on the database
+    """
+
+    async def check():
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    return check
+
+
+def http_check(client: httpx.AsyncClient, url: str) -> Callable[[], Awaitable]:
+    """
+    Returns a check that the host of 'url' answers at all. Any response counts, since the
+    request is sent without credentials
+    """
+
+    async def check():
+        await client.head(url)
+
+    return check
+
+
+class HealthMonitor:
+    """
+    Keeps the live measurements used by the readiness probe: event loop lag and the
+    reachability of the database, openai and Twilio.
+
+    The app is ready when the database can be reached and the event loop lag is under
+    'Config.health_max_loop_lag'. openai and Twilio are reported, but do not decide readiness,
+    since replacing the instance would not bring them back
+
+    Usage:
+        monitor = HealthMonitor(ENGINE)
+        await monitor.start()
+        monitor.snapshot()
+        ...
+        await monitor.stop()
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.loop_lag = LoopLagMonitor()
+        self._client = httpx.AsyncClient(timeout=Config.health_upstream_timeout)
+        self.upstreams = UpstreamChecks(
+            checks={
+                "database": database_check(engine),
+                "openai": http_check(
+                    self._client, os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+                ),
+                "twilio": http_check(self._client, Config.twilio_base_url),
+            },
+            interval=Config.health_check_interval,
+            timeout=Config.health_upstream_timeout,
+        )
+
+    async def start(self):
+        self.loop_lag.start()
+        self.upstreams.start()
+
+    async def stop(self):
+        await self.loop_lag.stop()
+        await self.upstreams.stop()
+        await self._client.aclose()
+
+    @property
+    def ready(self) -> bool:
+        database = self.upstreams.statuses.get("database")
+        return bool(
+            database
+            and database.reachable
+            and self.loop_lag.current < Config.health_max_loop_lag
+        )
+
+    def snapshot(self) -> dict:
+        return {
+            "loop_lag": self.loop_lag.snapshot(),
+            "upstreams": self.upstreams.snapshot(),
+        }
@@ -0,0 +1,117 @@
+from html.parser import HTMLParser
+from urllib.parse import urldefrag, urljoin
+
+"""
+File contains the helpers used to reduce a HTML page to its readable text before it is sent to
+openai. Scripts, styles, navigation and other page chrome make up most of a page's tokens, but
+none of its resources.
+"""
+
+# Elements whose content is never part of the main content of a page
+_SKIP_TAGS = {
+    "aside",
+    "footer",
+    "form",
+    "head",
+    "header",
+    "iframe",
+    "nav",
+    "noscript",
+    "script",
+    "style",
+    "svg",
+    "template",
+}
+# Elements that should start a new line of text
+_BLOCK_TAGS = {
+    "address",
+    "article",
+    "br",
+    "dd",
+    "div",
+    "dt",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "li",
+    "main",
+    "p",
+    "section",
+    "td",
+    "th",
+    "tr",
+}
+# Elements that hold the main content of a page, if the page uses them
+_MAIN_TAGS = {"main", "article"}
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Collects the text and links of a HTML page. Text inside of '<main>' or '<article>' is kept
+    separately, so that it can be used on its own when the page has it.
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.parts: list[str] = []
+        self.main_parts: list[str] = []
+        self.links: list[str] = []
+        self._skip_depth = 0
+        self._main_depth = 0
+
+    def _add(self, text: str):
+        self.parts.append(text)
+        if self._main_depth:
+            self.main_parts.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(urldefrag(urljoin(self.base_url, href))[0])
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in _MAIN_TAGS:
+            self._main_depth += 1
+        if tag in _BLOCK_TAGS:
+            self._add("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _MAIN_TAGS:
+            self._main_depth = max(0, self._main_depth - 1)
+        if tag in _BLOCK_TAGS:
+            self._add("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._add(data)
+
+
+def _normalize_lines(parts: list[str]) -> str:
+    lines = (" ".join(line.split()) for line in "".join(parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def html_to_text(html: str, base_url: str = "") -> tuple[str, list[str]]:
+    """
+    Reduces a HTML page to its main text content, and the absolute urls it links to
+
+    args:
+        - html(str): The raw HTML of the page
+        - base_url(str): The url of the page, used to resolve relative links
+
+    returns:
+        tuple[str, list[str]]: The text of the page, one block per line, and its links
+    """
+    extractor = _TextExtractor(base_url=base_url)
+    extractor.feed(html)
+    extractor.close()
+
+    text = _normalize_lines(extractor.main_parts) or _normalize_lines(extractor.parts)
+    return text, extractor.links
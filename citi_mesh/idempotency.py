@@ -0,0 +1,129 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Protocol
+
+from citi_mesh.config import Config
+from citi_mesh.database._models import WebhookReceipt
+from citi_mesh.database.session import get_session
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+"""
+File contains the helpers used to ignore webhooks that have already been accepted. Twilio
+retries '/sms/twilio' when a response is slow, and without these each retry would be answered
+again. Webhooks are remembered by their 'MessageSid' for 'Config.webhook_dedup_ttl_seconds'
+"""
+
+
+class DedupStore(Protocol):
+    async def add(self, key: str) -> bool:
+        """
+        Remembers a key, returning False if it was already remembered
+        """
+        ...
+
+
+class MemoryDedupStore:
+    """
+    Remembers keys in process memory. Only spots retries that land on the same worker
+
+    Attributes:
+        - ttl_seconds(float): How long each key is remembered
+        - max_size(int): The max number of keys remembered at once, the oldest are forgotten
+            first
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_size: int = 100_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        # Keys are added in order of expiry, so the oldest are always at the front
+        self._expires: OrderedDict[str, float] = OrderedDict()
+
+    def _purge(self, now: float):
+        while self._expires and (
+            next(iter(self._expires.values())) <= now or len(self._expires) > self.max_size
+        ):
+            self._expires.popitem(last=False)
+
+    async def add(self, key: str) -> bool:
+        now = time.monotonic()
+        self._purge(now)
+        if key in self._expires:
+            return False
+        self._expires[key] = now + self.ttl_seconds
+        return True
+
+
+class DatabaseDedupStore:
+    """
+    Remembers keys as 'WebhookReceipt' rows in the app's database, so retries are spotted
+    across every worker and replica. Expired rows are purged at most once every 'purge_every'
+    seconds
+
+    Attributes:
+        - ttl_seconds(float): How long each key is remembered
+        - purge_every(float): The seconds between purges of expired keys
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, purge_every: float = 300):
+        self.ttl_seconds = ttl_seconds
+        self.purge_every = purge_every
+        self._purged_at = 0.0
+
+    async def add(self, key: str) -> bool:
+        async with get_session() as session:
+            if time.monotonic() - self._purged_at > self.purge_every:
+                self._purged_at = time.monotonic()
+                older_than = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+                purged = await WebhookReceipt.purge(session, older_than=older_than)
+                logger.debug(f"Purged {purged} expired webhook receipts")
+            return await WebhookReceipt.record(session, key)
+
+
+@dataclass
+class DedupMetrics:
+    """
+    Running counters of the webhooks checked by a WebhookDeduplicator
+    """
+
+    accepted: int = 0
+    suppressed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def snapshot(self) -> dict:
+        return {"accepted": self.accepted, "suppressed": self.suppressed}
+
+
+class WebhookDeduplicator:
+    """
+    Spots retries of webhooks that have already been accepted
+
+    Attributes:
+        - store(DedupStore): Where accepted webhooks are remembered. Defaults to the store
+            named by 'Config.webhook_dedup_backend', either 'memory' or 'database'
+
+    Usage:
+        dedup = WebhookDeduplicator()
+        if await dedup.is_duplicate(MessageSid):
+            return
+    """
+
+    def __init__(self, store: Optional[DedupStore] = None):
+        if store is None and Config.webhook_dedup_backend == "database":
+            store = DatabaseDedupStore(ttl_seconds=Config.webhook_dedup_ttl_seconds)
+        self.store = store or MemoryDedupStore(ttl_seconds=Config.webhook_dedup_ttl_seconds)
+        self.metrics = DedupMetrics()
+
+    async def is_duplicate(self, key: str) -> bool:
+        """
+        Returns True if a webhook with this key was already accepted, otherwise remembers it
+        """
+        if await self.store.add(key):
+            self.metrics.accepted += 1
+            return False
+        self.metrics.suppressed += 1
+        logger.info(f"Ignoring retry of webhook {key}")
+        return True
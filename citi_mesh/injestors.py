@@ -1,19 +1,65 @@
 import asyncio
+import hashlib
 import json
+import math
 import pathlib
+import time
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Optional, Union
+from functools import lru_cache
+from typing import AsyncIterator, BinaryIO, Iterator, Optional, Union
+from urllib.parse import urlparse
 
+import httpx
 import numpy as np
-import openai
+import openpyxl
 import pandas as pd
-import requests
+import pyarrow.parquet as pq
 from pydantic import Field, create_model
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from citi_mesh.chunking import TokenChunker, estimate_tokens
+from citi_mesh.column_mapping import (MAPPING_SYSTEM_MESSAGE, apply_column_mapping,
+                                      create_column_mapping_model)
 from citi_mesh.config import Config
 from citi_mesh.database._models import Address, Repository, Resource, Source
+from citi_mesh.html_text import html_to_text
+from citi_mesh.llm_cache import create_openai_client
+from citi_mesh.logging import get_logger
+from citi_mesh.model_cache import MODEL_CACHE_SIZE, CachedSchemaModel
+from citi_mesh.moderation import ModerationCache
+from citi_mesh.scheduler import LLMScheduler
+
+logger = get_logger(__name__)
+
+
+def content_hash(source_string: str) -> str:
+    """
+    Returns a stable hash of a single row / chunk of source data, used to detect which parts of
+    a source have changed since it was last pulled.
+
+    Rows of tabular sources are JSON objects, and are hashed in the indented form they were
+    first stored with, so the hash does not depend on how compactly the row is sent to openai
+    """
+    if source_string.startswith("{"):
+        try:
+            source_string = json.dumps(json.loads(source_string), indent=2)
+        except ValueError:
+            pass
+    return hashlib.sha256(source_string.encode("utf-8")).hexdigest()
+
+
+def _record_to_string(record: dict) -> str:
+    """
+    Converts a single row of a tabular source to a compact json string. NaNs are sent as null,
+    and values json does not know about (dates, decimals) as their string form
+    """
+    record = {
+        key: None if isinstance(value, float) and math.isnan(value) else value
+        for key, value in record.items()
+    }
+    return json.dumps(record, separators=(",", ":"), default=str)
 
 
 def create_resource_list_model(resource_types: list[tuple[str, str]]):
@@ -21,6 +67,28 @@ def create_resource_list_model(resource_types: list[tuple[str, str]]):
     Return a pydantic model class that has a single field:
     `resources: List[DynamicResource]`
     where `DynamicResource` is the subclass generated from resource_types.
+
+    Models are cached by resource types, so every chunk of a source shares the same class
+    and JSON schema
+    """
+    return _create_resource_list_model(tuple(tuple(rt) for rt in resource_types))
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def _create_resource_list_model(resource_types: tuple[tuple[str, str], ...]):
+    OpenAIResource = _create_resource_model(resource_types)
+    ResourceList = create_model(
+        "ResourceList", __base__=CachedSchemaModel, resources=(list[OpenAIResource], ...)
+    )
+
+    return ResourceList
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def _create_resource_model(resource_types: tuple[tuple[str, str], ...]):
+    """
+    Private function to create the model of a single resource parsed by openai, shared by the
+    resource list model and resources built without openai (see 'CSVInjestor')
     """
     enum_name = "ResourceTypeEnum"
     type_map = {rt[0].upper().replace(" ", "_"): rt[0] for rt in resource_types}
@@ -35,11 +103,13 @@ def create_resource_list_model(resource_types: list[tuple[str, str]]):
         website=(Optional[str], None),
         address=(Optional[Address], None),
         resource_types=(list[ResourceTypeEnum], Field(default_factory=list)),
+        source_index=(
+            int,
+            Field(..., description="The [index] of the entry the resource was parsed from"),
+        ),
     )
 
-    ResourceList = create_model("ResourceList", resources=(list[OpenAIResource], ...))
-
-    return ResourceList
+    return OpenAIResource
 
 
 SYSTEM_MESSAGE = """
@@ -48,11 +118,44 @@ You will be provided a string of data, that will be in many different forms.
 Your task is to, to the best of your ability, parse data out of that string in
 a more structered format.
 
+Each entry in the string is prefixed with its index, i.e. [0]. For every resource,
+set 'source_index' to the index of the entry it was parsed from.
+
 Please do not include any data that is not in the original string
 Please do include all of the data that is in the string.
 """
 
 
+@dataclass
+class IngestionProgress:
+    """
+    Counters tracking the progress of a single 'pull_resources' run
+    """
+
+    chunks_queued: int = 0
+    chunks_parsed: int = 0
+    chunks_failed: int = 0
+    entries_parsed: int = 0
+    entries_flagged: int = 0
+    entries_mapped: int = 0
+    resources_parsed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "chunks_queued": self.chunks_queued,
+            "chunks_parsed": self.chunks_parsed,
+            "chunks_failed": self.chunks_failed,
+            "entries_parsed": self.entries_parsed,
+            "entries_flagged": self.entries_flagged,
+            "entries_mapped": self.entries_mapped,
+            "resources_parsed": self.resources_parsed,
+            "elapsed_seconds": elapsed,
+            "entries_per_second": self.entries_parsed / elapsed,
+        }
+
+
 class Injestor(ABC):
     """
     Injestors take in a form of data, a respository, and creates new resources based on that
@@ -66,9 +169,21 @@ class Injestor(ABC):
         attributes that may be used when parsing the data. The class
         must send over a tenant_name and name to the BaseRepository when
         initializing
-      - _parse_source(): This function must use any class attributes to
-        create a list of strings that will later be sent to openai to pull out
-        a more structured response. This function *must* return list[str]
+      - _iter_source(): This async generator must use any class attributes to
+        yield the strings that will later be sent to openai to pull out a more
+        structured response. Reads must not block the event loop, so blocking
+        I/O is run in a worker thread
+
+    All calls to openai go through a LLMScheduler, which caps concurrency and rate limits
+    requests and tokens. A chunk that still fails after retries is skipped and logged, and the
+    rest of the source is still synced. Skipped chunks are picked up by the next pull.
+
+    Each string yielded by '_iter_source' is hashed, and only strings that were not seen the
+    last time the source was pulled are sent to openai. Resources parsed from strings that have
+    since disappeared from the source are retired.
+
+    Every string is moderated on its own before parsing, and flagged strings are dropped from
+    the chunk. Strings are moderated many at a time, and verdicts are cached by content hash.
     """
 
     __source_type__ = "base"
@@ -76,93 +191,380 @@ class Injestor(ABC):
     def __init__(
         self,
         repo: Repository,
+        scheduler: Optional[LLMScheduler] = None,
+        moderation_cache: Optional[ModerationCache] = None,
     ):
         self.repo = repo
-        self.client = openai.AsyncClient()
+        # Retries are handled by the scheduler
+        self.client = create_openai_client(max_retries=0)
+        self.scheduler = scheduler or LLMScheduler.get_instance()
+        self.moderation_cache = moderation_cache or ModerationCache.get_instance()
+        self.progress = IngestionProgress()
         self.details = None
+        # Set to map entries to resources without openai, in batches of this size. See
+        # '_map_entries'
+        self.map_batch_size: Optional[int] = None
+        # Maps normalized address keys to address ids, so resources that share a building
+        # share a single address row
+        self._address_ids: dict[str, str] = {}
+        # The content hash of each entry between being read and being written, so each entry
+        # is only hashed once. See '_hash'
+        self._hashes: dict[str, str] = {}
 
     @abstractmethod
-    def _parse_source(self) -> list[str]:
-        # Extend this method to provide 'source' material for
-        # openai to parse resources from
+    def _iter_source(self) -> AsyncIterator[str]:
+        # Extend this method to yield the 'source' material for
+        # openai to parse resources from, one string at a time
+        pass
+
+    async def _before_pull(self, session: Optional[AsyncSession]):
+        """
+        Hook called before the source is read, once 'self.source' is set. 'self.source' and
+        'session' are None in debug mode.
+        """
+        pass
+
+    async def _after_pull(self, session: AsyncSession):
+        """
+        Hook called after every resource is synced, in the same transaction as retiring old
+        resources. Not called in debug mode.
+        """
         pass
 
-    async def _sync_to_db(self, openai_resources: list[Resource], session: AsyncSession):
+    async def _sync_to_db(
+        self,
+        openai_resources: list[tuple[Resource, list[str]]],
+        source: Source,
+        new_hashes: set[str],
+        session: AsyncSession,
+    ):
         """
-        Private method to sync resources to the SQL Database
+        Private method to sync a batch of resources to the SQL Database, along with the content
+        hashes they were parsed from. Parsed resources are always new, so they are inserted in
+        bulk instead of merged one at a time
         """
-        source = Source(
-            repository_id=self.repo.id, source_type=self.__source_type__, details=self.details
+        # Using the Tenant, create the proper resources to add to the Repository
+        new_resources = [
+            (self.repo.create_resource_from_openai_resource(openai_resource=resource), hashes)
+            for resource, hashes in openai_resources
+        ]
+
+        # Save any addresses not seen yet during this ingestion, or point them at the rows
+        # already saved under their key
+        addresses = [resource.address for resource, _ in new_resources if resource.address]
+        self._address_ids.update(
+            await Address.claim_keys(
+                session,
+                [a for a in addresses if a.normalized_key not in self._address_ids],
+            )
         )
-        await session.merge(source.to_orm())
+        for address in addresses:
+            address.id = self._address_ids[address.normalized_key]
+        records = [
+            (hash_, new_resource.id) for new_resource, hashes in new_resources for hash_ in hashes
+        ]
+
+        await Resource.insert_many(session, [resource for resource, _ in new_resources])
 
-        # Loop through the openai generated resources and
-        # using the Tenant, create the proper resources to
-        # add to the Repository
-        for resource in openai_resources:
-            new_resource = self.repo.create_resource_from_openai_resource(openai_resource=resource)
-            await session.merge(new_resource.to_orm())
+        # Record content that produced no resources as well, so it is not parsed again
+        linked_hashes = {hash_ for hash_, _ in records}
+        records.extend((hash_, None) for hash_ in new_hashes - linked_hashes)
+        await source.add_content_hashes(session, records)
 
         await session.commit()
         await session.flush()
 
+    async def _map_entries(self, source_strings: list[str]) -> tuple[list[str], list, list[str]]:
+        """
+        Private method to build resources straight from the source strings, without openai.
+        Only called when 'map_batch_size' is set, with batches of up to that many strings.
+        Extend this method for sources where entries can be mapped to resources directly.
+
+        returns:
+            tuple[list[str], list, list[str]]: The strings that passed moderation, the
+                resources built with 'source_index' pointing into those strings, and the
+                strings that still need to be parsed by openai. Defaults to parsing every
+                string.
+        """
+        return source_strings, [], source_strings
+
+    def _hash(self, source_string: str) -> str:
+        """
+        Private method to get the content hash of an entry, reusing the hash computed when it
+        was read. Hashing a row of a tabular source means parsing its JSON, so it is only done
+        once per entry
+        """
+        hash_ = self._hashes.get(source_string)
+        return hash_ if hash_ is not None else content_hash(source_string)
+
+    def _attribute_resource(self, resource, source_strings: list[str]) -> list[str]:
+        """
+        Private method to get the content hash(es) a parsed resource came from. If openai gave
+        back an index that is not in the chunk, the resource is linked to the whole chunk
+        """
+        if 0 <= resource.source_index < len(source_strings):
+            return [self._hash(source_strings[resource.source_index])]
+        return [self._hash(source_string) for source_string in source_strings]
+
+    async def _moderate(self, source_strings: list[str]) -> list[bool]:
+        """
+        Private method to check each string for bad content. Returns whether each string was
+        flagged. Strings without a cached verdict are sent in batches of
+        'Config.moderation_batch_size', using the array input of the moderations endpoint
+        """
+        hashes = [self._hash(source_string) for source_string in source_strings]
+        verdicts = {hash_: self.moderation_cache.get(hash_) for hash_ in hashes}
+        unchecked = {
+            hash_: source_string
+            for hash_, source_string in zip(hashes, source_strings)
+            if verdicts[hash_] is None
+        }
+
+        async def _moderate_batch(batch: list[tuple[str, str]]):
+            self.moderation_cache.metrics.requests += 1
+            content_check = await self.scheduler.call(
+                self.client.moderations.create,
+                input=[source_string for _, source_string in batch],
+                rate_limited=False,
+            )
+            for (hash_, _), result in zip(batch, content_check.results):
+                verdicts[hash_] = result.flagged
+                self.moderation_cache.set(hash_, result.flagged)
+
+        unchecked = list(unchecked.items())
+        batch_size = Config.moderation_batch_size
+        await asyncio.gather(
+            *(
+                _moderate_batch(unchecked[i : i + batch_size])
+                for i in range(0, len(unchecked), batch_size)
+            )
+        )
+        return [verdicts[hash_] for hash_ in hashes]
+
     async def _openai_parse(self, source_strings: list[str]) -> list[Resource]:
         """
         Private method to extract the strucuted resource from a list of strings
-        that may contain those resources
+        that may contain those resources. Strings should already be moderated, see '_moderate'
         """
-        # Check string for bad content
-        content_check = await self.client.moderations.create(
-            input="\n".join(source_strings),
+        indexed_strings = [f"[{i}] {string}" for i, string in enumerate(source_strings)]
+        user_message = "\n".join(indexed_strings)
+        completion = await self.scheduler.call(
+            self.client.beta.chat.completions.parse,
+            # Count the response as well, it is about the size of the input
+            tokens=2 * estimate_tokens(user_message) + estimate_tokens(SYSTEM_MESSAGE),
+            model=Config.parsing_model,
+            messages=[
+                {"role": "system", "content": SYSTEM_MESSAGE},
+                {"role": "user", "content": user_message},
+            ],
+            response_format=create_resource_list_model(
+                resource_types=[(t.name, t.display_name) for t in self.repo.resource_types]
+            ),
         )
 
-        if not content_check.results[0].flagged:
-            completion = await self.client.beta.chat.completions.parse(
-                model=Config.parsing_model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_MESSAGE},
-                    {"role": "user", "content": "\n".join(source_strings)},
-                ],
-                response_format=create_resource_list_model(
-                    resource_types=[(t.name, t.display_name) for t in self.repo.resource_types]
-                ),
-            )
-
-            resources = completion.choices[0].message.parsed.resources
+        resources = completion.choices[0].message.parsed.resources
 
-            return resources
-        else:
-            return []
+        return resources
 
     async def pull_resources(
-        self, session: AsyncSession, debug: bool = False, chunk_size: int = 20
+        self,
+        session: AsyncSession,
+        debug: bool = False,
+        chunk_size: Optional[int] = None,
+        chunk_tokens: Optional[int] = None,
+        parse_workers: Optional[int] = None,
+        max_pending_chunks: int = 8,
+        write_batch_size: int = 200,
     ) -> Optional[list[Resource]]:
         """
-        Pulls resources out of the original source and syncs them to the database
+        Pulls resources out of the original source and syncs them to the database. Only
+        content that is new or changed since the last pull of the source is sent to openai.
+
+        The source is processed as a pipeline of three stages, reading, parsing with openai,
+        and writing to the database, connected by bounded queues. A slow stage makes the
+        stages before it wait, so memory stays flat no matter how large the source is.
 
         Attributes:
           - debug (bool): If True, will skip syncing database and return the list
             of Resources instead. Defaults to False.
-          - chunk_size: The size of each sublist that is sent over to openai. The bigger
-            the chunk size, the faster it will run, but may result in lower accuracy.
-            Defaults to 20.
+          - chunk_size: An optional cap on the number of entries in each sublist that is sent
+            over to openai. Defaults to None, where chunks are only limited by 'chunk_tokens'.
+          - chunk_tokens: The estimated number of tokens in each sublist that is sent over to
+            openai. Entries are packed up to this size, and entries bigger than it are split.
+            The bigger the chunks, the faster it will run, but may result in lower accuracy.
+            Defaults to 'Config.ingestion_chunk_tokens'.
+          - parse_workers: The number of chunks being parsed at once. Defaults to the
+            scheduler's max concurrency.
+          - max_pending_chunks: The max number of chunks buffered between each stage.
+            Defaults to 8.
+          - write_batch_size: The number of resources written to the database per commit.
+            Defaults to 200.
         """
-        source_data = self._parse_source()
+        parse_workers = parse_workers or self.scheduler.max_concurrency
+        self.progress = progress = IngestionProgress()
 
-        chunked_data = [
-            source_data[i : i + chunk_size] for i in range(0, len(source_data), chunk_size)
-        ]
+        if not debug:
+            source = await Source.get_or_create(
+                session,
+                repository_id=self.repo.id,
+                source_type=self.__source_type__,
+                details=self.details,
+            )
+            known_hashes = await source.get_content_hashes(session)
+        else:
+            source = None
+            known_hashes = {}
+        self.source = source
+        # Hashes of content that is known to still exist without being read again, see
+        # 'CrawlerInjestor'
+        self.unchanged_hashes = set()
+        self._hashes = {}
+        await self._before_pull(session)
+
+        chunk_queue = asyncio.Queue(maxsize=max_pending_chunks)
+        result_queue = asyncio.Queue(maxsize=max_pending_chunks)
+        pending = []
+        seen_hashes = set()
+        debug_resources = []
 
-        openai_results = await asyncio.gather(
-            *[self._openai_parse(source_strings=source_strings) for source_strings in chunked_data]
+        self.chunker = chunker = TokenChunker(
+            target_tokens=chunk_tokens or Config.ingestion_chunk_tokens, max_items=chunk_size
         )
 
-        resources = sum(openai_results, [])
+        async def _queue(source_string):
+            if chunk := chunker.add(source_string):
+                await chunk_queue.put(chunk)
+                progress.chunks_queued += 1
 
-        if not debug:
-            await self._sync_to_db(resources, session=session)
-        else:
-            return resources
+        async def _map_pending():
+            try:
+                allowed, resources, unmapped = await self._map_entries(pending)
+            except Exception as e:
+                logger.error(f"Failed to map {len(pending)} entries, using openai: {e}")
+                allowed, resources, unmapped = pending, [], pending
+            # Mapped (and flagged) entries go straight to the writer, the rest are parsed
+            unmapped_set = set(unmapped)
+            mapped = [string for string in pending if string not in unmapped_set]
+            progress.entries_parsed += len(mapped)
+            progress.entries_flagged += len(pending) - len(allowed)
+            progress.entries_mapped += len(allowed) - len(unmapped)
+            progress.resources_parsed += len(resources)
+            if mapped:
+                await result_queue.put((mapped, allowed, resources))
+            for source_string in unmapped:
+                await _queue(source_string)
+            pending.clear()
+
+        async def _read():
+            async for source_data in self._iter_source():
+                # Entries too big for a single chunk are split, and each piece is tracked
+                # as its own entry
+                for source_string in chunker.split(source_data):
+                    # Sources can hash their entries while reading them, i.e. crawled pages
+                    hash_ = self._hashes.pop(source_string, None) or content_hash(source_string)
+                    # Skip duplicate entries, and entries parsed in a previous pull
+                    if hash_ in seen_hashes:
+                        continue
+                    seen_hashes.add(hash_)
+                    if hash_ in known_hashes:
+                        continue
+                    # Kept until the entry is written, see '_hash'
+                    self._hashes[source_string] = hash_
+                    if self.map_batch_size is None:
+                        await _queue(source_string)
+                        continue
+                    pending.append(source_string)
+                    if len(pending) >= self.map_batch_size:
+                        await _map_pending()
+            if pending:
+                await _map_pending()
+            if chunk := chunker.flush():
+                await chunk_queue.put(chunk)
+                progress.chunks_queued += 1
+            # Signal each parse worker that the source is exhausted
+            for _ in range(parse_workers):
+                await chunk_queue.put(None)
+
+        async def _parse():
+            while (chunk := await chunk_queue.get()) is not None:
+                try:
+                    flagged = await self._moderate(chunk)
+                    # Drop flagged entries on their own, the rest of the chunk is still parsed
+                    allowed = [string for string, flag in zip(chunk, flagged) if not flag]
+                    resources = await self._openai_parse(allowed) if allowed else []
+                except Exception as e:
+                    # Skip the chunk instead of failing the whole pull. Its entries are not
+                    # recorded, so they will be parsed again on the next pull
+                    progress.chunks_failed += 1
+                    logger.error(f"Failed to parse chunk of {len(chunk)} entries: {e}")
+                    for source_string in chunk:
+                        self._hashes.pop(source_string, None)
+                    continue
+                progress.chunks_parsed += 1
+                progress.entries_parsed += len(chunk)
+                progress.entries_flagged += len(chunk) - len(allowed)
+                progress.resources_parsed += len(resources)
+                await result_queue.put((chunk, allowed, resources))
+            await result_queue.put(None)
+
+        async def _write():
+            finished_workers = 0
+            batch, batch_hashes = [], set()
+            while finished_workers < parse_workers:
+                result = await result_queue.get()
+                if result is None:
+                    finished_workers += 1
+                    continue
+
+                chunk, allowed, resources = result
+                batch.extend(
+                    (resource, self._attribute_resource(resource, allowed))
+                    for resource in resources
+                )
+                # Flagged entries are recorded too, so they are not moderated again
+                batch_hashes.update(
+                    self._hashes.pop(source_string, None) or content_hash(source_string)
+                    for source_string in chunk
+                )
+                if len(batch) >= write_batch_size:
+                    await _flush(batch, batch_hashes)
+                    batch, batch_hashes = [], set()
+
+            await _flush(batch, batch_hashes)
+
+        async def _flush(batch, batch_hashes):
+            if debug:
+                debug_resources.extend(resource for resource, _ in batch)
+            elif batch_hashes:
+                await self._sync_to_db(
+                    batch, source=source, new_hashes=batch_hashes, session=session
+                )
+
+        # If any stage fails, the others are cancelled instead of blocking on their queues
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_read())
+            for _ in range(parse_workers):
+                tg.create_task(_parse())
+            tg.create_task(_write())
+
+        logger.info(
+            f"Parsed {self.__source_type__} '{self.details}': {progress.snapshot()}, "
+            f"scheduler: {self.scheduler.metrics.snapshot()}, "
+            f"moderation: {self.moderation_cache.metrics.snapshot()}"
+        )
+        self._hashes = {}
+        if debug:
+            return debug_resources
+
+        removed_hashes = set(known_hashes) - seen_hashes - self.unchanged_hashes
+        retired = await source.retire_content_hashes(session, removed_hashes, known_hashes)
+        await self._after_pull(session)
+        await session.commit()
+        logger.info(
+            f"Synced {self.__source_type__} '{self.details}': {progress.resources_parsed} new "
+            f"resources from {progress.entries_parsed} new entries, {retired} resources retired, "
+            f"{progress.chunks_failed} chunks failed"
+        )
 
 
 class WebpageInjestor(Injestor):
@@ -177,29 +579,186 @@ class WebpageInjestor(Injestor):
 
     __source_type__ = "webpage"
 
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/98.0.4758.102 Safari/537.36"
+    }
+
     def __init__(
         self,
         repo: Repository,
         url: str,
+        scheduler: Optional[LLMScheduler] = None,
     ):
         self.url = url
-        super().__init__(repo=repo)
+        super().__init__(repo=repo, scheduler=scheduler)
         self.details = url
 
-    def _parse_source(self):
+    async def _iter_source(self):
         """
-        Private function that uses the requests library to pull the
-        raw HTML from the webpage
+        Private function that pulls the text of the webpage without blocking the event loop.
+        Raises if the page can not be read, so the pull fails instead of retiring every
+        resource parsed from the page before
         """
+        async with httpx.AsyncClient(headers=self.headers, follow_redirects=True) as client:
+            response = await client.get(self.url)
+        if response.status_code != 200 or "html" not in response.headers.get("content-type", ""):
+            raise ValueError(
+                f"Could not read {self.url}: got {response.status_code} "
+                f"({response.headers.get('content-type')})"
+            )
+        text, _ = html_to_text(response.text, base_url=str(response.url))
+        yield text
+
+
+class CrawlerInjestor(WebpageInjestor):
+    """
+    Repository class used to update the Resources DB with information from a website, starting
+    at a url and following links on the same domain.
+
+    Pages are fetched concurrently over a pooled connection, and reduced to their main text
+    before being chunked. Pages are re-fetched with 'If-None-Match' / 'If-Modified-Since', and
+    pages that have not changed are not downloaded or parsed again.
+
+    Attributes:
+      - repo( Repository): the repository SQLModel to add the new resources to
+      - url(str): The URL to start crawling from
+      - max_depth(int): The number of links to follow away from 'url'. Defaults to 2
+      - max_pages(int): The max number of pages to crawl. Defaults to 100
+      - max_concurrency(int): The max number of pages fetched at once. Defaults to 8
+    """
+
+    __source_type__ = "web_crawl"
+
+    def __init__(
+        self,
+        repo: Repository,
+        url: str,
+        max_depth: int = 2,
+        max_pages: int = 100,
+        max_concurrency: int = 8,
+        scheduler: Optional[LLMScheduler] = None,
+    ):
+        super().__init__(repo=repo, url=url, scheduler=scheduler)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_concurrency = max_concurrency
+        self.domain = urlparse(url).netloc
+        self._previous_pages: dict[str, dict] = {}
+        self._pages: dict[str, dict] = {}
+
+    async def _before_pull(self, session):
+        self._pages = {}
+        self._previous_pages = await self.source.get_pages(session) if self.source else {}
+
+    async def _after_pull(self, session):
+        # If a chunk failed, a page could be recorded without all of its content being synced.
+        # Forget the pages so they are fully fetched next time, the content hashes still keep
+        # the synced content from being parsed again.
+        if self.progress.chunks_failed:
+            self._pages = {}
+        await self.source.replace_pages(session, self._pages)
+
+    def _is_followable(self, url: str) -> bool:
+        parsed = urlparse(url)
+        return parsed.scheme in ("http", "https") and parsed.netloc == self.domain
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str) -> Optional[tuple[list[str], dict]]:
+        """
+        Private function to fetch a single page. Returns the pieces of new text on the page
+        (split to fit in a chunk) along with the page's record, or None if it failed.
+
+        A page that was crawled before and fails to fetch (i.e. a timeout or a 5xx) is treated
+        as unchanged, so one bad fetch never retires the resources parsed from it, and its
+        links are still followed
+        """
+        previous = self._previous_pages.get(url)
+        headers = {}
+        if previous and previous["etag"]:
+            headers["If-None-Match"] = previous["etag"]
+        if previous and previous["last_modified"]:
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to fetch {url}: {e}")
+            response = None
 
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/98.0.4758.102 Safari/537.36"
+        if response is not None and response.status_code == 304 and previous:
+            self.unchanged_hashes.update(previous["content_hashes"])
+            return [], previous
+        if (
+            response is None
+            or response.status_code != 200
+            or "html" not in response.headers.get("content-type", "")
+        ):
+            if not previous:
+                return None
+            if response is not None:
+                logger.warning(f"Failed to fetch {url}: got {response.status_code}")
+            self.unchanged_hashes.update(previous["content_hashes"])
+            return [], previous
+
+        text, links = html_to_text(response.text, base_url=str(response.url))
+        pieces = self.chunker.split(text) if text else []
+        hashes = [content_hash(piece) for piece in pieces]
+        # Handed to 'pull_resources' along with the pieces, so they are not hashed again
+        self._hashes.update(zip(pieces, hashes))
+        page = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "content_hashes": hashes,
+            "links": links,
         }
-        response = requests.get(url=self.url, headers=headers)
+        return pieces, page
+
+    async def _iter_source(self):
+        """
+        Private function that crawls the site breadth first, yielding the text of each page as
+        soon as it is fetched. Links are only followed once their whole level is fetched, in
+        the order of the level and then of the links on each page, so 'max_pages' always cuts
+        the crawl off at the same pages
+        """
+        limits = httpx.Limits(
+            max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency
+        )
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        visited = {self.url}
+        level = [self.url]
+
+        async def _fetch_limited(client, url):
+            async with semaphore:
+                return url, await self._fetch(client, url)
 
-        return [response.text]
+        async with httpx.AsyncClient(
+            headers=self.headers, follow_redirects=True, limits=limits, timeout=30
+        ) as client:
+            for depth in range(self.max_depth + 1):
+                for task in asyncio.as_completed([_fetch_limited(client, url) for url in level]):
+                    url, result = await task
+                    if result is None:
+                        continue
+                    pieces, page = result
+                    self._pages[url] = page
+                    for piece in pieces:
+                        yield piece
+
+                if depth == self.max_depth:
+                    break
+                next_level = []
+                for url in level:
+                    page = self._pages.get(url)
+                    for link in page["links"] if page else []:
+                        if len(visited) >= self.max_pages:
+                            break
+                        if link not in visited and self._is_followable(link):
+                            visited.add(link)
+                            next_level.append(link)
+                level = next_level
+                if not level:
+                    break
 
 
 class CSVInjestor(Injestor):
@@ -210,6 +769,13 @@ class CSVInjestor(Injestor):
     Attributes:
       - repo( Repository): the repository SQLModel to add the new resources to
       - csv_path(str): Path to the csv to sync with
+      - csv_file(BinaryIO): An open csv file to sync with, used instead of 'csv_path'
+      - name(str): The name of the source. Defaults to the stem of 'csv_path'
+      - rows_per_read(int): The number of rows read from the file at a time
+      - column_mapping(bool): If True, openai is asked once how the columns of the csv map to
+        resource fields, and rows are turned into resources without openai. Rows that can not
+        be mapped are still parsed by openai. Defaults to False
+      - sample_rows(int): The number of rows shown to openai when mapping columns
     """
 
     __source_type__ = "csv_file"
@@ -217,20 +783,247 @@ class CSVInjestor(Injestor):
     def __init__(
         self,
         repo: Repository,
-        csv_path: Union[str, pathlib.Path],
+        csv_path: Optional[Union[str, pathlib.Path]] = None,
+        csv_file: Optional[BinaryIO] = None,
+        name: Optional[str] = None,
+        rows_per_read: int = 1000,
+        column_mapping: bool = False,
+        sample_rows: int = 20,
+        scheduler: Optional[LLMScheduler] = None,
     ):
-        self.csv_path = pathlib.Path(csv_path)
-        super().__init__(repo=repo)
-        self.details = self.csv_path.stem
+        if (csv_path is None) == (csv_file is None):
+            raise ValueError("Exactly one of 'csv_path' or 'csv_file' must be given")
+
+        self.csv_path = pathlib.Path(csv_path) if csv_path is not None else None
+        self.csv_file = csv_file
+        self.rows_per_read = rows_per_read
+        self.column_mapping = column_mapping
+        self.sample_rows = sample_rows
+        self.mapping = None
+        super().__init__(repo=repo, scheduler=scheduler)
+        self.details = name or (self.csv_path.stem if self.csv_path else "upload")
 
-    def _parse_source(self):
+    @staticmethod
+    def _to_source_strings(df: pd.DataFrame) -> list[str]:
         """
-        Private function that uses the csv to create a list of
-        json strings for each row in the file
+        Private function to convert the rows of a dataframe to compact json strings
         """
-        df = pd.read_csv(self.csv_path)
         # Replace all np.nan with Python None
         # This is so that the rows are JSON Serializable
         df = df.replace({np.nan: None})
         records_array = df.to_dict(orient="records")
-        return [json.dumps(record, indent=2) for record in records_array]
+        return [json.dumps(record, separators=(",", ":")) for record in records_array]
+
+    async def _before_pull(self, session):
+        self.mapping = await self._learn_column_mapping() if self.column_mapping else None
+        self.map_batch_size = self.rows_per_read if self.mapping else None
+
+    async def _learn_column_mapping(self):
+        """
+        Private function to ask openai how the columns of the csv map to resource fields, using
+        the header and the first 'sample_rows' rows. Returns None if openai could not be asked,
+        in which case every row is parsed by openai.
+        """
+        df = await asyncio.to_thread(
+            pd.read_csv, self.csv_path or self.csv_file, nrows=self.sample_rows
+        )
+        if self.csv_file is not None:
+            self.csv_file.seek(0)
+
+        sample = self._to_source_strings(df)
+        flagged = await self._moderate(sample)
+        sample = [string for string, flag in zip(sample, flagged) if not flag]
+        columns = tuple(str(column) for column in df.columns)
+        user_message = f"Columns: {json.dumps(columns)}\nSample rows:\n" + "\n".join(sample)
+        try:
+            completion = await self.scheduler.call(
+                self.client.beta.chat.completions.parse,
+                tokens=2 * estimate_tokens(user_message) + estimate_tokens(MAPPING_SYSTEM_MESSAGE),
+                model=Config.parsing_model,
+                messages=[
+                    {"role": "system", "content": MAPPING_SYSTEM_MESSAGE},
+                    {"role": "user", "content": user_message},
+                ],
+                response_format=create_column_mapping_model(
+                    columns, tuple(t.name for t in self.repo.resource_types)
+                ),
+            )
+        except Exception as e:
+            logger.error(f"Failed to map the columns of '{self.details}', using openai: {e}")
+            return None
+
+        mapping = completion.choices[0].message.parsed
+        logger.info(f"Mapped the columns of '{self.details}': {mapping.model_dump()}")
+        return mapping
+
+    async def _map_entries(self, source_strings):
+        """
+        Private function that builds resources from rows using the learned column mapping,
+        leaving any rows that can not be mapped for openai. Mapping happens in a worker thread
+        to keep the event loop free.
+        """
+        flagged = await self._moderate(source_strings)
+        allowed = [string for string, flag in zip(source_strings, flagged) if not flag]
+        resource_model = _create_resource_model(
+            tuple((t.name, t.display_name) for t in self.repo.resource_types)
+        )
+        resources, unmapped = await asyncio.to_thread(
+            apply_column_mapping,
+            self.mapping,
+            [json.loads(string) for string in allowed],
+            resource_model,
+        )
+        return allowed, resources, [allowed[index] for index in unmapped]
+
+    async def _iter_source(self):
+        """
+        Private function that reads the csv 'rows_per_read' rows at a time, yielding a json
+        string for each row. Reads happen in a worker thread to keep the event loop free.
+        """
+        reader = pd.read_csv(self.csv_path or self.csv_file, chunksize=self.rows_per_read)
+        try:
+            while (df := await asyncio.to_thread(next, reader, None)) is not None:
+                for source_string in self._to_source_strings(df):
+                    yield source_string
+        finally:
+            reader.close()
+
+
+class ParquetInjestor(Injestor):
+    """
+    Repository class used to update the Resources DB with information
+    from a given Parquet file
+
+    The file is memory-mapped and read one record batch at a time, only reading the columns
+    that are needed, so large files are never loaded into memory all at once.
+
+    Attributes:
+      - repo( Repository): the repository SQLModel to add the new resources to
+      - parquet_path(str): Path to the parquet file to sync with
+      - parquet_file(BinaryIO): An open parquet file to sync with, used instead of
+        'parquet_path'. Open files can not be memory-mapped
+      - columns(list[str]): The columns to read. Defaults to every column
+      - name(str): The name of the source. Defaults to the stem of 'parquet_path'
+      - rows_per_read(int): The number of rows read from the file at a time
+    """
+
+    __source_type__ = "parquet_file"
+
+    def __init__(
+        self,
+        repo: Repository,
+        parquet_path: Optional[Union[str, pathlib.Path]] = None,
+        parquet_file: Optional[BinaryIO] = None,
+        columns: Optional[list[str]] = None,
+        name: Optional[str] = None,
+        rows_per_read: int = 1000,
+        scheduler: Optional[LLMScheduler] = None,
+    ):
+        if (parquet_path is None) == (parquet_file is None):
+            raise ValueError("Exactly one of 'parquet_path' or 'parquet_file' must be given")
+
+        self.parquet_path = pathlib.Path(parquet_path) if parquet_path is not None else None
+        self.parquet_file = parquet_file
+        self.columns = columns
+        self.rows_per_read = rows_per_read
+        super().__init__(repo=repo, scheduler=scheduler)
+        self.details = name or (self.parquet_path.stem if self.parquet_path else "upload")
+
+    def _open(self) -> pq.ParquetFile:
+        return pq.ParquetFile(self.parquet_path or self.parquet_file, memory_map=True)
+
+    async def _iter_source(self):
+        """
+        Private function that reads the parquet file one record batch of 'rows_per_read' rows at
+        a time, yielding a json string for each row. Reads happen in a worker thread to keep
+        the event loop free.
+        """
+        parquet_file = self._open()
+        batches = parquet_file.iter_batches(batch_size=self.rows_per_read, columns=self.columns)
+        try:
+            while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+                for record in batch.to_pylist():
+                    yield _record_to_string(record)
+        finally:
+            parquet_file.close()
+
+
+class XLSXInjestor(Injestor):
+    """
+    Repository class used to update the Resources DB with information
+    from a given Excel (.xlsx) file
+
+    The workbook is opened in read-only mode, which streams rows from the file instead of
+    loading the whole workbook. The first row of the sheet is used as the header.
+
+    Attributes:
+      - repo( Repository): the repository SQLModel to add the new resources to
+      - xlsx_path(str): Path to the workbook to sync with
+      - xlsx_file(BinaryIO): An open workbook to sync with, used instead of 'xlsx_path'
+      - sheet_name(str): The sheet to read. Defaults to the active sheet
+      - name(str): The name of the source. Defaults to the stem of 'xlsx_path'
+      - rows_per_read(int): The number of rows read from the file at a time
+    """
+
+    __source_type__ = "xlsx_file"
+
+    def __init__(
+        self,
+        repo: Repository,
+        xlsx_path: Optional[Union[str, pathlib.Path]] = None,
+        xlsx_file: Optional[BinaryIO] = None,
+        sheet_name: Optional[str] = None,
+        name: Optional[str] = None,
+        rows_per_read: int = 1000,
+        scheduler: Optional[LLMScheduler] = None,
+    ):
+        if (xlsx_path is None) == (xlsx_file is None):
+            raise ValueError("Exactly one of 'xlsx_path' or 'xlsx_file' must be given")
+
+        self.xlsx_path = pathlib.Path(xlsx_path) if xlsx_path is not None else None
+        self.xlsx_file = xlsx_file
+        self.sheet_name = sheet_name
+        self.rows_per_read = rows_per_read
+        super().__init__(repo=repo, scheduler=scheduler)
+        self.details = name or (self.xlsx_path.stem if self.xlsx_path else "upload")
+
+    def _iter_batches(self) -> Iterator[list[str]]:
+        """
+        Private function that streams the sheet, yielding json strings for 'rows_per_read' rows
+        at a time. Empty rows are skipped
+        """
+        workbook = openpyxl.load_workbook(
+            self.xlsx_path or self.xlsx_file, read_only=True, data_only=True
+        )
+        try:
+            sheet = workbook[self.sheet_name] if self.sheet_name else workbook.active
+            rows = sheet.iter_rows(values_only=True)
+            header = [
+                str(cell) if cell is not None else f"column_{i}"
+                for i, cell in enumerate(next(rows, ()))
+            ]
+            batch = []
+            for row in rows:
+                if all(cell is None for cell in row):
+                    continue
+                batch.append(_record_to_string(dict(zip(header, row))))
+                if len(batch) >= self.rows_per_read:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            workbook.close()
+
+    async def _iter_source(self):
+        """
+        Private function that streams the sheet 'rows_per_read' rows at a time, yielding a json
+        string for each row. Reads happen in a worker thread to keep the event loop free.
+        """
+        batches = self._iter_batches()
+        try:
+            while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+                for source_string in batch:
+                    yield source_string
+        finally:
+            batches.close()
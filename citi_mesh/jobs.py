@@ -0,0 +1,291 @@
+import asyncio
+import pathlib
+import shutil
+from datetime import datetime, timezone
+from typing import BinaryIO, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from citi_mesh.config import Config
+from citi_mesh.database._models import IngestionJob, Repository
+from citi_mesh.database.session import get_session
+from citi_mesh.injestors import (CSVInjestor, CrawlerInjestor, Injestor, ParquetInjestor,
+                                 WebpageInjestor, XLSXInjestor)
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class IngestionJobQueue:
+    """
+    Processes ingestion jobs in the background, so that pulling a large source does not happen
+    inside of a request.
+
+    Jobs are stored in the database. Each parsed chunk is committed along with its content
+    hashes as soon as it is parsed, so a job that is restarted after a crash only re-parses the
+    chunks that were in flight (see 'Injestor.pull_resources'). Running jobs send a heartbeat,
+    and every 'Config.ingestion_sweep_seconds' the queue looks for jobs whose heartbeat went
+    stale (i.e. their worker died) and picks them up again, up to 'Config.ingestion_max_attempts'
+    times. Jobs that can not be started (i.e. their repository was deleted) are failed, and jobs
+    that finish with chunks that could not be parsed are marked 'partial' instead of
+    'succeeded'.
+
+    Attributes:
+        - workers(int): The number of jobs processed at once. Defaults to
+            'Config.ingestion_workers'
+        - upload_dir(str): Where uploaded sources are kept until their job finishes, whether
+            it succeeds or fails. Defaults to 'Config.ingestion_upload_dir'
+
+    Usage:
+        queue = IngestionJobQueue()
+        await queue.start()
+        job = await queue.submit(session, repository_id, "webpage", details=url)
+        ...
+        await queue.stop()
+    """
+
+    def __init__(self, workers: Optional[int] = None, upload_dir: Optional[str] = None):
+        self.workers = workers or Config.ingestion_workers
+        self.upload_dir = pathlib.Path(upload_dir or Config.ingestion_upload_dir)
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        # Ids in '_queue', so a sweep does not queue the same job twice
+        self._queued: set[str] = set()
+        self._tasks: list[asyncio.Task] = []
+        # Injestors of the jobs running in this process, used to report live progress
+        self._running: dict[str, Injestor] = {}
+
+    async def start(self):
+        """
+        Starts the workers, and queues any jobs left over from a previous run
+        """
+        await self._sweep_once()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._queued and job_id not in self._running:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _sweep_once(self):
+        """
+        Private method to queue every job that is waiting, or was running on a worker that
+        stopped sending heartbeats. Jobs that have crashed their worker too many times are
+        failed instead
+        """
+        async with get_session() as session:
+            exhausted = await IngestionJob.fail_exhausted(
+                session,
+                stale_seconds=Config.ingestion_stale_seconds,
+                max_attempts=Config.ingestion_max_attempts,
+            )
+            job_ids = await IngestionJob.get_claimable_ids(
+                session,
+                stale_seconds=Config.ingestion_stale_seconds,
+                max_attempts=Config.ingestion_max_attempts,
+            )
+        for payload_path in exhausted:
+            if payload_path:
+                pathlib.Path(payload_path).unlink(missing_ok=True)
+        if exhausted:
+            logger.warning(f"Failed {len(exhausted)} ingestion jobs that ran out of attempts")
+        job_ids = [
+            job_id
+            for job_id in job_ids
+            if job_id not in self._queued and job_id not in self._running
+        ]
+        for job_id in job_ids:
+            self._enqueue(job_id)
+        if job_ids:
+            logger.info(f"Picked up {len(job_ids)} waiting or stale ingestion jobs")
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(Config.ingestion_sweep_seconds)
+            try:
+                await self._sweep_once()
+            except Exception as e:
+                logger.error(f"Could not sweep for stale ingestion jobs: {e}", exc_info=True)
+
+    async def stop(self):
+        """
+        Stops the workers. Jobs that are interrupted are put back in the queue, and will resume
+        from their last checkpoint on the next start
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+        self,
+        session: AsyncSession,
+        repository_id: str,
+        source_type: str,
+        details: str,
+        upload: Optional[BinaryIO] = None,
+        options: Optional[dict] = None,
+    ) -> IngestionJob:
+        """
+        Creates a new job and queues it
+
+        args:
+            - session(AsyncSession): An Async SQLAlchemy Session object
+            - repository_id(str): The id of the repository to add resources to
+            - source_type(str): The '__source_type__' of the injestor to use
+            - details(str): The url of a 'webpage', or the name of an uploaded file
+            - upload(BinaryIO): The uploaded file, for sources that are not fetched by url
+            - options(dict): Extra keyword arguments for the injestor
+        """
+        job = IngestionJob(
+            repository_id=repository_id, source_type=source_type, details=details, options=options
+        )
+        if upload is not None:
+            self.upload_dir.mkdir(parents=True, exist_ok=True)
+            payload_path = self.upload_dir / job.id
+            await asyncio.to_thread(self._save_upload, upload, payload_path)
+            job.payload_path = str(payload_path)
+
+        session.add(job.to_orm())
+        await session.commit()
+        self._enqueue(job.id)
+        return job
+
+    @staticmethod
+    def _save_upload(upload: BinaryIO, path: pathlib.Path):
+        upload.seek(0)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(upload, f)
+
+    def get_live_progress(self, job_id: str) -> Optional[dict]:
+        """
+        Returns the up to date progress of a job, if it is running in this process
+        """
+        injestor = self._running.get(job_id)
+        return injestor.progress.snapshot() if injestor else None
+
+    def backlog(self) -> dict:
+        """
+        Returns the number of jobs waiting to be picked up, and running, in this process
+        """
+        return {"queued": self._queue.qsize(), "running": len(self._running)}
+
+    @staticmethod
+    def _build_injestor(job: IngestionJob, repo: Repository) -> Injestor:
+        """
+        Private method to create the injestor for a job given its source type
+        """
+        options = job.options or {}
+        if job.source_type == WebpageInjestor.__source_type__:
+            return WebpageInjestor(repo=repo, url=job.details)
+        elif job.source_type == CrawlerInjestor.__source_type__:
+            return CrawlerInjestor(repo=repo, url=job.details, **options)
+        elif job.source_type == CSVInjestor.__source_type__:
+            return CSVInjestor(repo=repo, csv_path=job.payload_path, name=job.details, **options)
+        elif job.source_type == ParquetInjestor.__source_type__:
+            return ParquetInjestor(
+                repo=repo, parquet_path=job.payload_path, name=job.details, **options
+            )
+        elif job.source_type == XLSXInjestor.__source_type__:
+            return XLSXInjestor(repo=repo, xlsx_path=job.payload_path, name=job.details, **options)
+        raise ValueError(f"No injestor for source type '{job.source_type}'")
+
+    async def _heartbeat(self, job_id: str, injestor: Injestor):
+        """
+        Private method to periodically record that a job is still alive, along with its progress
+        """
+        while True:
+            await asyncio.sleep(Config.ingestion_heartbeat_seconds)
+            async with get_session() as session:
+                await IngestionJob.update_status(
+                    session,
+                    job_id,
+                    heartbeat_at=datetime.now(timezone.utc),
+                    progress=injestor.progress.snapshot(),
+                )
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} could not be run: {e}", exc_info=True)
+
+    async def _run(self, job_id: str):
+        async with get_session() as session:
+            if not await IngestionJob.claim(
+                session,
+                job_id,
+                stale_seconds=Config.ingestion_stale_seconds,
+                max_attempts=Config.ingestion_max_attempts,
+            ):
+                # Another worker has it
+                return
+
+        job, injestor, heartbeat = None, None, None
+        # Interrupted jobs are resumed later, so they still need their upload
+        interrupted = False
+
+        def _progress() -> dict:
+            # Jobs that fail before their injestor is built keep their last progress
+            return {"progress": injestor.progress.snapshot()} if injestor else {}
+
+        try:
+            # Loaded inside the try, so a job that can not be started is failed instead of
+            # being left running and picked up again by every sweep
+            async with get_session() as session:
+                job = await IngestionJob.from_id(session, job_id)
+                repo = await Repository.from_id(session, job.repository_id)
+            logger.info(f"Starting ingestion job {job_id}, attempt {job.attempts}")
+            injestor = self._build_injestor(job, repo)
+            self._running[job_id] = injestor
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, injestor))
+
+            async with get_session() as session:
+                # Commit every chunk as it is parsed, so each one is checkpointed
+                await injestor.pull_resources(session, write_batch_size=1)
+        except asyncio.CancelledError:
+            interrupted = True
+            async with get_session() as session:
+                await IngestionJob.update_status(session, job_id, status="queued", **_progress())
+            raise
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}", exc_info=True)
+            async with get_session() as session:
+                await IngestionJob.update_status(
+                    session,
+                    job_id,
+                    status="failed",
+                    error=str(e),
+                    finished_at=datetime.now(timezone.utc),
+                    **_progress(),
+                )
+        else:
+            # Chunks that could not be parsed are left for the next pull, so the source was
+            # not fully imported
+            chunks_failed = injestor.progress.chunks_failed
+            async with get_session() as session:
+                await IngestionJob.update_status(
+                    session,
+                    job_id,
+                    status="partial" if chunks_failed else "succeeded",
+                    error=(
+                        f"{chunks_failed} chunks could not be parsed, they are parsed again on "
+                        "the next time the source is pulled"
+                        if chunks_failed
+                        else None
+                    ),
+                    finished_at=datetime.now(timezone.utc),
+                    **_progress(),
+                )
+            logger.info(f"Finished ingestion job {job_id}, {chunks_failed} chunks failed")
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+            self._running.pop(job_id, None)
+            if job and job.payload_path and not interrupted:
+                pathlib.Path(job.payload_path).unlink(missing_ok=True)
@@ -0,0 +1,344 @@
+import asyncio
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Callable, Optional, Union
+
+import openai
+from openai.types import ModerationCreateResponse
+from openai.types.chat import ChatCompletion, ParsedChatCompletion
+from pydantic import BaseModel
+
+from citi_mesh.config import Config
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+"""
+File contains a content addressed cache for openai responses. Each request is keyed by a hash of
+everything that decides its response (model, messages, tools, response format, ...), and the
+response is kept on disk, so identical prompts are only ever sent to openai once.
+
+The cache runs in one of three modes, set with 'Config.llm_cache_mode':
+    - off: The openai client is used as is
+    - read_write: Cached responses are used, and new responses are written to the cache
+    - replay: Only cached responses are used, a request that is not in the cache raises an
+        LLMCacheMiss. Used to run the engine and ingestion offline and deterministically
+"""
+
+# Arguments that do not change the response, so are left out of the key
+_IGNORED_KWARGS = {"timeout", "extra_headers", "extra_query", "extra_body"}
+
+
+class LLMCacheMiss(Exception):
+    """
+    Raised in replay mode, when a request has no cached response
+    """
+
+    def __init__(self, endpoint: str, key: str):
+        self.endpoint = endpoint
+        self.key = key
+        self.message = f"No cached response for {endpoint} request {key}"
+        super().__init__(self.message)
+
+
+@dataclass
+class LLMCacheMetrics:
+    """
+    Running counters of the requests looked up in an LLMCache
+    """
+
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+def _canonical(value: Any) -> Any:
+    """
+    Private function to turn request arguments into plain JSON types, so they can be hashed.
+    Response formats are swapped for their JSON schema, and messages given back by openai for
+    their dict form
+    """
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return {"name": value.__name__, "schema": value.model_json_schema()}
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+class LLMCache:
+    """
+    A size bounded, on disk cache of openai responses. Each response is a JSON file named by
+    the hash of its request. Reading a response touches the file, and the least recently used
+    files are evicted once the cache holds more than 'max_bytes'.
+
+    The directory is only listed once, on the first write. After that the size and order of the
+    files are kept in memory, so writes and evictions never list the directory again. 'get' and
+    'set' do blocking file I/O, so are run in a thread from async code.
+
+    Attributes:
+        - directory(pathlib.Path): The directory the responses are written to
+        - max_bytes(int): The max size of all cached responses together
+        - mode(str): One of 'off', 'read_write' or 'replay', see the module docstring
+
+    Usage:
+        cache = LLMCache.get_instance()
+        key = cache.key("chat.completions.create", kwargs)
+        payload = cache.get(key)
+        if payload is None:
+            ...
+            cache.set(key, response.to_json(indent=None))
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        directory: Union[str, pathlib.Path] = ".llm_cache",
+        max_bytes: int = 512 * 1024 * 1024,
+        mode: str = "read_write",
+    ):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.metrics = LLMCacheMetrics()
+        # The size of each cached file, least recently used first. Only loaded on the first
+        # write, so reading from the cache never lists the directory
+        self._files: Optional[OrderedDict[pathlib.Path, int]] = None
+        self._size = 0
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "LLMCache":
+        """
+        Returns the process wide cache, built from 'Config'
+        """
+        if not cls._instance:
+            with cls._lock:
+                if not cls._instance:
+                    cls._instance = cls(
+                        directory=Config.llm_cache_dir,
+                        max_bytes=Config.llm_cache_max_bytes,
+                        mode=Config.llm_cache_mode,
+                    )
+        return cls._instance
+
+    @staticmethod
+    def key(endpoint: str, kwargs: dict) -> str:
+        """
+        Returns the hash of a request, made from the endpoint and every argument that could
+        change its response
+        """
+        request = {
+            "endpoint": endpoint,
+            **{name: value for name, value in kwargs.items() if name not in _IGNORED_KWARGS},
+        }
+        serialized = json.dumps(
+            _canonical(request), sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        # Split by the first two characters, to keep each directory small
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached response of a request as JSON, or None if it is not cached
+        """
+        path = self._path(key)
+        try:
+            payload = path.read_text(encoding="utf-8")
+            os.utime(path)
+        except FileNotFoundError:
+            self.metrics.misses += 1
+            return None
+        with self._write_lock:
+            if self._files is not None and path in self._files:
+                self._files.move_to_end(path)
+        self.metrics.hits += 1
+        return payload
+
+    def set(self, key: str, payload: str):
+        """
+        Writes the response of a request to the cache, then evicts the least recently used
+        responses if the cache is too large
+        """
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = payload.encode("utf-8")
+        with self._write_lock:
+            if self._files is None:
+                self._load_files()
+            # Write to a temp file first, so readers never see a partial response
+            tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self._size += len(data) - self._files.pop(path, 0)
+            self._files[path] = len(data)
+            self.metrics.writes += 1
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _load_files(self):
+        """
+        Private method to list the responses already in the cache, oldest first, along with
+        their total size
+        """
+        files = []
+        for file in self.directory.glob("*/*.json"):
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, file, stat.st_size))
+        files.sort()
+        self._files = OrderedDict((file, size) for _, file, size in files)
+        self._size = sum(self._files.values())
+
+    def _evict(self):
+        """
+        Private method to delete the least recently used responses, until the cache is back
+        under 'max_bytes'
+        """
+        while self._files and self._size > self.max_bytes:
+            file, size = self._files.popitem(last=False)
+            file.unlink(missing_ok=True)
+            self._size -= size
+            self.metrics.evictions += 1
+
+
+class CachedAsyncOpenAI:
+    """
+    Wraps an 'openai.AsyncOpenAI' client, so 'chat.completions.create',
+    'beta.chat.completions.parse' and 'moderations.create' go through an LLMCache. Every other
+    attribute is taken from the wrapped client.
+
+    Responses given back from the cache are the same types openai gives back, including the
+    'parsed' output of 'beta.chat.completions.parse'
+
+    Attributes:
+        - client(openai.AsyncOpenAI): The client requests are sent with on a cache miss
+        - cache(LLMCache): The cache to look responses up in
+    """
+
+    def __init__(self, client: openai.AsyncOpenAI, cache: LLMCache):
+        self.client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse))
+        )
+        self.moderations = SimpleNamespace(create=self._moderate)
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+    async def _cached(
+        self, endpoint: str, func: Callable, load: Callable[[str, dict], Any], **kwargs
+    ):
+        """
+        Private method to look a request up in the cache, and only send it to openai on a miss
+        """
+        key = self.cache.key(endpoint, kwargs)
+        payload = await asyncio.to_thread(self.cache.get, key)
+        if payload is not None:
+            return load(payload, kwargs)
+        if self.cache.mode == "replay":
+            raise LLMCacheMiss(endpoint, key)
+
+        response = await func(**kwargs)
+        # Written with the names used by the api, so it loads the same way a response does
+        await asyncio.to_thread(self.cache.set, key, response.to_json(indent=None))
+        return response
+
+    @staticmethod
+    def _load_completion(payload: str, kwargs: dict) -> ChatCompletion:
+        return ChatCompletion.construct(**json.loads(payload))
+
+    @staticmethod
+    def _load_parsed_completion(payload: str, kwargs: dict) -> ParsedChatCompletion:
+        # Validate the content again, so 'parsed' is an instance of the response format. Only
+        # complete responses were cached, as openai raises on any other finish reason
+        completion = ParsedChatCompletion.construct(**json.loads(payload))
+        response_format = kwargs.get("response_format")
+        for choice in completion.choices:
+            message = choice.message
+            message.parsed = None
+            if (
+                message.content
+                and not message.refusal
+                and isinstance(response_format, type)
+                and issubclass(response_format, BaseModel)
+            ):
+                message.parsed = response_format.model_validate_json(message.content)
+        return completion
+
+    @staticmethod
+    def _load_moderation(payload: str, kwargs: dict) -> ModerationCreateResponse:
+        return ModerationCreateResponse.construct(**json.loads(payload))
+
+    async def _create(self, **kwargs) -> ChatCompletion:
+        return await self._cached(
+            "chat.completions.create",
+            self.client.chat.completions.create,
+            self._load_completion,
+            **kwargs,
+        )
+
+    async def _parse(self, **kwargs):
+        return await self._cached(
+            "beta.chat.completions.parse",
+            self.client.beta.chat.completions.parse,
+            self._load_parsed_completion,
+            **kwargs,
+        )
+
+    async def _moderate(self, **kwargs) -> ModerationCreateResponse:
+        return await self._cached(
+            "moderations.create",
+            self.client.moderations.create,
+            self._load_moderation,
+            **kwargs,
+        )
+
+
+def create_openai_client(**kwargs) -> Union[openai.AsyncOpenAI, CachedAsyncOpenAI]:
+    """
+    Returns an async openai client, wrapped in the process wide LLMCache unless
+    'Config.llm_cache_mode' is 'off'
+
+    args:
+        - **kwargs: Passed to 'openai.AsyncOpenAI', i.e. 'max_retries'
+    """
+    cache = LLMCache.get_instance()
+    if cache.mode == "off":
+        return openai.AsyncOpenAI(**kwargs)
+    if cache.mode == "replay":
+        # Nothing is sent in replay mode, so an api key is not needed
+        kwargs.setdefault("api_key", os.getenv("OPENAI_API_KEY") or "replay")
+    logger.info(f"Caching openai responses in {cache.directory} ({cache.mode})")
+    return CachedAsyncOpenAI(openai.AsyncOpenAI(**kwargs), cache)
@@ -0,0 +1,37 @@
+import copy
+from typing import Any
+
+from pydantic import BaseModel
+from pydantic.json_schema import DEFAULT_REF_TEMPLATE, GenerateJsonSchema
+
+# The max number of generated models kept around by each model factory
+MODEL_CACHE_SIZE = 128
+
+
+class CachedSchemaModel(BaseModel):
+    """
+    Base model for models generated at runtime and sent to openai as structured outputs.
+    The JSON schema of each model is only built once, and a copy is handed out on every
+    call after that, since the openai client edits the schema it is given in place.
+
+    Should be combined with a cached factory (i.e. 'functools.lru_cache'), so that the same
+    definition gives back the same class
+    """
+
+    @classmethod
+    def model_json_schema(
+        cls,
+        by_alias: bool = True,
+        ref_template: str = DEFAULT_REF_TEMPLATE,
+        schema_generator: type[GenerateJsonSchema] = GenerateJsonSchema,
+        mode: str = "validation",
+    ) -> dict[str, Any]:
+        args = (by_alias, ref_template, schema_generator, mode)
+        # Look in the class' own dict, so subclasses do not share their parent's schemas
+        schemas = cls.__dict__.get("__json_schemas__")
+        if schemas is None:
+            schemas = {}
+            setattr(cls, "__json_schemas__", schemas)
+        if args not in schemas:
+            schemas[args] = super().model_json_schema(*args)
+        return copy.deepcopy(schemas[args])
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from citi_mesh.config import Config
+
+
+@dataclass
+class ModerationMetrics:
+    """
+    Running counters of the moderation verdicts looked up in a ModerationCache
+    """
+
+    hits: int = 0
+    misses: int = 0
+    flagged: int = 0
+    requests: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "flagged": self.flagged,
+            "requests": self.requests,
+        }
+
+
+class ModerationCache:
+    """
+    A bounded cache of moderation verdicts, keyed by the content hash of the moderated string.
+    The least recently used verdicts are evicted once 'max_size' is reached.
+
+    Attributes:
+        - max_size(int): The max number of verdicts held at once
+
+    Usage:
+        cache = ModerationCache.get_instance()
+        flagged = cache.get(content_hash(source_string))
+        if flagged is None:
+            ...
+            cache.set(content_hash(source_string), flagged)
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, max_size: int = 100_000):
+        self.max_size = max_size
+        self.metrics = ModerationMetrics()
+        self._verdicts: OrderedDict[str, bool] = OrderedDict()
+
+    @classmethod
+    def get_instance(cls) -> "ModerationCache":
+        """
+        Returns the process wide cache, so verdicts carry over between injestions
+        """
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls(max_size=Config.moderation_cache_size)
+        return cls._instance
+
+    def get(self, hash_: str) -> Optional[bool]:
+        """
+        Returns whether the content was flagged, or None if it has not been moderated yet
+        """
+        flagged = self._verdicts.get(hash_)
+        if flagged is None:
+            self.metrics.misses += 1
+            return None
+        self.metrics.hits += 1
+        self._verdicts.move_to_end(hash_)
+        return flagged
+
+    def set(self, hash_: str, flagged: bool):
+        self._verdicts[hash_] = flagged
+        self._verdicts.move_to_end(hash_)
+        if flagged:
+            self.metrics.flagged += 1
+        while len(self._verdicts) > self.max_size:
+            self._verdicts.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._verdicts)
@@ -0,0 +1,210 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+from citi_mesh.config import Config
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Errors worth retrying, anything else is a problem with the request itself
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """
+    An async token bucket that refills continuously at 'rate_per_minute'
+
+    Attributes:
+        - rate_per_minute(float): The number of tokens added to the bucket each minute
+        - capacity(float): The max number of tokens the bucket can hold. Defaults to one
+            minute's worth
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """
+        Waits until 'amount' tokens are available, then takes them. Waiters are served in order.
+        """
+        # A request bigger than the bucket would never fit, so let it take the whole bucket
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+
+@dataclass
+class SchedulerMetrics:
+    """
+    Running counters of the requests sent through a LLMScheduler
+    """
+
+    requests: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    retries: int = 0
+    in_flight: int = 0
+    tokens: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "requests": self.requests,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "tokens": self.tokens,
+            "requests_per_second": self.succeeded / elapsed,
+            "tokens_per_minute": self.tokens / elapsed * 60,
+        }
+
+
+class LLMScheduler:
+    """
+    Schedules calls to openai under a concurrency cap, and request / token per minute limits.
+    Calls that fail with a retryable error (rate limits, timeouts, 5xx) are retried with
+    exponential backoff, honoring any 'retry-after' header.
+
+    Attributes:
+        - max_concurrency(int): The max number of calls in flight at once
+        - requests_per_minute(int): The max number of rate limited calls started per minute
+        - tokens_per_minute(int): The max number of estimated tokens sent per minute
+        - max_retries(int): The number of times a call is retried before failing
+        - backoff_base(float): The delay, in seconds, before the first retry
+        - backoff_max(float): The max delay, in seconds, between retries
+
+    Usage:
+        scheduler = LLMScheduler.get_instance()
+        completion = await scheduler.call(client.chat.completions.create, tokens=500, **kwargs)
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        requests_per_minute: int = 500,
+        tokens_per_minute: int = 200_000,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.metrics = SchedulerMetrics()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+
+    @classmethod
+    def get_instance(cls) -> "LLMScheduler":
+        """
+        Returns the process wide scheduler, created from the Citimesh Config, so that every
+        injestion shares the same limits
+        """
+        if not cls._instance:
+            with cls._lock:
+                if not cls._instance:
+                    cls._instance = cls(
+                        max_concurrency=Config.llm_max_concurrency,
+                        requests_per_minute=Config.llm_requests_per_minute,
+                        tokens_per_minute=Config.llm_tokens_per_minute,
+                        max_retries=Config.llm_max_retries,
+                        backoff_base=Config.llm_backoff_base,
+                        backoff_max=Config.llm_backoff_max,
+                    )
+        return cls._instance
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """
+        Private method to get the delay before a retry, preferring the server's 'retry-after'
+        """
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return min(float(retry_after), self.backoff_max)
+        except (TypeError, ValueError):
+            delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+            # Add jitter so that calls limited at the same time do not retry at the same time
+            return delay * random.uniform(0.5, 1.0)
+
+    async def call(
+        self,
+        func: Callable[..., Awaitable[T]],
+        *args,
+        tokens: int = 0,
+        rate_limited: bool = True,
+        **kwargs,
+    ) -> T:
+        """
+        Calls 'func(*args, **kwargs)' once there is capacity, retrying on retryable errors
+
+        args:
+            - func(Callable): The async function to call, i.e. 'client.chat.completions.create'
+            - tokens(int): The estimated number of tokens the call will use
+            - rate_limited(bool): If False, the call only counts against the concurrency cap.
+                Used for endpoints with their own limits, such as moderations
+        """
+        attempt = 0
+        while True:
+            if rate_limited:
+                await self._request_bucket.acquire(1)
+                await self._token_bucket.acquire(tokens)
+
+            async with self._semaphore:
+                self.metrics.requests += 1
+                self.metrics.in_flight += 1
+                try:
+                    result = await func(*args, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        self.metrics.failed += 1
+                        raise
+                    error = e
+                except Exception:
+                    self.metrics.failed += 1
+                    raise
+                else:
+                    self.metrics.succeeded += 1
+                    self.metrics.tokens += tokens
+                    return result
+                finally:
+                    self.metrics.in_flight -= 1
+
+            # Sleep outside of the semaphore, so other calls can use the slot
+            delay = self._backoff(attempt, error)
+            name = getattr(func, "__qualname__", func)
+            logger.warning(f"Retrying {name} in {delay:.1f}s after: {error}")
+            self.metrics.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
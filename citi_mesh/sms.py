@@ -0,0 +1,128 @@
+import os
+import threading
+from typing import Optional
+
+import httpx
+
+from citi_mesh.config import Config
+from citi_mesh.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class SMSDeliveryError(Exception):
+    """
+    Raised when Twilio does not accept a message
+    """
+
+    def __init__(self, to: str, status_code: int, detail: str):
+        self.to = to
+        self.status_code = status_code
+        self.message = f"Twilio refused message to {to} ({status_code}): {detail}"
+        super().__init__(self.message)
+
+
+class TwilioSender:
+    """
+    Long lived, async sender for the Twilio Messages API. Messages are posted with a single
+    pooled 'httpx.AsyncClient', so connections (and their TLS handshakes) are reused between
+    messages, and the event loop is never blocked while a message is sent.
+
+    Attributes:
+        - account_sid(str): The Twilio account to send from
+        - messaging_service_sid(str): The messaging service to send with
+        - base_url(str): The root of the Twilio API, can be swapped for a local stand-in
+
+    Usage:
+        sender = TwilioSender.get_instance()
+        await sender.send(to="+15555555555", body="Hello!")
+        ...
+        await sender.close()
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        account_sid: Optional[str],
+        messaging_service_sid: Optional[str],
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        base_url: str = "https://api.twilio.com",
+        max_connections: int = 10,
+        timeout: float = 10.0,
+    ):
+        self.account_sid = account_sid
+        self.messaging_service_sid = messaging_service_sid
+        self.base_url = base_url
+        # API keys are used in place of the account sid and auth token when given
+        auth = (username or account_sid, password) if password else None
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            auth=auth,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ),
+        )
+
+    @classmethod
+    def get_instance(cls) -> "TwilioSender":
+        """
+        Returns the process wide sender, built from the 'TWILIO_*' environment variables.
+        Authenticates with 'TWILIO_API_KEY' and 'TWILIO_API_SECRET' when both are set, and
+        with 'TWILIO_ACCOUNT_SID' and 'TWILIO_AUTH_TOKEN' otherwise, never a mix of the two
+        """
+        if not cls._instance:
+            with cls._lock:
+                if not cls._instance:
+                    api_key = os.getenv("TWILIO_API_KEY")
+                    api_secret = os.getenv("TWILIO_API_SECRET")
+                    if bool(api_key) != bool(api_secret):
+                        logger.warning(
+                            "Only one of TWILIO_API_KEY and TWILIO_API_SECRET is set, "
+                            "using TWILIO_AUTH_TOKEN instead"
+                        )
+                    if api_key and api_secret:
+                        username, password = api_key, api_secret
+                    else:
+                        username, password = None, os.getenv("TWILIO_AUTH_TOKEN")
+                    cls._instance = cls(
+                        account_sid=os.getenv("TWILIO_ACCOUNT_SID"),
+                        messaging_service_sid=os.getenv("TWILIO_MESSAGE_SERVICE_SID"),
+                        username=username,
+                        password=password,
+                        base_url=Config.twilio_base_url,
+                        max_connections=Config.twilio_max_connections,
+                        timeout=Config.twilio_timeout,
+                    )
+        return cls._instance
+
+    async def send(self, to: str, body: str) -> dict:
+        """
+        Sends a single message
+
+        args:
+            - to(str): The phone number to send to
+            - body(str): The text of the message
+
+        returns:
+            dict: The message resource Twilio gave back, i.e. its 'sid' and 'status'
+        """
+        response = await self._client.post(
+            f"/2010-04-01/Accounts/{self.account_sid}/Messages.json",
+            data={"To": to, "Body": body, "MessagingServiceSid": self.messaging_service_sid},
+        )
+        if response.status_code >= 400:
+            raise SMSDeliveryError(to, response.status_code, response.text)
+        return response.json()
+
+    async def close(self):
+        """
+        Closes the pooled connections, should be called when the app shuts down
+        """
+        await self._client.aclose()
+        with self._lock:
+            if type(self)._instance is self:
+                type(self)._instance = None
@@ -5,6 +5,7 @@ import os
 import googlemaps
 import openai
 
+from citi_mesh.config import Config
 from citi_mesh.tools._base import CitimeshTool
 
 SYSTEM_MESSAGE = """You are an expert at interpreting results from the Google Maps API.
@@ -30,7 +31,9 @@ class GoogleMapsDirectionsTool(CitimeshTool):
             **kwargs,
         )
 
-        self.gmaps = googlemaps.Client(key=os.environ["GOOGLE_MAPS_KEY"])
+        self.gmaps = googlemaps.Client(
+            key=os.environ["GOOGLE_MAPS_KEY"], base_url=Config.google_maps_base_url
+        )
         self.openai = openai.OpenAI()
 
     def _lookup_place(self, place_name):
@@ -1,8 +1,7 @@
-import os
 from datetime import datetime
 from typing import Callable
 
-from twilio.rest import Client
+from citi_mesh.sms import TwilioSender
 
 
 def json_serializer(o):
@@ -14,17 +13,9 @@ def json_serializer(o):
 
 async def send_message_twilio(to: str, message_func: Callable, *args, **kwargs):
     """
-    Helper function to use the Twilio API in order to send a message through their servers
+    Helper function to use the Twilio API in order to send a message through their servers.
+    Messages are sent with the shared 'TwilioSender', so connections are reused
     """
-    client = Client(
-        username=os.getenv("TWILIO_API_KEY", None),
-        password=os.getenv("TWILIO_API_SECRET", None),
-        account_sid=os.getenv("TWILIO_ACCOUNT_SID"),
-    )
     message = await message_func(*args, **kwargs)
 
-    client.messages.create(
-        to=to,
-        body=message,
-        messaging_service_sid=os.getenv("TWILIO_MESSAGE_SERVICE_SID"),
-    )
+    await TwilioSender.get_instance().send(to=to, body=message)
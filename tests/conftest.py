@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from citi_mesh.database import _tables  # noqa: F401, registers every table on the metadata
+from citi_mesh.database._base import SQLTable
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def session_maker(tmp_path):
+    """
+    Makes sessions on an empty SQLite database, with every table created
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLTable.metadata.create_all)
+    yield async_sessionmaker(bind=engine)
+    await engine.dispose()
+
+
+@pytest.fixture
+async def session(session_maker):
+    async with session_maker() as session:
+        yield session
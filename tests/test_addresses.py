@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import select
+
+from citi_mesh.database import _tables
+from citi_mesh.database._models import Address, Resource
+
+pytestmark = pytest.mark.anyio
+
+
+def _resource(street: str) -> Resource:
+    return Resource(
+        tenant_id="tenant",
+        name="Pantry",
+        description="Free food",
+        address=Address(
+            street=street, city="New York", state="NY", zip_code="10001", google_place_id="P"
+        ),
+    )
+
+
+async def _address_ids(session) -> list[str]:
+    return list((await session.execute(select(_tables.ResourceTable.address_id))).scalars())
+
+
+async def test_upsert_many_shares_one_address_per_building(session):
+    results = await Resource.upsert_many(
+        session, [_resource("1 Main Street"), _resource("1 Main St.")]
+    )
+
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert len(set(await _address_ids(session))) == 1
+
+
+async def test_upsert_links_to_a_saved_address(session):
+    await Resource.upsert_many(session, [_resource("1 Main Street")])
+    await _resource("1 main st").upsert(session)
+
+    assert len(set(await _address_ids(session))) == 1
+
+
+async def test_claim_keys_uses_the_row_of_a_concurrent_writer(session_maker, monkeypatch):
+    async with session_maker() as session:
+        first = await Address.claim_keys(session, [_resource("1 Main Street").address])
+        await session.commit()
+
+    # The second writer looked its key up before the first one saved it
+    get_ids_by_key = Address.get_ids_by_key.__func__
+    calls = []
+
+    async def stale_get_ids_by_key(cls, session, keys):
+        calls.append(keys)
+        return {} if len(calls) == 1 else await get_ids_by_key(cls, session, keys)
+
+    monkeypatch.setattr(Address, "get_ids_by_key", classmethod(stale_get_ids_by_key))
+    async with session_maker() as session:
+        second = await Address.claim_keys(session, [_resource("1 main st").address])
+
+    assert second == first
+    assert len(calls) == 2
+
+
+async def test_edited_address_does_not_change_shared_row(session):
+    first, second = _resource("1 Main Street"), _resource("1 Main Street")
+    await Resource.upsert_many(session, [first, second])
+
+    address = {**first.address.model_dump(), "street": "9 Elm St", "normalized_key": None}
+    edited = Resource.model_validate({**first.model_dump(), "address": address})
+    await edited.upsert(session)
+
+    streets = list((await session.execute(select(_tables.AddressTable.street))).scalars())
+    assert sorted(streets) == ["1 Main Street", "9 Elm St"]
@@ -0,0 +1,104 @@
+from datetime import datetime
+
+import pytest
+
+from citi_mesh.database._exceptions import InvalidCursor
+from citi_mesh.database._models import Resource, Tenant
+
+pytestmark = pytest.mark.anyio
+
+CREATED_AT = datetime(2024, 1, 1)
+
+
+async def _add_resources(session, count: int, **fields) -> list[str]:
+    """
+    Inserts 'count' resources in repository 'repo', all created at the same time
+    """
+    resources = [
+        Resource(
+            tenant_id="tenant",
+            repository_id="repo",
+            name=f"Pantry {i}",
+            description="Free food",
+            created_at=CREATED_AT,
+            **fields,
+        )
+        for i in range(count)
+    ]
+    await Resource.insert_many(session, resources)
+    await session.commit()
+    return sorted(resource.id for resource in resources)
+
+
+async def test_list_page_walks_tied_created_at_by_id(session):
+    ids = await _add_resources(session, 5)
+    # Rows from another repository must not leak into the pages
+    await Resource.insert_many(
+        session, [Resource(tenant_id="tenant", repository_id="other", name="x", description="x")]
+    )
+    await session.commit()
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = await Resource.list_page(
+            session, filters={"repository_id": "repo"}, limit=2, cursor=cursor
+        )
+        pages.append([resource.id for resource in page])
+        if cursor is None:
+            break
+
+    assert pages == [ids[0:2], ids[2:4], ids[4:5]]
+
+
+async def test_list_page_has_no_cursor_on_an_exact_last_page(session):
+    ids = await _add_resources(session, 2)
+
+    page, cursor = await Resource.list_page(session, filters={"repository_id": "repo"}, limit=2)
+
+    assert [resource.id for resource in page] == ids
+    assert cursor is None
+
+
+async def test_list_page_rejects_a_malformed_cursor(session):
+    with pytest.raises(InvalidCursor):
+        await Resource.list_page(session, cursor="not a cursor")
+
+
+async def test_stream_yields_tied_created_at_by_id(session):
+    ids = await _add_resources(session, 5)
+
+    streamed = [
+        resource.id
+        async for resource in Resource.stream(
+            session, filters={"repository_id": "repo"}, batch_size=2
+        )
+    ]
+
+    assert streamed == ids
+
+
+def _tenant(name: str) -> Tenant:
+    return Tenant(name=name, display_name=name, registered_number=name, subdomain=name)
+
+
+async def test_upsert_many_rejects_only_the_bad_instance(session):
+    good, clash = _tenant("good"), _tenant("taken")
+    await _tenant("taken").upsert(session)
+
+    results = await Tenant.upsert_many(session, [good, clash])
+
+    assert [result["status"] for result in results] == ["ok", "error"]
+    assert "UNIQUE" in results[1]["detail"]
+    names = [tenant.name for tenant in (await Tenant.list_page(session))[0]]
+    assert sorted(names) == ["good", "taken"]
+
+
+async def test_upsert_many_updates_rows_that_were_loaded_before_a_failed_flush(session):
+    saved = _tenant("saved")
+    await saved.upsert(session)
+
+    saved.display_name = "renamed"
+    results = await Tenant.upsert_many(session, [saved, _tenant("new"), _tenant("new")])
+
+    assert [result["status"] for result in results] == ["ok", "ok", "error"]
+    assert (await Tenant.from_id(session, saved.id)).display_name == "renamed"
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from citi_mesh.coalescing import InboundCoalescer
+from citi_mesh.dispatch import SMSDispatchQueue
+
+pytestmark = pytest.mark.anyio
+
+
+class GatedSender:
+    """
+    Stands in for the TwilioSender. Sends wait on 'gate', and are kept as '(to, body)'
+    """
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.sent = []
+
+    async def send(self, to: str, body: str):
+        await self.gate.wait()
+        self.sent.append((to, body))
+        return body
+
+
+@pytest.fixture
+async def queue():
+    queue = SMSDispatchQueue(messages_per_second=1000, workers=2, sender=GatedSender())
+    await queue.start()
+    yield queue
+    queue.sender.gate.set()
+    await queue.stop(drain_seconds=1)
+
+
+class Turns:
+    """
+    Starts turns on the queue, with replies that are only ready once 'answer' is called
+    """
+
+    def __init__(self, queue: SMSDispatchQueue):
+        self.queue = queue
+        self.texts = []
+        self.replies = []
+
+    def __call__(self, phone: str, text: str):
+        self.texts.append(text)
+        self.replies.append(self.queue.submit(phone, asyncio.get_running_loop().create_future()))
+        return self.replies[-1]
+
+    def answer(self, index: int = -1):
+        self.replies[index].body.set_result(f"re: {self.texts[index]}")
+        return self.replies[index].delivered
+
+
+async def test_messages_in_the_window_are_one_turn(queue):
+    turns = Turns(queue)
+    coalescer = InboundCoalescer(start_turn=turns, window_ms=20)
+
+    coalescer.receive("+1", "a")
+    await asyncio.sleep(0.01)
+    coalescer.receive("+1", "b")
+    coalescer.receive("+2", "c")
+    await asyncio.sleep(0.05)
+    await asyncio.gather(turns.answer(0), turns.answer(1))
+
+    assert sorted(turns.texts) == ["a\nb", "c"]
+    assert coalescer.metrics.merged == 1
+    assert coalescer._turns == {}
+
+
+async def test_message_during_a_turn_cancels_and_restarts_it(queue):
+    turns = Turns(queue)
+    coalescer = InboundCoalescer(start_turn=turns, window_ms=10)
+
+    coalescer.receive("+1", "a")
+    await asyncio.sleep(0.03)
+    coalescer.receive("+1", "b")
+    await asyncio.sleep(0.03)
+
+    assert turns.texts == ["a", "a\nb"]
+    assert turns.replies[0].cancelled
+    await turns.answer()
+    assert queue.sender.sent == [("+1", "re: a\nb")]
+    assert coalescer.metrics.restarted == 1
+    assert coalescer._turns == {}
+
+
+async def test_message_after_the_reply_is_sending_starts_a_new_turn(queue):
+    turns = Turns(queue)
+    coalescer = InboundCoalescer(start_turn=turns, window_ms=10)
+    queue.sender.gate.clear()
+
+    coalescer.receive("+1", "a")
+    await asyncio.sleep(0.03)
+    turns.answer()
+    await asyncio.sleep(0.01)
+    assert turns.replies[0].sending
+    coalescer.receive("+1", "b")
+    await asyncio.sleep(0.03)
+    queue.sender.gate.set()
+    await turns.answer()
+
+    assert turns.texts == ["a", "b"]
+    assert queue.sender.sent == [("+1", "re: a"), ("+1", "re: b")]
+    assert coalescer.metrics.restarted == 0
@@ -0,0 +1,13 @@
+from sqlalchemy.engine import make_url
+
+from citi_mesh.config import CitimeshConfig
+
+
+def test_sql_server_password_survives_the_url(monkeypatch):
+    monkeypatch.delenv("DEFAULT_DATABASE_CONNECTION_URL", raising=False)
+    config = CitimeshConfig(db_password="p@ss#w&rd%}")
+
+    url = make_url(config.default_database_connection_url)
+
+    assert list(url.query) == ["odbc_connect"]
+    assert "Pwd={p@ss#w&rd%}}};" in url.query["odbc_connect"]
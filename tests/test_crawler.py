@@ -0,0 +1,88 @@
+import asyncio
+
+import httpx
+import pytest
+
+from citi_mesh import injestors
+from citi_mesh.chunking import TokenChunker
+from citi_mesh.database._models import Repository
+from citi_mesh.injestors import CrawlerInjestor
+
+pytestmark = pytest.mark.anyio
+
+
+def _page(*links: str) -> str:
+    return "<main><p>Some text</p>" + "".join(f'<a href="{link}">x</a>' for link in links)
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """
+    Serves the given pages to every 'httpx.AsyncClient' the injestors make. Pages are given as
+    path -> (status, html, seconds to wait before answering)
+    """
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    client_cls = httpx.AsyncClient
+
+    def _serve(pages: dict[str, tuple[int, str, float]]):
+        requested = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            requested.append(request.url.path)
+            status, html, delay = pages[request.url.path]
+            await asyncio.sleep(delay)
+            return httpx.Response(status, headers={"content-type": "text/html"}, text=html)
+
+        monkeypatch.setattr(
+            injestors.httpx,
+            "AsyncClient",
+            lambda **kwargs: client_cls(transport=httpx.MockTransport(handler), **kwargs),
+        )
+        return requested
+
+    return _serve
+
+
+def _crawler(**kwargs) -> CrawlerInjestor:
+    repo = Repository(tenant_id="tenant", name="repo", display_name="Repo", tool_description="")
+    crawler = CrawlerInjestor(repo=repo, url="http://example.org/", **kwargs)
+    crawler.chunker = TokenChunker(target_tokens=1000)
+    crawler.unchanged_hashes = set()
+    return crawler
+
+
+async def test_failed_fetch_keeps_the_previous_page(serve):
+    requested = serve(
+        {"/": (200, _page("/down"), 0), "/down": (503, "", 0), "/child": (200, _page(), 0)}
+    )
+    crawler = _crawler()
+    previous = {"etag": None, "last_modified": None, "content_hashes": ["abc"], "links": []}
+    crawler._previous_pages = {
+        "http://example.org/down": {**previous, "links": ["http://example.org/child"]}
+    }
+
+    [piece async for piece in crawler._iter_source()]
+
+    assert "abc" in crawler.unchanged_hashes
+    assert crawler._pages["http://example.org/down"]["content_hashes"] == ["abc"]
+    # Links of the failed page are still followed from its previous record
+    assert "/child" in requested
+
+
+async def test_max_pages_cuts_off_at_the_same_pages(serve):
+    # '/a' answers last, but its links still come before the links of '/b'
+    serve(
+        {
+            "/": (200, _page("/a", "/b"), 0),
+            "/a": (200, _page("/a1", "/a2"), 0.05),
+            "/b": (200, _page("/b1", "/b2"), 0),
+            **{f"/{name}": (200, _page(), 0) for name in ("a1", "a2", "b1", "b2")},
+        }
+    )
+    crawler = _crawler(max_pages=5)
+
+    [piece async for piece in crawler._iter_source()]
+
+    assert sorted(crawler._pages) == [
+        f"http://example.org/{path}" for path in ("", "a", "a1", "a2", "b")
+    ]
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from citi_mesh.dispatch import ACK, REPLY, SMSDispatchQueue
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeSender:
+    """
+    Stands in for the TwilioSender, keeping each message sent as '(to, body)'
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, to: str, body: str):
+        self.sent.append((to, body))
+        return body
+
+
+def _queue(workers: int = 4) -> SMSDispatchQueue:
+    return SMSDispatchQueue(messages_per_second=1000, workers=workers, sender=FakeSender())
+
+
+async def test_messages_to_a_phone_are_sent_in_submit_order():
+    queue = _queue()
+    await queue.start()
+    first_body = asyncio.get_running_loop().create_future()
+
+    first = queue.submit("+1", first_body)
+    second = queue.submit("+1", "second")
+    other = queue.submit("+2", "other")
+    await other.delivered
+    # The second message is ready, but waits on the first
+    assert queue.sender.sent == [("+2", "other")]
+
+    first_body.set_result("first")
+    await asyncio.gather(first.delivered, second.delivered)
+    await queue.stop(drain_seconds=0)
+
+    assert queue.sender.sent == [("+2", "other"), ("+1", "first"), ("+1", "second")]
+
+
+async def test_acks_are_sent_before_replies_across_phones():
+    queue = _queue(workers=1)
+    queue.submit("+1", "reply 1", priority=REPLY)
+    queue.submit("+2", "reply 2", priority=REPLY)
+    ack = queue.submit("+3", "ack 3", priority=ACK)
+
+    await queue.start()
+    await queue.stop(drain_seconds=1)
+
+    assert ack.delivered.done()
+    assert queue.sender.sent == [("+3", "ack 3"), ("+1", "reply 1"), ("+2", "reply 2")]
+
+
+async def test_late_answer_is_sent_after_its_ack():
+    queue = _queue()
+    await queue.start()
+    answer_body = asyncio.get_running_loop().create_future()
+
+    async def ack():
+        return "working on it"
+
+    answer = queue.submit_with_ack("+1", answer_body, ack=ack, ack_after=0.01)
+    await asyncio.sleep(0.05)
+    answer_body.set_result("answer")
+    await answer.delivered
+    await queue.stop(drain_seconds=0)
+
+    assert queue.sender.sent == [("+1", "working on it"), ("+1", "answer")]
+
+
+async def test_quick_answer_skips_the_ack():
+    queue = _queue()
+    await queue.start()
+    acks = []
+
+    async def ack():
+        acks.append(1)
+        return "working on it"
+
+    async def answer():
+        return "answer"
+
+    message = queue.submit_with_ack("+1", answer(), ack=ack, ack_after=1)
+    await message.delivered
+    await queue.stop(drain_seconds=1)
+
+    assert acks == []
+    assert queue.sender.sent == [("+1", "answer")]
+    assert queue.metrics.cancelled == 1
+
+
+async def test_cancelled_message_does_not_hold_up_the_phone():
+    queue = _queue()
+    await queue.start()
+
+    dropped = queue.submit("+1", asyncio.get_running_loop().create_future())
+    kept = queue.submit("+1", "kept")
+    dropped.cancel()
+    await kept.delivered
+    await queue.stop(drain_seconds=0)
+
+    assert queue.sender.sent == [("+1", "kept")]
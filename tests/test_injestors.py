@@ -0,0 +1,121 @@
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from citi_mesh import injestors
+from citi_mesh.database import _tables
+from citi_mesh.database._models import Repository, Resource, ResourceType, Source
+from citi_mesh.injestors import Injestor
+from citi_mesh.moderation import ModerationCache
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeOpenAI:
+    """
+    Stands in for openai. Nothing is flagged, and each entry (a JSON row) is parsed into one
+    resource named by its 'name'. Names are kept in 'parsed'
+    """
+
+    def __init__(self):
+        self.parsed = []
+        self.moderations = SimpleNamespace(create=self._moderate)
+        self.beta = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse))
+        )
+
+    async def _moderate(self, input, **kwargs):
+        return SimpleNamespace(results=[SimpleNamespace(flagged=False) for _ in input])
+
+    async def _parse(self, messages, response_format, **kwargs):
+        resources = [
+            {"name": json.loads(row)["name"], "description": "d", "source_index": int(index)}
+            for index, row in re.findall(r"^\[(\d+)\] (.*)$", messages[-1]["content"], re.M)
+        ]
+        self.parsed.extend(resource["name"] for resource in resources)
+        parsed = response_format(resources=resources)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(parsed=parsed))])
+
+
+class ListInjestor(Injestor):
+    __source_type__ = "list"
+
+    def __init__(self, repo: Repository, rows: list[dict]):
+        super().__init__(repo=repo, moderation_cache=ModerationCache(max_size=100))
+        self.client = FakeOpenAI()
+        self.details = "rows"
+        self.rows = rows
+
+    async def _iter_source(self):
+        for row in self.rows:
+            yield json.dumps(row, separators=(",", ":"))
+
+
+@pytest.fixture
+def repo(monkeypatch) -> Repository:
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    return Repository(
+        tenant_id="tenant",
+        name="repo",
+        display_name="Repo",
+        tool_description="d",
+        resource_types=[ResourceType(name="food", display_name="Food")],
+    )
+
+
+async def test_each_entry_is_hashed_once(repo, monkeypatch):
+    content_hash = injestors.content_hash
+    hashed = []
+
+    def counting_content_hash(source_string):
+        hashed.append(source_string)
+        return content_hash(source_string)
+
+    monkeypatch.setattr(injestors, "content_hash", counting_content_hash)
+    injestor = ListInjestor(repo, [{"name": f"r{i}"} for i in range(5)])
+
+    resources = await injestor.pull_resources(None, debug=True, chunk_size=2)
+
+    assert sorted(resource.name for resource in resources) == [f"r{i}" for i in range(5)]
+    assert len(hashed) == 5
+
+
+async def _live_names(session) -> list[str]:
+    stmt = select(_tables.ResourceTable.name).where(_tables.ResourceTable.retired_at.is_(None))
+    return sorted((await session.execute(stmt)).scalars())
+
+
+async def test_pull_retires_resources_of_removed_entries(repo, session):
+    rows = [{"name": f"r{i}"} for i in range(3)]
+    await ListInjestor(repo, rows).pull_resources(session, chunk_size=2)
+
+    injestor = ListInjestor(repo, [rows[0], rows[2], {"name": "r3"}])
+    await injestor.pull_resources(session, chunk_size=2)
+
+    # Only the new entry is parsed again
+    assert injestor.client.parsed == ["r3"]
+    assert await _live_names(session) == ["r0", "r2", "r3"]
+    hashes = await injestor.source.get_content_hashes(session)
+    assert len(hashes) == 3
+
+
+async def test_retire_keeps_resources_linked_to_remaining_content(session):
+    source = Source(repository_id="repo", source_type="list", details="rows")
+    shared, only_removed = (
+        Resource(tenant_id="tenant", name=name, description="d") for name in ("shared", "gone")
+    )
+    await Resource.insert_many(session, [shared, only_removed])
+    await source.add_content_hashes(
+        session, [("a", shared.id), ("b", shared.id), ("c", only_removed.id), ("d", None)]
+    )
+    known_hashes = await source.get_content_hashes(session)
+
+    retired = await source.retire_content_hashes(session, {"a", "c", "d"}, known_hashes)
+    await session.commit()
+
+    assert retired == 1
+    assert await _live_names(session) == ["shared"]
+    assert set(await source.get_content_hashes(session)) == {"b"}
@@ -0,0 +1,84 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from citi_mesh import jobs
+from citi_mesh.config import Config
+from citi_mesh.database._models import IngestionJob, Repository
+from citi_mesh.injestors import IngestionProgress
+from citi_mesh.jobs import IngestionJobQueue
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def queue(session_maker, monkeypatch):
+    @asynccontextmanager
+    async def get_session():
+        async with session_maker() as session:
+            yield session
+
+    monkeypatch.setattr(jobs, "get_session", get_session)
+    return IngestionJobQueue(workers=1)
+
+
+async def _add_job(session_maker, **values) -> IngestionJob:
+    values = {"repository_id": "missing", "source_type": "webpage", "details": "x", **values}
+    job = IngestionJob(**values)
+    async with session_maker() as session:
+        session.add(job.to_orm())
+        await session.commit()
+    return job
+
+
+async def _load(session_maker, job_id: str) -> IngestionJob:
+    async with session_maker() as session:
+        return await IngestionJob.from_id(session, job_id)
+
+
+async def test_job_that_can_not_start_is_failed(queue, session_maker):
+    job = await _add_job(session_maker)
+
+    await queue._run(job.id)
+
+    job = await _load(session_maker, job.id)
+    assert job.status == "failed"
+    assert job.error
+
+
+async def test_sweep_fails_jobs_out_of_attempts(queue, session_maker):
+    stale = datetime.now(timezone.utc) - timedelta(seconds=Config.ingestion_stale_seconds + 1)
+    exhausted = await _add_job(
+        session_maker,
+        status="running",
+        heartbeat_at=stale,
+        attempts=Config.ingestion_max_attempts,
+    )
+    retried = await _add_job(session_maker, status="running", heartbeat_at=stale, attempts=1)
+
+    await queue._sweep_once()
+
+    assert (await _load(session_maker, exhausted.id)).status == "failed"
+    assert queue._queued == {retried.id}
+
+
+async def test_job_with_failed_chunks_is_partial(queue, session_maker, monkeypatch):
+    async with session_maker() as session:
+        repo = Repository(tenant_id="tenant", name="repo", display_name="R", tool_description="d")
+        await repo.upsert(session)
+    job = await _add_job(session_maker, repository_id=repo.id)
+
+    class Injestor:
+        progress = IngestionProgress(chunks_failed=2)
+
+        async def pull_resources(self, session, **kwargs):
+            pass
+
+    monkeypatch.setattr(queue, "_build_injestor", lambda job, repo: Injestor())
+
+    await queue._run(job.id)
+
+    job = await _load(session_maker, job.id)
+    assert job.status == "partial"
+    assert "2 chunks" in job.error
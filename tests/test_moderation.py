@@ -0,0 +1,9 @@
+from citi_mesh.moderation import ModerationCache
+
+
+def test_get_instance_reuses_empty_cache():
+    ModerationCache._instance = None
+    cache = ModerationCache.get_instance()
+
+    assert len(cache) == 0
+    assert ModerationCache.get_instance() is cache
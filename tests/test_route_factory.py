@@ -0,0 +1,26 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from citi_mesh.database._models import Tenant
+from citi_mesh.database.route_factory import RouteFactory
+from citi_mesh.database.session import get_session_dependency
+
+
+def test_oversized_batch_is_rejected_before_it_is_saved(monkeypatch):
+    app = FastAPI()
+    RouteFactory(app, max_batch_size=2).add_routes(Tenant)
+
+    async def upsert_many(session, instances):
+        raise AssertionError("An oversized batch should not be saved")
+
+    async def no_session():
+        yield None
+
+    monkeypatch.setattr(Tenant, "upsert_many", upsert_many)
+    app.dependency_overrides[get_session_dependency] = no_session
+    tenant = {"name": "t", "display_name": "T", "registered_number": "+1", "subdomain": "t"}
+
+    response = TestClient(app).post("/tenant/batch", json=[tenant] * 3)
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "too_long"